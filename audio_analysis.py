@@ -0,0 +1,129 @@
+import time
+
+import numpy as np
+
+from ffmpeg_pipe import FfmpegPipe
+from job_control import IO_BOUND, JobControl
+from range_suggestions import suggest_ranges
+
+# Plenty for loudness, and decoding to 8 kHz mono keeps the pipe small
+SAMPLE_RATE = 8000
+WINDOW_SECONDS = 0.5
+# Windows analysed per read, about two minutes of audio
+BLOCK_WINDOWS = 240
+SILENCE_DB = -90.0
+# Without an explicit threshold, the loudest few percent of the event count as highlights
+DEFAULT_TOP_PERCENT = 3
+MIN_THRESHOLD_ABOVE_MEDIAN_DB = 6
+
+
+class LoudnessProfile:
+    def __init__(self, times, rms_db, peak_db, window=WINDOW_SECONDS):
+        self.times = times
+        self.rms_db = rms_db
+        self.peak_db = peak_db
+        self.window = window
+
+    @property
+    def duration(self):
+        return float(self.times[-1] + self.window) if len(self.times) else 0.0
+
+
+def _to_db(values):
+    return np.maximum(20 * np.log10(np.maximum(values, 1e-9)), SILENCE_DB)
+
+
+def window_loudness(samples, window_samples):
+    """Returns (rms dB, peak dB) for each window of int16 samples, the last window may be shorter."""
+    samples = samples.astype(np.float32) / 32768
+    full_windows = len(samples) // window_samples
+    windows = samples[:full_windows * window_samples].reshape(full_windows, window_samples)
+    rms = np.sqrt(np.mean(windows * windows, axis=1))
+    peak = np.max(np.abs(windows), axis=1) if full_windows else np.empty(0, dtype=np.float32)
+
+    remainder = samples[full_windows * window_samples:]
+    if len(remainder):
+        rms = np.append(rms, np.sqrt(np.mean(remainder * remainder)))
+        peak = np.append(peak, np.max(np.abs(remainder)))
+    return _to_db(rms), _to_db(peak)
+
+
+class AudioHighlightJob:
+    """Finds loud moments such as crowd noise, whistles and applause by streaming the audio through NumPy."""
+
+    # Decoding audio only is cheap, most of the time goes into reading the file
+    resource = IO_BOUND
+
+    def __init__(self, input_file=None, clip_dir=None, threshold_db=None, max_ranges=20, control=None):
+        self.input_file = input_file
+        self.clip_dir = clip_dir
+        self.threshold_db = threshold_db
+        self.max_ranges = max_ranges
+        self.control = control or JobControl()
+        self.profile = None
+        self.highlights = []
+
+    def cancel(self):
+        self.control.cancel()
+
+    def run(self, progress_handler=None, success_handler=None, error_handler=None, message_handler=None):
+        if message_handler:
+            message_handler("Analysing audio..")
+
+        self.profile = self.analyze(progress_handler)
+        if self.profile is None or self.control.cancelled:
+            if error_handler:
+                error_handler("Audio analysis failed")
+            return
+
+        threshold = self.threshold_db
+        if threshold is None:
+            threshold = self.default_threshold(self.profile.rms_db)
+        self.highlights = suggest_ranges(self.profile.times, self.profile.rms_db, threshold, self.profile.window,
+                                         self.profile.duration, max_ranges=self.max_ranges, name_prefix="loud")
+
+        if message_handler:
+            message_handler(f"Found {len(self.highlights)} loud moments above {threshold:.1f} dB")
+        if success_handler:
+            success_handler()
+
+    @staticmethod
+    def default_threshold(rms_db):
+        if not len(rms_db):
+            return 0.0
+        return max(np.percentile(rms_db, 100 - DEFAULT_TOP_PERCENT),
+                   np.median(rms_db) + MIN_THRESHOLD_ABOVE_MEDIAN_DB)
+
+    def analyze(self, progress_handler=None):
+        """Streams 8 kHz mono PCM out of FFmpeg and returns the loudness of every window."""
+        pipe = FfmpegPipe(["-vn", "-sn", "-dn", "-map", "0:a:0", "-ac", "1", "-ar", str(SAMPLE_RATE), "-f", "s16le"],
+                          input_file=self.input_file, clip_dir=self.clip_dir, control=self.control,
+                          log_name="audio_analysis")
+
+        window_samples = int(SAMPLE_RATE * WINDOW_SECONDS)
+        buffer = np.empty(BLOCK_WINDOWS * window_samples, dtype="<i2")
+        rms_blocks = []
+        peak_blocks = []
+        samples_read = 0
+
+        start = time.perf_counter()
+        for byte_count in pipe.read_into(buffer):
+            samples = buffer[:byte_count // 2]
+            rms_db, peak_db = window_loudness(samples, window_samples)
+            rms_blocks.append(rms_db)
+            peak_blocks.append(peak_db)
+            samples_read += len(samples)
+
+            if progress_handler and pipe.duration > 0:
+                seconds = samples_read / SAMPLE_RATE
+                elapsed = time.perf_counter() - start
+                speed = seconds / elapsed if elapsed > 0 else 0
+                eta = (pipe.duration - seconds) / speed if speed else None
+                progress_handler(min(seconds / pipe.duration * 100, 100), round(speed, 1), eta, None)
+
+        if pipe.returncode != 0:
+            return None
+
+        rms_db = np.concatenate(rms_blocks) if rms_blocks else np.empty(0)
+        peak_db = np.concatenate(peak_blocks) if peak_blocks else np.empty(0)
+        return LoudnessProfile(np.arange(len(rms_db)) * WINDOW_SECONDS, rms_db, peak_db)
@@ -0,0 +1,278 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+import probe_service
+from ffmpeg_binaries import get_ffmpeg_path
+from hardware_encoder_util import get_encoder_capabilities
+from jobs import ConcatJob, ProcessJob
+from utils import get_cache_dir
+
+# name: (chapters, seconds per chapter)
+CLIP_SETS = {
+    "small": (3, 20),
+    "medium": (6, 60),
+    "large": (12, 120),
+}
+DEFAULT_RESOLUTION = "1280x720"
+DEFAULT_FRAME_RATE = 30
+# Fixed so generated clips are identical from run to run
+RECORDING_START = datetime(2024, 1, 1, 12, 0, 0, tzinfo=timezone.utc)
+
+
+def clip_set_dir(root, name, resolution, frame_rate):
+    return os.path.join(root, f"{name}_{resolution}_{frame_rate}")
+
+
+def generate_clip_set(directory, chapters, chapter_duration, resolution=DEFAULT_RESOLUTION,
+                      frame_rate=DEFAULT_FRAME_RATE):
+    """Writes GoPro style chapters (GX01xxxx.MP4, GX02xxxx.MP4, ..) of a test pattern with a tone."""
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for chapter in range(1, chapters + 1):
+        path = os.path.join(directory, f"GX{chapter:02d}0001.MP4")
+        paths.append(path)
+        if os.path.exists(path):
+            continue
+
+        creation_time = RECORDING_START + timedelta(seconds=(chapter - 1) * chapter_duration)
+        partial_path = path + ".partial.mp4"
+        subprocess.run([
+            get_ffmpeg_path(), "-hide_banner", "-loglevel", "error",
+            "-f", "lavfi", "-i", f"testsrc2=size={resolution}:rate={frame_rate}:duration={chapter_duration}",
+            "-f", "lavfi", "-i", f"sine=frequency={220 * chapter}:sample_rate=48000:duration={chapter_duration}",
+            # GoPro cameras write a keyframe every second
+            "-c:v", "libx264", "-preset", "ultrafast", "-g", str(frame_rate), "-pix_fmt", "yuv420p",
+            "-c:a", "aac", "-b:a", "128k",
+            "-metadata", f"creation_time={creation_time.strftime('%Y-%m-%dT%H:%M:%S.000000Z')}",
+            partial_path, "-y"
+        ], check=True)
+        os.replace(partial_path, path)
+    return paths
+
+
+class ProcessCounter:
+    """Counts the ffmpeg and ffprobe processes started while it is active, however they are launched."""
+
+    def __init__(self):
+        self.counts = {"ffmpeg": 0, "ffprobe": 0}
+        self._lock = threading.Lock()
+        self._original_popen = None
+
+    def __enter__(self):
+        counter = self
+        self._original_popen = original_popen = subprocess.Popen
+
+        class CountingPopen(original_popen):
+            def __init__(self, args, *popen_args, **kwargs):
+                counter.record(args)
+                super().__init__(args, *popen_args, **kwargs)
+
+        subprocess.Popen = CountingPopen
+        return self
+
+    def __exit__(self, *exc_info):
+        subprocess.Popen = self._original_popen
+
+    def record(self, args):
+        if isinstance(args, (str, bytes)):
+            args = [args]
+        for arg in args:
+            # Skip launch prefixes such as nice and ionice
+            name = os.path.splitext(os.path.basename(str(arg)))[0].lower()
+            if name in self.counts:
+                with self._lock:
+                    self.counts[name] += 1
+                return
+
+
+def read_io_counters():
+    # Linux adds the I/O of finished child processes to the parent, so this covers FFmpeg as well
+    try:
+        with open("/proc/self/io") as f:
+            return {key: int(value) for key, value in (line.split(": ") for line in f.read().splitlines())}
+    except OSError:
+        return None
+
+
+def peak_rss_kb():
+    # Both are high-water marks for the whole process, run_isolated_scenario gives every scenario a new process
+    if resource is None:
+        return None
+    scale = 1024 if sys.platform == "darwin" else 1  # ru_maxrss is in bytes on macOS, kilobytes elsewhere
+    return {
+        "self": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // scale,
+        "children": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss // scale,
+    }
+
+
+class SpeedRecorder:
+    def __init__(self):
+        self.speeds = []
+
+    def handle_progress(self, percentage, speed, eta, estimated_filesize):
+        if speed:
+            self.speeds.append(speed)
+
+    def summary(self):
+        if not self.speeds:
+            return {"last": None, "max": None, "mean": None}
+        return {
+            "last": self.speeds[-1],
+            "max": max(self.speeds),
+            "mean": sum(self.speeds) / len(self.speeds),
+        }
+
+
+def scenario_jobs(clip_dir, output_dir, total_duration):
+    """The pipelines that are measured, as (name, job factory) pairs."""
+    start = f"{total_duration * 0.25:.3f}"
+    end = f"{total_duration * 0.75:.3f}"
+    concat_output = os.path.join(output_dir, "concatenated_output.mp4")
+    return [
+        ("concat", lambda: ConcatJob(clip_dir, concat_output)),
+        ("trim_copy", lambda: ProcessJob(None, os.path.join(output_dir, "trim_copy.mp4"), start, end, False, False,
+                                         False, clip_dir=clip_dir)),
+        ("trim_copy_concatenated", lambda: ProcessJob(concat_output, os.path.join(output_dir, "trim_input.mp4"),
+                                                      start, end, False, False, False)),
+        ("smart_cut", lambda: ProcessJob(None, os.path.join(output_dir, "smart_cut.mp4"), start, end, False, False,
+                                         False, clip_dir=clip_dir, smart_cut=True)),
+        ("trim_encode", lambda: ProcessJob(None, os.path.join(output_dir, "trim_encode.mp4"), start, end, False,
+                                           True, False, clip_dir=clip_dir)),
+    ]
+
+
+def run_scenario(name, job, output_file=None):
+    outcome = {}
+    speed = SpeedRecorder()
+    io_before = read_io_counters()
+
+    with ProcessCounter() as processes:
+        start = time.perf_counter()
+        job.run(progress_handler=speed.handle_progress,
+                success_handler=lambda: outcome.setdefault("success", True),
+                error_handler=lambda message="Failed": outcome.setdefault("error", message),
+                message_handler=lambda message: None)
+        wall_time = time.perf_counter() - start
+
+    io_after = read_io_counters()
+    result = {
+        "scenario": name,
+        "success": "success" in outcome and "error" not in outcome,
+        "error": outcome.get("error"),
+        "wall_time": wall_time,
+        "speed": speed.summary(),
+        "peak_rss_kb": peak_rss_kb(),
+        "processes": processes.counts,
+    }
+    if io_before and io_after:
+        result["io"] = {key: io_after[key] - io_before[key] for key in
+                        ("rchar", "wchar", "read_bytes", "write_bytes") if key in io_after}
+    if output_file and os.path.exists(output_file):
+        result["output_size"] = os.path.getsize(output_file)
+    return result
+
+
+def run_isolated_scenario(scenario_name, clip_dir, output_dir, total_duration, probe_cache_path=None):
+    """Runs one scenario, meant to be called in a process of its own so its peak memory is not an earlier one's."""
+    if probe_cache_path:
+        probe_service._probe_service = probe_service.ProbeService(probe_cache_path)
+    job = dict(scenario_jobs(clip_dir, output_dir, total_duration))[scenario_name]()
+    return run_scenario(scenario_name, job, getattr(job, "output_file", None))
+
+
+def run_benchmarks(clip_sets, scenarios, clips_root, repeat=1, cold_probe_cache=False,
+                   resolution=DEFAULT_RESOLUTION, frame_rate=DEFAULT_FRAME_RATE):
+    # The encoder probe runs once per FFmpeg build, keep it out of the timings
+    get_encoder_capabilities()
+
+    results = []
+    for set_name in clip_sets:
+        chapters, chapter_duration = CLIP_SETS[set_name]
+        clip_dir = clip_set_dir(clips_root, set_name, resolution, frame_rate)
+        print(f"Preparing {set_name} clip set in {clip_dir}..")
+        generate_clip_set(clip_dir, chapters, chapter_duration, resolution, frame_rate)
+
+        for run_index in range(repeat):
+            output_dir = tempfile.mkdtemp(prefix=f"benchmark_{set_name}_")
+            probe_cache_dir = None
+            try:
+                probe_cache_path = None
+                if cold_probe_cache:
+                    probe_cache_dir = tempfile.mkdtemp(prefix="benchmark_probe_cache_")
+                    probe_cache_path = os.path.join(probe_cache_dir, "probe_cache.sqlite")
+
+                for scenario_name, _ in scenario_jobs(clip_dir, output_dir, chapters * chapter_duration):
+                    if scenario_name not in scenarios:
+                        continue
+                    print(f"[{set_name} #{run_index + 1}] {scenario_name}..")
+                    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+                        result = pool.submit(run_isolated_scenario, scenario_name, clip_dir, output_dir,
+                                             chapters * chapter_duration, probe_cache_path).result()
+                    result.update({"clip_set": set_name, "run": run_index + 1})
+                    print(f"[{set_name} #{run_index + 1}] {scenario_name}: {result['wall_time']:.2f}s, "
+                          f"processes {result['processes']}, {'ok' if result['success'] else result['error']}")
+                    results.append(result)
+            finally:
+                if cold_probe_cache:
+                    shutil.rmtree(probe_cache_dir, ignore_errors=True)
+                shutil.rmtree(output_dir, ignore_errors=True)
+    return results
+
+
+def environment_info():
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "python": platform.python_version(),
+        "cpu_count": os.cpu_count(),
+        "ffmpeg": get_ffmpeg_path(),
+    }
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Time the concat and trim pipelines on generated GoPro style clips.")
+    parser.add_argument("--sets", nargs="+", choices=sorted(CLIP_SETS), default=["small"],
+                        help="Clip sets to run on")
+    parser.add_argument("--scenarios", nargs="+", choices=[name for name, _ in scenario_jobs("", "", 0)],
+                        default=[name for name, _ in scenario_jobs("", "", 0)])
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--clips-dir", default=os.path.join(get_cache_dir(), "benchmark_clips"),
+                        help="Where generated clip sets are kept between runs")
+    parser.add_argument("--resolution", default=DEFAULT_RESOLUTION)
+    parser.add_argument("--frame-rate", type=int, default=DEFAULT_FRAME_RATE)
+    parser.add_argument("--cold-probe-cache", action="store_true",
+                        help="Start every run with an empty ffprobe cache")
+    parser.add_argument("--output", default="benchmark_results.json", help="JSON file to write the results to")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    results = run_benchmarks(args.sets, args.scenarios, args.clips_dir, args.repeat, args.cold_probe_cache,
+                             args.resolution, args.frame_rate)
+
+    with open(args.output, "w") as f:
+        json.dump({"environment": environment_info(), "results": results}, f, indent=2)
+    print(f"Results written to {args.output}")
+    return 0 if all(result["success"] for result in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,162 @@
+import os
+import re
+
+from jobs import ConcatJob
+from probe_service import get_probe_service
+from time_sync import clip_start_time
+from timeline import list_clips
+
+# HERO6 and later: GH (AVC) or GX (HEVC), then the chapter, then the file number shared by all chapters of a recording
+CHAPTER_PATTERN = re.compile(r"^(G[HXL])(\d{2})(\d{4})$", re.IGNORECASE)
+# HERO5 and earlier: GOPRnnnn is the first chapter, GPccnnnn the ones after it
+LEGACY_FIRST_PATTERN = re.compile(r"^GOPR(\d{4})$", re.IGNORECASE)
+LEGACY_CHAPTER_PATTERN = re.compile(r"^GP(\d{2})(\d{4})$", re.IGNORECASE)
+# Camera clocks are set by hand, recordings this close together may still come from one camera
+OVERLAP_TOLERANCE = 1
+
+
+def parse_chapter_name(path):
+    """Returns (series, chapter, file number) for GoPro chapter file names, None for anything else."""
+    name = os.path.splitext(os.path.basename(path))[0]
+    match = CHAPTER_PATTERN.match(name)
+    if match:
+        return match.group(1).upper(), int(match.group(2)), int(match.group(3))
+    match = LEGACY_FIRST_PATTERN.match(name)
+    if match:
+        return "GP", 0, int(match.group(1))
+    match = LEGACY_CHAPTER_PATTERN.match(name)
+    if match:
+        return "GP", int(match.group(1)), int(match.group(2))
+    return None
+
+
+def clip_signature(video_info):
+    """What two clips must share to have come from the same camera."""
+    if video_info is None:
+        return None
+    video = next((stream for stream in video_info.get("streams", []) if stream.get("codec_type") == "video"), {})
+    tags = video_info.get("format", {}).get("tags", {})
+    return (tags.get("firmware"), video.get("codec_name"), video.get("width"), video.get("height"),
+            video.get("r_frame_rate"))
+
+
+class ClipChain:
+    """The chapters of one recording, in playback order."""
+
+    def __init__(self, key, clips, start, signature):
+        self.key = key
+        self.clips = clips  # list of (path, duration) tuples
+        self.start = start
+        self.signature = signature
+
+    @property
+    def paths(self):
+        return [path for path, _ in self.clips]
+
+    @property
+    def duration(self):
+        return sum(duration for _, duration in self.clips)
+
+    @property
+    def end(self):
+        return self.start + self.duration if self.start is not None else None
+
+    def __repr__(self):
+        return f"ClipChain({self.key!r}, {len(self.clips)} clips, start={self.start})"
+
+
+class CameraGroup:
+    def __init__(self, name, signature):
+        self.name = name
+        self.signature = signature
+        self.chains = []
+
+    @property
+    def clip_paths(self):
+        return [path for chain in self.chains for path in chain.paths]
+
+    @property
+    def end(self):
+        return self.chains[-1].end if self.chains else None
+
+    def __repr__(self):
+        return f"CameraGroup({self.name!r}, {len(self.chains)} recordings)"
+
+
+def build_chains(clip_paths, video_infos):
+    chains = {}
+    for path, video_info in zip(clip_paths, video_infos):
+        chapter_name = parse_chapter_name(path)
+        if chapter_name:
+            series, chapter, file_number = chapter_name
+            key = (os.path.dirname(path), series, file_number)
+        else:
+            key, chapter = (path,), 0
+        duration = 0
+        if video_info is not None:
+            try:
+                duration = float(video_info["format"]["duration"])
+            except (KeyError, ValueError):
+                pass
+        chains.setdefault(key, []).append((chapter, path, duration, video_info))
+
+    result = []
+    for key, chapters in chains.items():
+        chapters.sort(key=lambda chapter: chapter[0])
+        first_info = chapters[0][3]
+        start = clip_start_time(first_info) if first_info else None
+        series = key[1] if len(key) > 1 else None
+        signature = (series, clip_signature(first_info))
+        result.append(ClipChain(key, [(path, duration) for _, path, duration, _ in chapters],
+                                start.timestamp() if start else None, signature))
+    return result
+
+
+def group_cameras(clip_paths):
+    """Splits clips into per-camera groups, each holding that camera's recordings in the order they were made.
+
+    Recordings that overlap in time must come from different cameras. Recordings with the same file name series,
+    firmware and video format that follow each other are treated as one camera.
+    """
+    video_infos = get_probe_service().probe_many(clip_paths)
+    chains = build_chains(clip_paths, video_infos)
+    # Undated recordings go last, in file number order
+    chains.sort(key=lambda chain: (chain.start is None, chain.start or 0, chain.key))
+
+    cameras = []
+    for chain in chains:
+        best = None
+        for camera in cameras:
+            if camera.signature != chain.signature:
+                continue
+            if chain.start is not None and camera.end is not None and camera.end > chain.start + OVERLAP_TOLERANCE:
+                continue
+            # The camera that stopped recording last is the most likely one to have started again
+            if best is None or (camera.end or 0) > (best.end or 0):
+                best = camera
+        if best is None:
+            best = CameraGroup(f"camera_{len(cameras) + 1}", chain.signature)
+            cameras.append(best)
+        best.chains.append(chain)
+    return cameras
+
+
+def camera_output_path(output_file, camera_name):
+    stem, extension = os.path.splitext(output_file)
+    return f"{stem}_{camera_name}{extension}"
+
+
+def camera_concat_jobs(clip_dir, output_file, skip_unchanged=True, scratch_dir=None, fragmented=False,
+                       finalize=True):
+    """Returns (camera name, output file, ConcatJob) for every camera found in clip_dir.
+
+    A single camera keeps output_file, several get one output each with the camera name appended.
+    """
+    cameras = group_cameras(list_clips(clip_dir))
+    jobs = []
+    for camera in cameras:
+        camera_output = output_file if len(cameras) == 1 else camera_output_path(output_file, camera.name)
+        jobs.append((camera.name, camera_output,
+                     ConcatJob(clip_dir, camera_output, skip_unchanged=skip_unchanged, clip_paths=camera.clip_paths,
+                               scratch_dir=scratch_dir, fragmented=fragmented, finalize=finalize)))
+    return jobs
@@ -0,0 +1,343 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from tqdm import tqdm
+
+from concat_manifest import file_state
+from ffmpeg_binaries import get_ffmpeg_path
+from ffmpeg_wrapper import FfmpegWrapper
+from job_control import JobControl
+from probe_service import get_probe_service
+from timeline import escape_concat_path
+
+# Chunks shorter than this spend more time starting FFmpeg and filling the encoder lookahead than encoding
+MIN_CHUNK_DURATION = 20
+# Also the most work an interrupted encode can lose, finished chunks are kept and reused on the next run
+MAX_CHUNK_DURATION = 300
+MAX_CHUNK_WORKERS = 16
+WORK_DIR_PREFIX = ".chunked_encode_"
+MANIFEST_VERSION = 2
+
+
+def default_worker_count():
+    return max(1, min(MAX_CHUNK_WORKERS, (os.cpu_count() or 1) // 2))
+
+
+class EncodeChunk:
+    def __init__(self, path, start, end):
+        self.path = path
+        self.start = start
+        self.end = end
+
+    @property
+    def duration(self):
+        return self.end - self.start
+
+    def to_dict(self):
+        return {"path": self.path, "start": self.start, "end": self.end}
+
+    def __repr__(self):
+        return f"EncodeChunk({self.path!r}, {self.start:.3f}, {self.end:.3f})"
+
+
+def split_into_chunks(segments, chunk_count):
+    """Splits clip segments into roughly chunk_count pieces whose boundaries fall on source keyframes."""
+    total_duration = sum(segment.duration for segment in segments)
+    target_duration = max(total_duration / max(chunk_count, 1), MIN_CHUNK_DURATION)
+
+    chunks = []
+    for segment in segments:
+        try:
+            keyframes = get_probe_service().keyframes(segment.path, f"{segment.inpoint}%{segment.outpoint}")
+        except Exception as e:
+            print(f"Could not read keyframes of {segment.path}, splitting on time instead: {e}")
+            keyframes = []
+
+        if not keyframes:
+            keyframes = [segment.inpoint + target_duration * i
+                         for i in range(1, int(segment.duration // target_duration) + 1)]
+
+        chunk_start = segment.inpoint
+        for keyframe in keyframes:
+            if keyframe - chunk_start >= target_duration and segment.outpoint - keyframe >= MIN_CHUNK_DURATION:
+                chunks.append(EncodeChunk(segment.path, chunk_start, keyframe))
+                chunk_start = keyframe
+        chunks.append(EncodeChunk(segment.path, chunk_start, segment.outpoint))
+    return chunks
+
+
+class EncodeManifest:
+    """Remembers the chunk plan of an encode and which chunks are finished, so a failed encode can be resumed."""
+
+    def __init__(self, work_dir, signature, output_file, chunks, done=None):
+        self.work_dir = work_dir
+        self.signature = signature
+        self.output_file = output_file
+        self.chunks = chunks
+        self.done = set(done or [])
+        self._lock = threading.Lock()
+
+    @property
+    def path(self):
+        return os.path.join(self.work_dir, "manifest.json")
+
+    @classmethod
+    def load(cls, work_dir, signature):
+        try:
+            with open(os.path.join(work_dir, "manifest.json")) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if data.get("version") != MANIFEST_VERSION or data.get("signature") != signature:
+            return None
+        chunks = [EncodeChunk(chunk["path"], chunk["start"], chunk["end"]) for chunk in data["chunks"]]
+        # A chunk only counts as done if its file survived as well
+        done = [key for key in data["done"] if os.path.exists(os.path.join(work_dir, task_file_name(key)))]
+        return cls(work_dir, signature, data["output_file"], chunks, done)
+
+    def mark_done(self, key):
+        with self._lock:
+            self.done.add(key)
+            self.save()
+
+    def save(self):
+        data = {
+            "version": MANIFEST_VERSION,
+            "signature": self.signature,
+            "output_file": self.output_file,
+            "chunks": [chunk.to_dict() for chunk in self.chunks],
+            "done": sorted(self.done, key=str),
+        }
+        # Written next to the real file and moved over it, so a crash never leaves half a manifest behind
+        partial_path = self.path + ".partial"
+        with open(partial_path, "w") as f:
+            json.dump(data, f, indent=2)
+        os.replace(partial_path, self.path)
+
+
+def task_file_name(key):
+    return "audio.m4a" if key == "audio" else f"chunk_{key:04d}.mp4"
+
+
+class ChunkedEncoder:
+    """Encodes keyframe-aligned chunks of a trim range in parallel and joins them with the concat demuxer.
+
+    Finished chunks are kept in a work folder next to the output until the join succeeds, so running the same
+    encode again after a failure, a cancel or a restart only encodes the chunks that are missing.
+    """
+
+    def __init__(self, segments, output_file, video_args, mute=False, workers=None, audio_args=None, control=None):
+        self.segments = segments
+        self.control = control or JobControl()
+        self.output_file = output_file
+        self.video_args = video_args
+        self.mute = mute or audio_args == ["-an"]
+        # Audio that fits the output is copied by the caller's stream plan instead of encoded again
+        self.audio_args = audio_args or ["-c:a", "aac"]
+        self.workers = workers or default_worker_count()
+        self.total_duration = sum(segment.duration for segment in segments)
+
+        self._lock = threading.Lock()
+        self._seconds_done = {}
+        self._speeds = {}
+        self._failed = False
+
+    def _has_audio(self):
+        return any(get_probe_service().streams(segment.path, "audio") for segment in self.segments)
+
+    def _chunk_command(self, chunk, chunk_path):
+        threads = max(1, (os.cpu_count() or 1) // self.workers)
+        command = [get_ffmpeg_path()]
+        if chunk.start > 0:
+            command.extend(["-ss", f"{chunk.start:.6f}"])
+        command.extend(["-i", chunk.path, "-t", f"{chunk.duration:.6f}", "-map", "0:v:0", "-an"])
+        command.extend(self.video_args)
+        command.extend(["-threads", str(threads), chunk_path, "-y"])
+        return command
+
+    def _audio_command(self, audio_path):
+        """One audio pass over all segments, each cut on its own so it lines up with the video chunks."""
+        # The concat demuxer starts every clip at the video keyframe before its inpoint, which puts the audio early.
+        # Seeking each input and decoding makes the cut sample accurate, so copied audio is encoded here too.
+        audio_args = ["-c:a", "aac"] if self.audio_args == ["-c:a", "copy"] else self.audio_args
+        command = [get_ffmpeg_path()]
+        for segment in self.segments:
+            if segment.inpoint > 0:
+                command.extend(["-ss", f"{segment.inpoint:.6f}"])
+            command.extend(["-t", f"{segment.duration:.6f}", "-i", segment.path])
+        if len(self.segments) == 1:
+            command.extend(["-map", "0:a:0"])
+        else:
+            inputs = "".join(f"[{index}:a:0]" for index in range(len(self.segments)))
+            command.extend(["-filter_complex", f"{inputs}concat=n={len(self.segments)}:v=0:a=1[audio]",
+                            "-map", "[audio]"])
+        command.extend(["-vn", *audio_args, "-t", f"{self.total_duration:.6f}", audio_path, "-y"])
+        return command
+
+    def _signature(self):
+        # Anything that changes the encoded chunks must change the signature, otherwise old chunks would be reused
+        sources = {}
+        for segment in self.segments:
+            if segment.path not in sources:
+                sources[segment.path] = file_state(segment.path)
+        data = {
+            "output_file": os.path.abspath(self.output_file),
+            "segments": [[segment.path, segment.inpoint, segment.outpoint] for segment in self.segments],
+            "sources": sources,
+            "video_args": self.video_args,
+            "mute": self.mute,
+            "audio_args": self.audio_args,
+        }
+        return hashlib.sha1(json.dumps(data, sort_keys=True).encode()).hexdigest()
+
+    def _open_manifest(self):
+        output_dir = os.path.dirname(os.path.abspath(self.output_file))
+        signature = self._signature()
+        work_dir = os.path.join(output_dir, WORK_DIR_PREFIX + signature[:16])
+
+        manifest = EncodeManifest.load(work_dir, signature)
+        if manifest is not None:
+            return manifest
+
+        # Leftovers of an earlier, different encode to the same output can never be resumed
+        for name in os.listdir(output_dir):
+            old_dir = os.path.join(output_dir, name)
+            if name.startswith(WORK_DIR_PREFIX) and old_dir != work_dir:
+                try:
+                    with open(os.path.join(old_dir, "manifest.json")) as f:
+                        old_output = json.load(f).get("output_file")
+                except (OSError, ValueError):
+                    continue
+                if old_output == os.path.abspath(self.output_file):
+                    shutil.rmtree(old_dir, ignore_errors=True)
+
+        shutil.rmtree(work_dir, ignore_errors=True)
+        os.makedirs(work_dir)
+        chunk_count = max(self.workers * 2, int(self.total_duration // MAX_CHUNK_DURATION) + 1)
+        manifest = EncodeManifest(work_dir, signature, os.path.abspath(self.output_file),
+                                  split_into_chunks(self.segments, chunk_count))
+        manifest.save()
+        return manifest
+
+    def _run_task(self, key, command, duration, progress_handler, manifest):
+        if self._failed:
+            return
+
+        def handle_progress(percentage, speed, eta, estimated_filesize):
+            # Only video chunks count towards the combined progress
+            if key == "audio":
+                return
+            with self._lock:
+                self._seconds_done[key] = duration * percentage / 100
+                self._speeds[key] = speed if percentage < 100 else 0
+                done = sum(self._seconds_done.values())
+                total_speed = sum(self._speeds.values())
+            if progress_handler is not None:
+                overall_eta = (self.total_duration - done) / total_speed if total_speed else None
+                progress_handler(min(done / self.total_duration * 100, 100), round(total_speed, 2), overall_eta,
+                                 None)
+
+        # The output path is the last but one argument, FFmpeg writes to a partial file that is renamed when done
+        final_path = command[-2]
+        partial_path = final_path + ".partial" + os.path.splitext(final_path)[1]
+        command = command[:-2] + [partial_path, "-y"]
+
+        def handle_success():
+            os.replace(partial_path, final_path)
+            manifest.mark_done(key)
+
+        process = FfmpegWrapper(command, expected_duration=duration, control=self.control)
+        process.run(progress_handler=handle_progress, success_handler=handle_success,
+                    error_handler=self._handle_task_error)
+
+    def _handle_task_error(self):
+        self._failed = True
+
+    def run(self, progress_handler=None, success_handler=None, error_handler=None):
+        manifest = self._open_manifest()
+        work_dir = manifest.work_dir
+
+        # Without a handler the combined progress goes to a terminal bar, like a single FfmpegWrapper run
+        progress_bar = None
+        if progress_handler is None:
+            progress_bar = tqdm(total=round(self.total_duration, 1), unit="s", dynamic_ncols=True, leave=False)
+
+            def progress_handler(percentage, speed, eta, estimated_filesize):
+                progress_bar.n = round(self.total_duration * percentage / 100, 1)
+                progress_bar.refresh()
+
+        succeeded = False
+        try:
+            chunks = manifest.chunks
+            chunk_paths = [os.path.join(work_dir, task_file_name(index)) for index in range(len(chunks))]
+            tasks = [
+                (index, self._chunk_command(chunk, chunk_path), chunk.duration)
+                for index, (chunk, chunk_path) in enumerate(zip(chunks, chunk_paths))
+            ]
+
+            audio_path = None
+            if not self.mute and self._has_audio():
+                # Audio is cheap to encode, so it gets one continuous pass instead of gaps at every chunk boundary
+                audio_path = os.path.join(work_dir, task_file_name("audio"))
+                tasks.append(("audio", self._audio_command(audio_path), self.total_duration))
+
+            finished = [(key, duration) for key, _, duration in tasks if key in manifest.done]
+            if finished:
+                print(f"Resuming encode, {len(finished)} of {len(tasks)} parts are already done")
+                for key, duration in finished:
+                    if key != "audio":
+                        self._seconds_done[key] = duration
+            tasks = [task for task in tasks if task[0] not in manifest.done]
+            print(f"Encoding {len(tasks)} parts with {self.workers} workers: {chunks}")
+
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                futures = [
+                    executor.submit(self._run_task, key, command, duration, progress_handler, manifest)
+                    for key, command, duration in tasks
+                ]
+                for future in futures:
+                    if future.exception() is not None:
+                        print(f"Chunk encode failed: {future.exception()}")
+                        self._failed = True
+
+            if self._failed:
+                print(f"{len(manifest.done)} of {len(chunks) + (1 if audio_path else 0)} parts finished, "
+                      f"they are kept in {work_dir} and reused when the encode is run again")
+                if error_handler:
+                    error_handler()
+                return
+
+            chunklist_path = os.path.join(work_dir, "chunks.txt")
+            with open(chunklist_path, "w") as chunklist:
+                for chunk_path in chunk_paths:
+                    chunklist.write(f"file '{escape_concat_path(chunk_path)}'\n")
+
+            join_cmd = [get_ffmpeg_path(), "-f", "concat", "-safe", "0", "-i", chunklist_path]
+            if audio_path:
+                join_cmd.extend(["-i", audio_path, "-map", "0:v", "-map", "1:a"])
+            join_cmd.extend(["-c", "copy", self.output_file, "-y"])
+
+            join_progress_handler = None
+            if progress_handler is not None:
+                def join_progress_handler(percentage, speed, eta, estimated_filesize):
+                    progress_handler(100, speed, 0, estimated_filesize)
+
+            def handle_join_success():
+                nonlocal succeeded
+                succeeded = True
+
+            process = FfmpegWrapper(join_cmd, expected_duration=self.total_duration, control=self.control)
+            process.run(progress_handler=join_progress_handler, success_handler=handle_join_success,
+                        error_handler=error_handler)
+        finally:
+            if progress_bar is not None:
+                progress_bar.close()
+            if succeeded:
+                shutil.rmtree(work_dir, ignore_errors=True)
+
+        if succeeded and success_handler:
+            success_handler()
@@ -0,0 +1,360 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+from audio_analysis import AudioHighlightJob
+from camera_grouping import camera_concat_jobs
+from highlight_export import Highlight, HighlightExportJob, parse_highlights, write_highlights
+from job_control import CPU_BOUND, IO_BOUND
+from jobs import ConcatJob, ProcessJob
+from motion_scan import MotionScanJob
+from proxy import ProxyJob
+from renditions import parse_rendition
+from scheduler import JobScheduler
+from telemetry import enable_chrome_trace
+from time_sync import DEFAULT_AFTER, DEFAULT_BEFORE, SyncIndex, parse_event_time, parse_schedule
+from timeline import Timeline
+from utils import parse_time
+from watch_folder import DEFAULT_POLL_INTERVAL, DEFAULT_SETTLE_TIME, FolderWatcher
+
+
+# Arguments holding paths, made absolute before any job or FFmpeg list file sees them
+PATH_ARGUMENTS = ("clip_dir", "input", "output_file", "output_dir", "output", "scratch_dir", "ranges_file",
+                  "schedule_file", "job_file", "trace")
+BATCH_PATH_KEYS = ("clip_dir", "input_file", "output_dir", "scratch_dir")
+
+
+def absolute_paths(args):
+    for name in PATH_ARGUMENTS:
+        value = getattr(args, name, None)
+        if value:
+            setattr(args, name, os.path.abspath(value))
+    return args
+
+
+class JobResult:
+    def __init__(self):
+        self.success = False
+        self.message = None
+
+    def handle_success(self):
+        self.success = True
+        self.message = "Completed successfully"
+
+    def handle_error(self, message="Failed"):
+        self.success = False
+        self.message = message
+
+
+def run_job(job, name):
+    result = JobResult()
+    print(f"[{name}] Starting")
+    job.run(success_handler=result.handle_success, error_handler=result.handle_error,
+            message_handler=lambda message: print(f"[{name}] {message}"))
+    print(f"[{name}] {result.message or 'Did not finish'}")
+    return result.success
+
+
+def print_or_write_highlights(highlights, ranges_file=None):
+    if ranges_file:
+        write_highlights(ranges_file, highlights)
+        print(f"Wrote {len(highlights)} ranges to {ranges_file}")
+        return
+    for highlight in highlights:
+        print(f"{highlight.start:.3f},{highlight.end:.3f},{highlight.name}")
+
+
+def _trim_range(entry_name, trim_name, trim):
+    """Checks the start and end of a batch trim and returns them in seconds."""
+    missing = [key for key in ("start", "end") if not trim.get(key)]
+    if missing:
+        raise ValueError(f"Batch entry {entry_name}, trim {trim_name} needs {' and '.join(missing)}")
+    try:
+        start, end = parse_time(str(trim["start"])), parse_time(str(trim["end"]))
+    except ValueError:
+        raise ValueError(f"Batch entry {entry_name}, trim {trim_name} has an invalid start or end: "
+                         f"{trim['start']} - {trim['end']}") from None
+    if end <= start:
+        raise ValueError(f"Batch entry {entry_name}, trim {trim_name} ends before it starts")
+    return start, end
+
+
+def load_batch(job_file, scratch_dir=None):
+    """Expands a batch file into (name, job) lists, one list per clip folder entry."""
+    with open(job_file) as f:
+        entries = json.load(f)
+    if isinstance(entries, dict):
+        entries = entries.get("jobs", [])
+
+    batches = []
+    for entry_index, entry in enumerate(entries):
+        entry = dict(entry, **{key: os.path.abspath(entry[key]) for key in BATCH_PATH_KEYS if entry.get(key)})
+        clip_dir = entry.get("clip_dir")
+        input_file = entry.get("input_file")
+        if not clip_dir and not input_file:
+            raise ValueError(f"Batch entry {entry_index + 1} needs a clip_dir or an input_file")
+        entry_name = entry.get("name") or os.path.basename(os.path.normpath(clip_dir or input_file))
+        trims = [(trim.get("name") or f"trim_{trim_index + 1}", trim)
+                 for trim_index, trim in enumerate(entry.get("trims", []))]
+        trim_ranges = [_trim_range(entry_name, trim_name, trim) for trim_name, trim in trims]
+        output_dir = entry.get("output_dir") or os.path.dirname(os.path.abspath(input_file or clip_dir))
+        os.makedirs(output_dir, exist_ok=True)
+        entry_scratch_dir = entry.get("scratch_dir", scratch_dir)
+
+        jobs = []
+        if entry.get("concat") and clip_dir:
+            jobs.append((f"{entry_name}/concat",
+                         ConcatJob(clip_dir, os.path.join(output_dir, "concatenated_output.mp4"),
+                                   scratch_dir=entry_scratch_dir, fragmented=entry.get("fragmented", False),
+                                   finalize=entry.get("finalize", True))))
+
+        if entry.get("single_pass"):
+            # All trims of the entry are exported together so each stretch of the source is decoded once
+            highlights = [Highlight(start, end, trim_name) for (trim_name, _), (start, end) in zip(trims, trim_ranges)]
+            jobs.append((f"{entry_name}/highlights", HighlightExportJob(
+                highlights, output_dir, mute=entry.get("mute", False), re_encode=entry.get("re_encode", False),
+                hw_acceleration=entry.get("hw_acceleration", False), input_file=input_file, clip_dir=clip_dir,
+                scratch_dir=entry_scratch_dir
+            )))
+            batches.append(jobs)
+            continue
+
+        for trim_name, trim in trims:
+            jobs.append((f"{entry_name}/{trim_name}", ProcessJob(
+                input_file,
+                os.path.join(output_dir, f"{trim_name}.mp4"),
+                str(trim["start"]),
+                str(trim["end"]),
+                trim.get("mute", entry.get("mute", False)),
+                trim.get("re_encode", entry.get("re_encode", False)),
+                trim.get("hw_acceleration", entry.get("hw_acceleration", False)),
+                clip_dir=clip_dir,
+                smart_cut=trim.get("smart_cut", entry.get("smart_cut", False)),
+                scratch_dir=entry_scratch_dir,
+                renditions=[parse_rendition(value) for value in trim.get("renditions", entry.get("renditions", []))],
+                fragmented=trim.get("fragmented", entry.get("fragmented", False)),
+                finalize=trim.get("finalize", entry.get("finalize", True)),
+            )))
+        batches.append(jobs)
+    return batches
+
+
+def run_batch(batches, parallel):
+    scheduler = JobScheduler(limits={CPU_BOUND: max(parallel, 1), IO_BOUND: max(parallel, 1)})
+    for jobs in batches:
+        for name, job in jobs:
+            scheduler.submit(
+                job, name=name,
+                success_handler=lambda name=name: print(f"[{name}] Completed successfully"),
+                error_handler=lambda message, name=name: print(f"[{name}] {message}"),
+                message_handler=lambda message, name=name: print(f"[{name}] {message}"),
+            )
+
+    try:
+        return scheduler.wait()
+    except KeyboardInterrupt:
+        print("Cancelling all jobs..")
+        scheduler.cancel_all()
+        scheduler.wait()
+        return False
+
+
+def run_watch(clip_dir, output_file, poll_interval, settle_time, scratch_dir=None):
+    scheduler = JobScheduler()
+    watcher = FolderWatcher(
+        clip_dir, output_file, scheduler, poll_interval=poll_interval, settle_time=settle_time,
+        scratch_dir=scratch_dir,
+        success_handler=lambda: print(f"[watch] {output_file} is up to date"),
+        error_handler=lambda message: print(f"[watch] {message}"),
+        message_handler=lambda message: print(f"[watch] {message}"),
+    )
+    watcher.start()
+    try:
+        while watcher.running:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        print("Stopping..")
+    watcher.stop()
+    scheduler.wait()
+    return True
+
+
+def run_events(args):
+    with open(args.schedule_file) as f:
+        events = parse_schedule(f.read())
+    timeline = Timeline.from_directory(args.clip_dir) if args.clip_dir else Timeline.from_files([args.input])
+    sync_index = SyncIndex.from_timeline(timeline)
+    if not sync_index.spans:
+        print("None of the clips has a creation time")
+        return False
+    if args.reference:
+        offset = sync_index.calibrate(parse_event_time(args.reference[0]), parse_time(args.reference[1]))
+        print(f"Camera clock is {offset:+.1f} seconds off")
+
+    highlights, missed = sync_index.event_ranges(events, args.before, args.after, timeline.total_duration)
+    for name in missed:
+        print(f"Not recorded: {name}")
+    print_or_write_highlights(highlights, args.output)
+    return True
+
+
+def add_fragmented_arguments(parser):
+    parser.add_argument("--fragmented", action="store_true",
+                        help="Write fragmented MP4, so the output in progress can be previewed while the job runs")
+    parser.add_argument("--keep-fragmented", action="store_true",
+                        help="Keep the fragmented output instead of remuxing it to a faststart MP4 at the end")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Concatenate and trim event videos without the GUI.")
+    parser.add_argument("--scratch-dir", help="Write temporary files and outputs in progress here, ideally a fast "
+                                              "drive other than the one holding the clips")
+    parser.add_argument("--trace", help="Also write a Chrome trace-event file of every job and FFmpeg run here")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    concat_parser = subparsers.add_parser("concat", help="Concatenate all clips in a folder")
+    concat_parser.add_argument("--full", action="store_true",
+                               help="Rebuild the output even when none of the clips changed or new clips could be "
+                                    "appended to it")
+    concat_parser.add_argument("--split-cameras", action="store_true",
+                               help="Group the clips by camera and write one output per camera, concatenated in "
+                                    "parallel")
+    add_fragmented_arguments(concat_parser)
+    concat_parser.add_argument("clip_dir")
+    concat_parser.add_argument("output_file")
+
+    watch_parser = subparsers.add_parser("watch", help="Keep the concatenated output up to date while clips are copied in")
+    watch_parser.add_argument("--interval", type=float, default=DEFAULT_POLL_INTERVAL,
+                              help="Seconds between checks of the folder")
+    watch_parser.add_argument("--settle", type=float, default=DEFAULT_SETTLE_TIME,
+                              help="Seconds a clip, and the folder before a concat, must stay unchanged")
+    watch_parser.add_argument("clip_dir")
+    watch_parser.add_argument("output_file")
+
+    trim_parser = subparsers.add_parser("trim", help="Trim a range out of a clip folder or a single video")
+    source = trim_parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--clip-dir", help="Trim straight from the clips in this folder")
+    source.add_argument("--input", help="Trim from a single video file")
+    trim_parser.add_argument("--start", help="Start time (HH:MM:SS)")
+    trim_parser.add_argument("--end", help="End time (HH:MM:SS)")
+    trim_parser.add_argument("--mute", action="store_true")
+    trim_parser.add_argument("--re-encode", action="store_true")
+    trim_parser.add_argument("--hw-acceleration", action="store_true")
+    trim_parser.add_argument("--smart-cut", action="store_true")
+    trim_parser.add_argument("--rendition", action="append", type=parse_rendition, default=[],
+                             help="Also encode this version from the same decode, a preset (review, social) or "
+                                  "[name=]HEIGHT[:BITRATE[:CODEC]]. Can be given more than once")
+    add_fragmented_arguments(trim_parser)
+    trim_parser.add_argument("output_file")
+
+    proxy_parser = subparsers.add_parser("proxy", help="Build a small preview proxy and keyframe thumbnails")
+    source = proxy_parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--clip-dir", help="Build the proxy straight from the clips in this folder")
+    source.add_argument("--input", help="Build the proxy from a single video file")
+    proxy_parser.add_argument("output_dir")
+
+    loudness_parser = subparsers.add_parser("loudness", help="Suggest highlight ranges from the loudest moments")
+    source = loudness_parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--clip-dir", help="Analyse the clips in this folder")
+    source.add_argument("--input", help="Analyse a single video file")
+    loudness_parser.add_argument("--threshold", type=float, help="RMS level in dB, defaults to the loudest 3%%")
+    loudness_parser.add_argument("--max-ranges", type=int, default=20)
+    loudness_parser.add_argument("--output", help="Write the ranges as a highlights file instead of printing them")
+
+    motion_parser = subparsers.add_parser("motion", help="Suggest highlight ranges where the scene is moving")
+    source = motion_parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--clip-dir", help="Scan the clips in this folder")
+    source.add_argument("--input", help="Scan a single video file")
+    motion_parser.add_argument("--threshold", type=float,
+                               help="Mean gray level change between frames, defaults to well above the noise floor")
+    motion_parser.add_argument("--max-ranges", type=int, default=20)
+    motion_parser.add_argument("--output", help="Write the ranges as a highlights file instead of printing them")
+
+    events_parser = subparsers.add_parser("events", help="Turn a schedule of real-world event times into trim ranges")
+    source = events_parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--clip-dir", help="Match against the creation times of the clips in this folder")
+    source.add_argument("--input", help="Match against the creation time of a single video file")
+    events_parser.add_argument("--before", type=float, default=DEFAULT_BEFORE, help="Seconds to keep before each event")
+    events_parser.add_argument("--after", type=float, default=DEFAULT_AFTER, help="Seconds to keep after each event")
+    events_parser.add_argument("--reference", nargs=2, metavar=("ACTUAL_TIME", "RECORDING_TIME"),
+                               help="Correct the camera clock with one event's real time and its position in the "
+                                    "recording")
+    events_parser.add_argument("--output", help="Write the ranges as a highlights file instead of printing them")
+    events_parser.add_argument("schedule_file", help="One \"HH:MM:SS name\" or \"YYYY-MM-DD HH:MM:SS name\" per line")
+
+    highlights_parser = subparsers.add_parser("highlights",
+                                              help="Export every range in a start,end,name file in a single pass")
+    source = highlights_parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--clip-dir", help="Export straight from the clips in this folder")
+    source.add_argument("--input", help="Export from a single video file")
+    highlights_parser.add_argument("--mute", action="store_true")
+    highlights_parser.add_argument("--re-encode", action="store_true")
+    highlights_parser.add_argument("--hw-acceleration", action="store_true")
+    highlights_parser.add_argument("ranges_file")
+    highlights_parser.add_argument("output_dir")
+
+    batch_parser = subparsers.add_parser("batch", help="Run every job listed in a JSON job file")
+    batch_parser.add_argument("job_file")
+    batch_parser.add_argument("--parallel", type=int, default=1,
+                              help="How many encodes and how many stream copies may run at the same time")
+    return parser
+
+
+def main(argv=None):
+    args = absolute_paths(build_parser().parse_args(argv))
+    if args.trace:
+        enable_chrome_trace(args.trace)
+
+    if args.command == "concat" and args.split_cameras:
+        jobs = camera_concat_jobs(args.clip_dir, args.output_file, skip_unchanged=not args.full,
+                                  scratch_dir=args.scratch_dir, fragmented=args.fragmented,
+                                  finalize=not args.keep_fragmented)
+        for camera_name, camera_output, _ in jobs:
+            print(f"[{camera_name}] -> {camera_output}")
+        success = run_batch([[(camera_name, job) for camera_name, _, job in jobs]], len(jobs))
+    elif args.command == "concat":
+        success = run_job(ConcatJob(args.clip_dir, args.output_file, skip_unchanged=not args.full,
+                                     scratch_dir=args.scratch_dir, fragmented=args.fragmented,
+                                     finalize=not args.keep_fragmented), "concat")
+    elif args.command == "watch":
+        success = run_watch(args.clip_dir, args.output_file, args.interval, args.settle, args.scratch_dir)
+    elif args.command == "trim":
+        job = ProcessJob(args.input, args.output_file, args.start, args.end, args.mute, args.re_encode,
+                         args.hw_acceleration, clip_dir=args.clip_dir, smart_cut=args.smart_cut,
+                         scratch_dir=args.scratch_dir, renditions=args.rendition, fragmented=args.fragmented,
+                         finalize=not args.keep_fragmented)
+        success = run_job(job, "trim")
+    elif args.command == "proxy":
+        os.makedirs(args.output_dir, exist_ok=True)
+        success = run_job(ProxyJob(args.output_dir, input_file=args.input, clip_dir=args.clip_dir,
+                                   scratch_dir=args.scratch_dir), "proxy")
+    elif args.command == "loudness":
+        job = AudioHighlightJob(input_file=args.input, clip_dir=args.clip_dir, threshold_db=args.threshold,
+                                max_ranges=args.max_ranges)
+        success = run_job(job, "loudness")
+        if success:
+            print_or_write_highlights(job.highlights, args.output)
+    elif args.command == "motion":
+        job = MotionScanJob(input_file=args.input, clip_dir=args.clip_dir, threshold=args.threshold,
+                            max_ranges=args.max_ranges)
+        success = run_job(job, "motion")
+        if success:
+            print_or_write_highlights(job.highlights, args.output)
+    elif args.command == "events":
+        success = run_events(args)
+    elif args.command == "highlights":
+        os.makedirs(args.output_dir, exist_ok=True)
+        job = HighlightExportJob(parse_highlights(args.ranges_file), args.output_dir, mute=args.mute,
+                                 re_encode=args.re_encode, hw_acceleration=args.hw_acceleration,
+                                 input_file=args.input, clip_dir=args.clip_dir, scratch_dir=args.scratch_dir)
+        success = run_job(job, "highlights")
+    else:
+        success = run_batch(load_batch(args.job_file, args.scratch_dir), args.parallel)
+
+    return 0 if success else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,240 @@
+import hashlib
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from chunked_encoder import default_worker_count
+from concat_manifest import file_state
+from ffmpeg_binaries import get_ffmpeg_path
+from ffmpeg_wrapper import FfmpegWrapper
+from hardware_encoder_util import SOFTWARE_FALLBACK, select_encoder, split_filter_args
+from job_control import JobControl
+from probe_service import get_probe_service
+
+# What the concat demuxer needs to be equal across clips for a stream copy to play back correctly
+VIDEO_KEYS = ("codec_name", "width", "height", "pix_fmt", "r_frame_rate", "time_base")
+AUDIO_KEYS = ("codec_name", "sample_rate", "channels")
+AUDIO_ENCODERS = {"aac": "aac", "mp3": "libmp3lame", "opus": "libopus"}
+
+
+class ClipFormat:
+    def __init__(self, video, audio):
+        self.video = video  # dict of VIDEO_KEYS, None without video
+        self.audio = audio  # dict of AUDIO_KEYS, None without audio
+
+    @classmethod
+    def from_probe(cls, video_info):
+        streams = video_info.get("streams", [])
+        video = next((stream for stream in streams if stream.get("codec_type") == "video"
+                      and not stream.get("disposition", {}).get("attached_pic")), None)
+        audio = next((stream for stream in streams if stream.get("codec_type") == "audio"), None)
+        return cls({key: video.get(key) for key in VIDEO_KEYS} if video else None,
+                   {key: audio.get(key) for key in AUDIO_KEYS} if audio else None)
+
+    @property
+    def key(self):
+        return json.dumps([self.video, self.audio], sort_keys=True)
+
+    def differences(self, other):
+        """Describes how this format differs from other, empty when the two concat cleanly."""
+        differences = []
+        for kind, mine, theirs, keys in (("video", self.video, other.video, VIDEO_KEYS),
+                                         ("audio", self.audio, other.audio, AUDIO_KEYS)):
+            if (mine is None) != (theirs is None):
+                differences.append(f"{'no' if mine is None else 'extra'} {kind}")
+            elif mine is not None:
+                differences.extend(f"{kind} {key} {mine[key]} instead of {theirs[key]}"
+                                   for key in keys if mine[key] != theirs[key])
+        return differences
+
+
+class CompatibilityReport:
+    def __init__(self, reference, outliers):
+        self.reference = reference
+        self.outliers = outliers  # list of (path, duration, differences)
+
+    @property
+    def compatible(self):
+        return not self.outliers
+
+    def describe(self):
+        return "\n".join(f"  {os.path.basename(path)}: {', '.join(differences)}"
+                         for path, _, differences in self.outliers)
+
+
+def check_compatibility(clip_paths, reference_path=None):
+    """Compares every clip with the format most of the footage is in, or with reference_path's format.
+
+    Clips that cannot be probed are left alone, the concat reports those itself.
+    """
+    video_infos = get_probe_service().probe_many(clip_paths)
+    formats = {}
+    weights = {}
+    for path, video_info in zip(clip_paths, video_infos):
+        if video_info is None:
+            continue
+        clip_format = ClipFormat.from_probe(video_info)
+        formats[path] = clip_format
+        try:
+            duration = float(video_info["format"]["duration"])
+        except (KeyError, ValueError):
+            duration = 0
+        weights.setdefault(clip_format.key, [clip_format, 0])[1] += duration
+
+    if reference_path is not None and reference_path in formats:
+        reference = formats[reference_path]
+    elif weights:
+        # By duration rather than count, a handful of short test clips must not outvote the event itself
+        reference = max(weights.values(), key=lambda item: item[1])[0]
+    else:
+        return CompatibilityReport(None, [])
+
+    outliers = []
+    for path, video_info in zip(clip_paths, video_infos):
+        if path not in formats:
+            continue
+        differences = formats[path].differences(reference)
+        if differences:
+            outliers.append((path, float(video_info["format"].get("duration", 0)), differences))
+    return CompatibilityReport(reference, outliers)
+
+
+class ClipNormalizer:
+    """Re-encodes only the clips that differ from the reference format, several at a time.
+
+    Normalized clips are named after their source and the target format, so a repeated or interrupted concat
+    reuses the ones that already exist.
+    """
+
+    def __init__(self, report, work_dir, hw_acceleration=False, workers=None, control=None):
+        self.report = report
+        self.work_dir = work_dir
+        self.hw_acceleration = hw_acceleration
+        self.workers = workers or default_worker_count()
+        self.control = control or JobControl()
+        self.total_duration = sum(duration for _, duration, _ in report.outliers)
+
+        self._lock = threading.Lock()
+        self._seconds_done = {}
+        self._speeds = {}
+        self._failed = False
+
+    def normalized_path(self, path):
+        key = json.dumps([file_state(path), self.report.reference.key])
+        return os.path.join(self.work_dir, hashlib.sha1(key.encode()).hexdigest()[:16] + ".mp4")
+
+    def _command(self, path, output_file):
+        reference = self.report.reference
+        video = reference.video
+        audio = reference.audio
+        has_audio = bool(get_probe_service().streams(path, "audio"))
+
+        command = [get_ffmpeg_path()]
+        if video:
+            codec = video["codec_name"]
+            encoder = select_encoder(codec if codec in SOFTWARE_FALLBACK else "h264", self.hw_acceleration)
+            command.extend(encoder.input_args)
+        command.extend(["-i", path])
+        if audio and not has_audio:
+            # Silence keeps the audio track continuous across the clip
+            command.extend(["-f", "lavfi", "-i", f"anullsrc=r={audio['sample_rate']}:cl=stereo"])
+
+        if video:
+            width, height = video["width"], video["height"]
+            video_args, encoder_filter = split_filter_args(
+                encoder.video_args(get_probe_service().video_stream(path).get("bit_rate")))
+            # A second -vf would replace the scaling, an encoder's own filters such as a hardware upload go last
+            video_filter = f"scale={width}:{height}:force_original_aspect_ratio=decrease," \
+                           f"pad={width}:{height}:(ow-iw)/2:(oh-ih)/2,setsar=1"
+            if encoder_filter:
+                video_filter += f",{encoder_filter}"
+            command.extend(["-map", "0:v:0", "-vf", video_filter, "-r", video["r_frame_rate"], "-fps_mode", "cfr"])
+            command.extend(video_args)
+            if not encoder.hardware and video["pix_fmt"]:
+                command.extend(["-pix_fmt", video["pix_fmt"]])
+            timescale = str(video["time_base"] or "").partition("/")[2]
+            if timescale:
+                command.extend(["-video_track_timescale", timescale])
+        else:
+            command.extend(["-vn"])
+
+        if audio:
+            command.extend(["-map", "0:a:0" if has_audio else "1:a:0",
+                            "-c:a", AUDIO_ENCODERS.get(audio["codec_name"], audio["codec_name"]),
+                            "-ar", str(audio["sample_rate"]), "-ac", str(audio["channels"])])
+            if not has_audio:
+                command.extend(["-shortest"])
+        else:
+            command.extend(["-an"])
+        return command + [output_file, "-y"]
+
+    def _normalize(self, path, duration, progress_handler):
+        if self._failed or self.control.cancelled:
+            return
+
+        def handle_progress(percentage, speed, eta, estimated_filesize):
+            with self._lock:
+                self._seconds_done[path] = duration * percentage / 100
+                self._speeds[path] = speed if percentage < 100 else 0
+                done = sum(self._seconds_done.values())
+                total_speed = sum(self._speeds.values())
+            if progress_handler is not None and self.total_duration:
+                overall_eta = (self.total_duration - done) / total_speed if total_speed else None
+                progress_handler(min(done / self.total_duration * 100, 100), round(total_speed, 2), overall_eta,
+                                 None)
+
+        output_file = self.normalized_path(path)
+        partial_file = output_file + ".partial.mp4"
+
+        def handle_success():
+            os.replace(partial_file, output_file)
+
+        process = FfmpegWrapper(self._command(path, partial_file), expected_duration=duration, control=self.control)
+        process.run(progress_handler=handle_progress, success_handler=handle_success,
+                    error_handler=self._handle_error)
+
+    def _handle_error(self):
+        self._failed = True
+
+    def run(self, progress_handler=None):
+        """Returns {original path: normalized path}, or None when a clip could not be normalized."""
+        os.makedirs(self.work_dir, exist_ok=True)
+        pending = [(path, duration) for path, duration, _ in self.report.outliers
+                   if not os.path.exists(self.normalized_path(path))]
+        if len(pending) < len(self.report.outliers):
+            print(f"Reusing {len(self.report.outliers) - len(pending)} clips normalized by an earlier run")
+        for path, duration, _ in self.report.outliers:
+            if (path, duration) not in pending:
+                self._seconds_done[path] = duration
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [executor.submit(self._normalize, path, duration, progress_handler)
+                       for path, duration in pending]
+            for future in futures:
+                if future.exception() is not None:
+                    print(f"Normalizing a clip failed: {future.exception()}")
+                    self._failed = True
+
+        if self._failed or self.control.cancelled:
+            return None
+        return {path: self.normalized_path(path) for path, _, _ in self.report.outliers}
+
+
+def normalize_mismatched_clips(clip_paths, work_dir, hw_acceleration=False, control=None, progress_handler=None,
+                               message_handler=None, reference_path=None):
+    """Converts the clips that differ from the rest, or from reference_path, into work_dir.
+
+    Returns {original path: converted path}, empty when every clip matches, or None when a conversion failed.
+    """
+    clip_paths = list(dict.fromkeys(clip_paths))
+    report = check_compatibility(clip_paths + [reference_path] if reference_path else clip_paths, reference_path)
+    if report.compatible:
+        return {}
+    message = f"Converting {len(report.outliers)} clips that differ from the rest.."
+    if message_handler:
+        message_handler(message)
+    else:
+        print(message)
+    print(report.describe())
+    return ClipNormalizer(report, work_dir, hw_acceleration, control=control).run(progress_handler)
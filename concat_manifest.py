@@ -0,0 +1,75 @@
+import json
+import os
+
+MANIFEST_VERSION = 1
+
+
+def manifest_path(output_file):
+    return f"{output_file}.clips.json"
+
+
+def file_state(path):
+    stat = os.stat(path)
+    return {"path": os.path.abspath(path), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+class ConcatManifest:
+    """Records which clips, in which order, a concatenated output was built from."""
+
+    def __init__(self, output_file, clips=None, output_state=None, duration=0):
+        self.output_file = output_file
+        self.clips = clips or []
+        self.output_state = output_state
+        self.duration = duration
+
+    @classmethod
+    def load(cls, output_file):
+        try:
+            with open(manifest_path(output_file)) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if data.get("version") != MANIFEST_VERSION:
+            return None
+        return cls(output_file, data["clips"], data["output"], data["duration"])
+
+    @classmethod
+    def from_timeline(cls, output_file, timeline):
+        clips = [dict(file_state(path), duration=duration) for path, duration in timeline.clips]
+        return cls(output_file, clips, file_state(output_file), timeline.total_duration)
+
+    def save(self):
+        with open(manifest_path(self.output_file), "w") as f:
+            json.dump({"version": MANIFEST_VERSION, "output": self.output_state, "duration": self.duration,
+                       "clips": self.clips}, f, indent=2)
+
+    def _recorded_clips(self):
+        return [{key: clip[key] for key in ("path", "size", "mtime_ns")} for clip in self.clips]
+
+    def is_up_to_date(self, clip_paths):
+        """True when the output is the one recorded and was built from exactly these clips, unchanged."""
+        try:
+            if file_state(self.output_file) != self.output_state:
+                return False  # The output was changed or replaced since it was recorded
+            current = [file_state(path) for path in clip_paths]
+        except OSError:
+            return False
+        return current == self._recorded_clips()
+
+    def new_clips(self, clip_paths):
+        """The clips after the recorded ones, when the output and the recorded clips are unchanged, otherwise None."""
+        try:
+            if file_state(self.output_file) != self.output_state:
+                return None
+            current = [file_state(path) for path in clip_paths[:len(self.clips)]]
+        except OSError:
+            return None
+        if len(clip_paths) <= len(self.clips) or current != self._recorded_clips():
+            return None
+        return clip_paths[len(self.clips):]
+
+    def appended(self, timeline):
+        """The manifest after timeline's clips were appended to the output."""
+        clips = self.clips + [dict(file_state(path), duration=duration) for path, duration in timeline.clips]
+        return ConcatManifest(self.output_file, clips, file_state(self.output_file),
+                              self.duration + timeline.total_duration)
@@ -0,0 +1,79 @@
+import os
+import subprocess
+import sys
+import tempfile
+
+from ffmpeg_binaries import get_ffmpeg_path
+from job_control import JobControl, low_priority_creationflags, low_priority_prefix
+from telemetry import rotate_log
+from timeline import Timeline
+
+
+class FfmpegPipe:
+    """Runs FFmpeg on a clip folder or a single file and reads its raw output from stdout."""
+
+    def __init__(self, output_args, input_file=None, clip_dir=None, input_args=None, control=None, log_name="pipe"):
+        self.output_args = output_args
+        self.input_file = input_file
+        self.clip_dir = clip_dir
+        self.input_args = input_args or []
+        self.control = control or JobControl()
+        self.log_path = os.path.join("ffmpeg_logs", f"[{log_name}].txt")
+        self.returncode = None
+
+        if clip_dir:
+            self.timeline = Timeline.from_directory(clip_dir)
+        else:
+            self.timeline = Timeline.from_files([input_file])
+        self.duration = self.timeline.total_duration
+
+    def read_into(self, buffer):
+        """Yields the number of bytes read each time buffer has been filled, the last fill may be partial."""
+        filelist_path = None
+        command = [get_ffmpeg_path(), "-hide_banner", "-nostdin"] + self.input_args
+        if self.clip_dir:
+            fd, filelist_path = tempfile.mkstemp(prefix="pipe_filelist_", suffix=".txt")
+            os.close(fd)
+            self.timeline.write_filelist(filelist_path)
+            command.extend(["-f", "concat", "-safe", "0", "-i", filelist_path])
+        else:
+            command.extend(["-i", self.input_file])
+        command.extend(self.output_args + ["pipe:1"])
+
+        creationflags = subprocess.CREATE_NO_WINDOW if sys.platform.startswith("win") else 0
+        if self.control.low_priority:
+            command = low_priority_prefix() + command
+            creationflags |= low_priority_creationflags()
+
+        os.makedirs("ffmpeg_logs", exist_ok=True)
+        rotate_log(self.log_path)
+        view = memoryview(buffer).cast("B")
+        try:
+            with open(self.log_path, "a") as log:
+                process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=log, creationflags=creationflags)
+            self.control.register(process)
+            try:
+                while True:
+                    filled = 0
+                    while filled < len(view):
+                        count = process.stdout.readinto(view[filled:])
+                        if not count:
+                            break
+                        filled += count
+                    if filled:
+                        yield filled
+                    if filled < len(view):
+                        break
+                process.stdout.close()
+                self.returncode = process.wait()
+            finally:
+                if process.poll() is None:
+                    process.terminate()
+                    process.wait()
+                self.control.unregister(process)
+        finally:
+            if filelist_path:
+                os.remove(filelist_path)
+
+        if self.returncode != 0:
+            print(f"FFmpeg failed, its output can be found in {self.log_path}")
@@ -1,21 +1,82 @@
+import logging
 import os
 from pathlib import Path
+import queue
+import shlex
 import subprocess
 import sys
+import threading
+import time
 
-from ffmpeg import probe
 from tqdm import tqdm
 
-from ffmpeg_binaries import get_ffprobe_path
+from job_control import low_priority_creationflags, low_priority_prefix
+from probe_service import get_probe_service
+from telemetry import RunTrace, record, rotate_log
+from utils import parse_time
+
+logger = logging.getLogger("eventvideotool.ffmpeg")
+
+# At most this many progress callbacks per second, FFmpeg itself reports about twice a second
+DEFAULT_PROGRESS_RATE = 4
+
+
+def _progress_value(fields, key, convert):
+    value = fields.get(key)
+    if value is None or "N/A" in value:
+        return None
+    try:
+        return convert(value)
+    except ValueError:
+        return None
+
+
+class ProgressSnapshot:
+    """One block of FFmpeg -progress output, from its first key up to the progress= line."""
+
+    def __init__(self, fields):
+        self.frame = _progress_value(fields, "frame", int)
+        self.fps = _progress_value(fields, "fps", float)
+        self.bitrate = _progress_value(fields, "bitrate", lambda value: float(value.replace("kbits/s", "")))  # kbit/s
+        self.total_size = _progress_value(fields, "total_size", int)
+        # out_time_us is the newer name, out_time_ms is the same value in microseconds despite its name
+        out_time_us = _progress_value(fields, "out_time_us", int)
+        if out_time_us is None:
+            out_time_us = _progress_value(fields, "out_time_ms", int)
+        # Before the first packet is muxed FFmpeg reports a huge negative time
+        self.out_time = out_time_us / 1_000_000 if out_time_us is not None and out_time_us >= 0 else None
+        self.speed = _progress_value(fields, "speed", lambda value: float(value.rstrip("x")))
+        self.dup_frames = _progress_value(fields, "dup_frames", int)
+        self.drop_frames = _progress_value(fields, "drop_frames", int)
+        self.done = fields.get("progress") == "end"
+
+    def __repr__(self):
+        return (f"ProgressSnapshot(frame={self.frame}, fps={self.fps}, bitrate={self.bitrate}, "
+                f"out_time={self.out_time}, total_size={self.total_size}, speed={self.speed}, "
+                f"dup={self.dup_frames}, drop={self.drop_frames}, done={self.done})")
+
+
+def _output_path(command):
+    # The output is the last argument that is neither an option nor an option's value
+    for arg in reversed(command):
+        if arg == "-y":
+            continue
+        return None if arg.startswith("-") else arg
+    return None
 
 
 class FfmpegWrapper:
-    def __init__(self, command, ffmpeg_loglevel="verbose", expected_duration=0):
+    def __init__(self, command, ffmpeg_loglevel="verbose", expected_duration=0, control=None,
+                 max_progress_rate=DEFAULT_PROGRESS_RATE):
         if "-i" not in command:
             raise ValueError("FFmpeg command must include '-i'")
 
         self._ffmpeg_args = command + ["-hide_banner", "-loglevel", ffmpeg_loglevel]
         self._expected_duration = expected_duration
+        self._control = control
+        self._progress_interval = 1 / max_progress_rate if max_progress_rate else 0
+        self._output_file = _output_path(command)
+        self.trace = RunTrace(command)
 
         self._set_file_info()
 
@@ -31,30 +92,26 @@ class FfmpegWrapper:
             self.creationflags = subprocess.CREATE_NO_WINDOW
         else:
             self.creationflags = 0
+        if control is not None and control.low_priority:
+            self.creationflags |= low_priority_creationflags()
 
     def _parse_time(self, time_str):
-        """Converts a HH:MM:SS or MM:SS or SS format string into total seconds as float."""
-        parts = time_str.split(':')
-        if len(parts) == 3:
-            hours, minutes, seconds = map(float, parts)
-            return hours * 3600 + minutes * 60 + seconds
-        elif len(parts) == 2:
-            minutes, seconds = map(float, parts)
-            return minutes * 60 + seconds
-        else:
-            return float(parts[0])
+        return parse_time(time_str)
 
     def _set_file_info(self):
         index_of_filepath = self._ffmpeg_args.index("-i") + 1
         self._filepath = self._ffmpeg_args[index_of_filepath]
         self._can_get_duration = True
+        self.trace.name = Path(self._filepath).name
 
         if self._expected_duration > 0:
             self._can_get_duration = True
             self._duration_secs = self._expected_duration
         else:
+            probe_start = time.perf_counter()
             try:
-                self._duration_secs = float(probe(self._filepath, cmd=get_ffprobe_path())["format"]["duration"])
+                self._duration_secs = get_probe_service().duration(self._filepath)
+                self.trace.probe_seconds = time.perf_counter() - probe_start
                 print(f"The duration of {self._filepath} has been detected as {self._duration_secs} seconds.")
             except Exception:
                 self._can_get_duration = False
@@ -82,53 +139,72 @@ class FfmpegWrapper:
         if self._can_get_duration:
             self._ffmpeg_args += ["-progress", "pipe:1", "-nostats"]
 
-    def _update_progress(self, ffmpeg_output, progress_handler):
-        if ffmpeg_output:
-            value = ffmpeg_output.split("=")[1].strip()
-
-            if progress_handler is None:
-                if "out_time_ms" in ffmpeg_output:
-                    seconds_processed = round(int(value) / 1_000_000, 1)
-                    seconds_increase = seconds_processed - self._previous_seconds_processed
-                    self._progress_bar.update(seconds_increase)
-                    self._previous_seconds_processed = seconds_processed
-
+    def _read_progress(self, stdout, snapshots):
+        # Runs on its own thread so the run loop never blocks on a pipe read
+        fields = {}
+        for line in iter(stdout.readline, b""):
+            key, _, value = line.decode(errors="replace").strip().partition("=")
+            if not key:
+                continue
+            fields[key] = value.strip()
+            if key == "progress":
+                snapshots.put(ProgressSnapshot(fields))
+                fields = {}
+        snapshots.put(None)
+
+    def _update_progress(self, snapshot, progress_handler, snapshot_handler):
+        self.trace.progress(snapshot)
+        if snapshot.total_size is not None:
+            self._current_size = snapshot.total_size
+        if snapshot.out_time is not None:
+            self._seconds_processed = snapshot.out_time
+        if snapshot.speed:
+            self._speed = snapshot.speed
+
+        if self._can_get_duration and self._duration_secs > 0:
+            self._percentage_progress = min(self._seconds_processed / self._duration_secs * 100, 100)
+            if self._current_size and self._percentage_progress > 0:
+                self._estimated_size = self._current_size * (100 / self._percentage_progress)
+            if self._speed:
+                self._eta = max(self._duration_secs - self._seconds_processed, 0) / self._speed
+
+        if snapshot.done:
+            self._percentage_progress = 100
+            self._eta = 0
+
+        if self._progress_bar is not None:
+            seconds_processed = round(self._seconds_processed, 1)
+            self._progress_bar.update(seconds_processed - self._previous_seconds_processed)
+            self._previous_seconds_processed = seconds_processed
+            self._progress_bar.set_postfix_str(f"{snapshot.fps or 0:.1f} fps, {self._speed}x", refresh=False)
+
+        if snapshot_handler:
+            snapshot_handler(snapshot)
+        if progress_handler:
+            progress_handler(self._percentage_progress, self._speed, self._eta, self._estimated_size)
+
+    def _deliver_progress(self, snapshots, progress_handler, snapshot_handler):
+        last_delivery = 0
+        pending = None
+        while True:
+            try:
+                snapshot = snapshots.get(timeout=self._progress_interval or None)
+            except queue.Empty:
+                snapshot = pending  # Nothing new, flush whatever was held back by the rate limit
+                pending = None
+                if snapshot is None:
+                    continue
             else:
-                if "total_size" in ffmpeg_output and "N/A" not in value:
-                    self._current_size = int(value)
-
-                elif "out_time_ms" in ffmpeg_output and "N/A" not in value:
-                    # ERROR here
-                    #print("SecondsPr")
-                    self._seconds_processed = int(value) / 1_000_000
-
-                    if self._can_get_duration:
-                        self._percentage_progress = (
-                                                            self._seconds_processed / self._duration_secs
-                                                    ) * 100
-
-                        if self._current_size is not None and self._percentage_progress != 0.0:
-                            self._estimated_size = self._current_size * (
-                                    100 / self._percentage_progress
-                            )
-
-                elif "speed" in ffmpeg_output:
-                    speed_str = value[:-1]
-                    if speed_str != "0" and "N/A" not in value:
-                        self._speed = float(speed_str)
-
-                        if self._can_get_duration:
-                            self._eta = (
-                                                self._duration_secs - self._seconds_processed
-                                        ) / self._speed
-
-                if ffmpeg_output == "progress=end":
-                    self._percentage_progress = 100
-                    self._eta = 0
-
-                progress_handler(
-                    self._percentage_progress, self._speed, self._eta, self._estimated_size
-                )
+                if snapshot is None:
+                    break
+                # Only the newest snapshot matters, older ones are dropped rather than delivered late
+                if not snapshot.done and time.monotonic() - last_delivery < self._progress_interval:
+                    pending = snapshot
+                    continue
+
+            pending = None
+            last_delivery = time.monotonic()
+            self._update_progress(snapshot, progress_handler, snapshot_handler)
 
     def run(
             self,
@@ -136,17 +212,34 @@ class FfmpegWrapper:
             ffmpeg_output_file=None,
             success_handler=None,
             error_handler=None,
+            snapshot_handler=None,
     ):
 
         if ffmpeg_output_file is None:
             os.makedirs("ffmpeg_logs", exist_ok=True)
             ffmpeg_output_file = os.path.join("ffmpeg_logs", f"[{Path(self._filepath).name}].txt")
 
-        print(self._ffmpeg_args)
+        if self._control is not None and self._control.cancelled:
+            if error_handler:
+                error_handler()
+            return
 
+        launch_args = self._ffmpeg_args
+        if self._control is not None and self._control.low_priority:
+            launch_args = low_priority_prefix() + launch_args
+        self.trace.command = launch_args
+        command_line = subprocess.list2cmdline(launch_args) if os.name == "nt" else shlex.join(launch_args)
+        logger.info("Running: %s", command_line)
+
+        rotate_log(ffmpeg_output_file)
         with open(ffmpeg_output_file, "a") as f:
-            process = subprocess.Popen(self._ffmpeg_args, stdout=subprocess.PIPE, stderr=f, creationflags=self.creationflags)
-            print(f"\nRunning: {' '.join(self._ffmpeg_args)}\n")
+            f.write(f"Running: {command_line}\n")
+            f.flush()
+            self.trace.started_at = time.time()
+            process = subprocess.Popen(launch_args, stdout=subprocess.PIPE, stderr=f, creationflags=self.creationflags)
+
+        if self._control is not None:
+            self._control.register(process)
 
         if progress_handler is None and self._can_get_duration:
             self._progress_bar = tqdm(
@@ -156,10 +249,18 @@ class FfmpegWrapper:
                 leave=False,
             )
 
+        snapshots = queue.Queue()
+        reader = threading.Thread(target=self._read_progress, args=(process.stdout, snapshots), daemon=True)
+        reader.start()
+
         try:
-            while process.poll() is None:
-                ffmpeg_output = process.stdout.readline().decode().strip()
-                self._update_progress(ffmpeg_output, progress_handler)
+            self._deliver_progress(snapshots, progress_handler, snapshot_handler)
+            process.wait()
+            # Measured before the handlers run, they may move the output into place
+            self.trace.finish(process.returncode, self._output_file)
+
+            if self._progress_bar is not None:
+                self._progress_bar.close()
 
             if process.returncode != 0:
                 if error_handler:
@@ -169,6 +270,7 @@ class FfmpegWrapper:
                 print(
                     f"The FFmpeg process encountered an error. The output of FFmpeg can be found in {ffmpeg_output_file}"
                 )
+                return
 
             if success_handler:
                 success_handler()
@@ -176,9 +278,17 @@ class FfmpegWrapper:
             print(f"\n\nDone! To see FFmpeg's output, check out {ffmpeg_output_file}")
 
         except KeyboardInterrupt:
-            self._progress_bar.close()
+            if self._progress_bar is not None:
+                self._progress_bar.close()
             print("[KeyboardInterrupt] FFmpeg process killed.")
             sys.exit()
 
         except Exception as e:
             print(f"[Better FFmpeg Process] {e}")
+
+        finally:
+            if self._control is not None:
+                self._control.unregister(process)
+            if self.trace.finished_at is None:
+                self.trace.finish(process.poll(), self._output_file)
+            record(self.trace.to_dict())
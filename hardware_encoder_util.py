@@ -1,75 +1,195 @@
+import json
+import os
 import platform
 import subprocess
+import sys
+import threading
+import time
 
+from ffmpeg_binaries import get_ffmpeg_path
+from utils import get_cache_dir
 
-def get_hardware_encoder():
-    system = platform.system().lower()
+VAAPI_DEVICE = "/dev/dri/renderD128"
+# Frames encoded per candidate, enough to get past encoder startup without making the first run slow
+BENCHMARK_FRAMES = 120
+BENCHMARK_TIMEOUT = 30
+CACHE_VERSION = 1
 
-    if system == "darwin":  # macOS
-        return get_mac_encoder()
-    elif system == "windows":
-        return get_windows_encoder()
-    elif system == "linux":
-        return get_linux_encoder()
-    else:
-        return None  # Unknown system, fallback to software encoding
 
+class EncoderProfile:
+    def __init__(self, name, codec, hardware, input_args=None, output_args=None, platforms=None):
+        self.name = name
+        self.codec = codec
+        self.hardware = hardware
+        self.input_args = input_args or []
+        self.output_args = output_args or []
+        self.platforms = platforms
 
-def get_mac_encoder():
-    # macOS typically uses VideoToolbox
-    return "h264_videotoolbox"
+    def video_args(self, bitrate=None):
+        args = ["-c:v", self.name] + self.output_args
+        if bitrate:
+            args.extend(["-b:v", bitrate])
+        return args
 
+    def __repr__(self):
+        return f"EncoderProfile({self.name!r})"
 
-def get_windows_encoder():
-    # Check for NVIDIA, AMD, and Intel GPUs
-    if check_nvidia_gpu():
-        return "h264_nvenc"
-    elif check_amd_gpu():
-        return "h264_amf"
-    elif check_intel_gpu():
-        return "h264_qsv"
-    return None
 
+CANDIDATES = [
+    EncoderProfile("h264_videotoolbox", "h264", True, platforms=("darwin",)),
+    EncoderProfile("hevc_videotoolbox", "hevc", True, platforms=("darwin",)),
+    EncoderProfile("h264_nvenc", "h264", True, output_args=["-preset", "fast"], platforms=("win32", "linux")),
+    EncoderProfile("hevc_nvenc", "hevc", True, output_args=["-preset", "fast"], platforms=("win32", "linux")),
+    EncoderProfile("h264_amf", "h264", True, output_args=["-quality", "speed"], platforms=("win32",)),
+    EncoderProfile("h264_qsv", "h264", True, output_args=["-preset", "fast"], platforms=("win32", "linux")),
+    EncoderProfile("h264_vaapi", "h264", True, input_args=["-vaapi_device", VAAPI_DEVICE],
+                   output_args=["-vf", "format=nv12,hwupload"], platforms=("linux",)),
+    EncoderProfile("libx264", "h264", False, output_args=["-preset", "fast"]),
+    EncoderProfile("libx265", "hevc", False, output_args=["-preset", "fast"]),
+]
 
-def get_linux_encoder():
-    # Similar to Windows, but might require different detection methods
-    if check_nvidia_gpu():
-        return "h264_nvenc"
-    elif check_amd_gpu():
-        return "h264_vaapi"  # VAAPI is often used on Linux
-    elif check_intel_gpu():
-        return "h264_qsv"
-    return None
+SOFTWARE_FALLBACK = {
+    "h264": "libx264",
+    "hevc": "libx265",
+}
 
+_capabilities = None
+_capabilities_lock = threading.Lock()
 
-def check_nvidia_gpu():
+
+def _creationflags():
+    return subprocess.CREATE_NO_WINDOW if sys.platform.startswith("win") else 0
+
+
+def candidate_encoders():
+    candidates = []
+    for profile in CANDIDATES:
+        if profile.platforms and not any(sys.platform.startswith(name) for name in profile.platforms):
+            continue
+        if profile.name == "h264_vaapi" and not os.path.exists(VAAPI_DEVICE):
+            continue
+        candidates.append(profile)
+    return candidates
+
+
+def get_profile(name):
+    return next((profile for profile in CANDIDATES if profile.name == name), None)
+
+
+def merge_input_args(*arg_lists):
+    """Joins input args given as flag/value pairs, keeping the first value set for each flag."""
+    merged = []
+    for args in arg_lists:
+        for index in range(0, len(args), 2):
+            if args[index] not in merged[::2]:
+                merged.extend(args[index:index + 2])
+    return merged
+
+
+def split_filter_args(args):
+    """Separates a -vf chain from encoder args, so it can be joined with the command's own filters instead."""
+    args = list(args)
+    if "-vf" not in args:
+        return args, None
+    index = args.index("-vf")
+    return args[:index] + args[index + 2:], args[index + 1]
+
+
+def _cache_key():
+    # The results only hold for this machine and this exact FFmpeg build
+    ffmpeg_path = get_ffmpeg_path()
+    try:
+        stat = os.stat(ffmpeg_path)
+        build = f"{ffmpeg_path}|{stat.st_size}|{stat.st_mtime_ns}"
+    except OSError:
+        build = ffmpeg_path
+    return f"v{CACHE_VERSION}|{platform.node()}|{platform.system()}|{platform.machine()}|{build}"
+
+
+def _compiled_encoders():
     try:
-        # This command works on Windows and Linux
-        subprocess.check_output(["nvidia-smi"])
-        return True
-    except:
-        return False
+        output = subprocess.check_output([get_ffmpeg_path(), "-hide_banner", "-encoders"], stderr=subprocess.DEVNULL,
+                                         creationflags=_creationflags()).decode(errors="replace")
+    except (OSError, subprocess.CalledProcessError):
+        return set()
+    encoders = set()
+    for line in output.splitlines():
+        parts = line.split()
+        if len(parts) >= 2 and parts[0].startswith("V"):
+            encoders.add(parts[1])
+    return encoders
+
 
+def benchmark_encoder(profile):
+    """Encodes a short lavfi test pattern and returns frames per second, or None if the encoder does not work."""
+    command = [get_ffmpeg_path(), "-hide_banner", "-loglevel", "error"] + profile.input_args + [
+        "-f", "lavfi", "-i", "testsrc2=size=1280x720:rate=30", "-frames:v", str(BENCHMARK_FRAMES)
+    ] + profile.video_args("5M") + ["-f", "null", "-"]
 
-def check_amd_gpu():
-    # This is a simplified check and might need to be more robust
+    start = time.perf_counter()
     try:
-        if platform.system().lower() == "windows":
-            output = subprocess.check_output(["wmic", "path", "win32_VideoController", "get", "name"]).decode()
-        else:  # Linux
-            output = subprocess.check_output(["lspci"]).decode()
-        return "AMD" in output or "Radeon" in output
-    except:
-        return False
+        result = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                                timeout=BENCHMARK_TIMEOUT, creationflags=_creationflags())
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+    elapsed = time.perf_counter() - start
+
+    if result.returncode != 0:
+        return None
+    return BENCHMARK_FRAMES / elapsed if elapsed > 0 else None
+
 
+def _cache_path():
+    return os.path.join(get_cache_dir(), "encoder_capabilities.json")
 
-def check_intel_gpu():
-    # This is a simplified check and might need to be more robust
+
+def _load_cache():
     try:
-        if platform.system().lower() == "windows":
-            output = subprocess.check_output(["wmic", "path", "win32_VideoController", "get", "name"]).decode()
-        else:  # Linux
-            output = subprocess.check_output(["lspci"]).decode()
-        return "Intel" in output and ("HD Graphics" in output or "UHD Graphics" in output)
-    except:
-        return False
\ No newline at end of file
+        with open(_cache_path()) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def get_encoder_capabilities(refresh=False):
+    """Returns {encoder name: {"works": bool, "fps": float or None}}, test encoding each candidate only once."""
+    global _capabilities
+    with _capabilities_lock:
+        if _capabilities is not None and not refresh:
+            return _capabilities
+
+        key = _cache_key()
+        cache = _load_cache()
+        if not refresh and key in cache:
+            _capabilities = cache[key]["encoders"]
+            return _capabilities
+
+        compiled = _compiled_encoders()
+        capabilities = {}
+        for profile in candidate_encoders():
+            fps = benchmark_encoder(profile) if profile.name in compiled else None
+            capabilities[profile.name] = {"works": fps is not None, "fps": fps}
+            print(f"Encoder {profile.name}: {'%.1f fps' % fps if fps else 'not available'}")
+
+        cache[key] = {"tested_at": time.time(), "encoders": capabilities}
+        try:
+            with open(_cache_path(), "w") as f:
+                json.dump(cache, f, indent=2)
+        except OSError as e:
+            print(f"Could not save encoder capabilities: {e}")
+
+        _capabilities = capabilities
+        return _capabilities
+
+
+def select_encoder(codec="h264", hw_acceleration=True):
+    """Returns the fastest working encoder for codec, falling back to the software encoder."""
+    capabilities = get_encoder_capabilities()
+    working = [
+        profile for profile in candidate_encoders()
+        if profile.codec == codec and (hw_acceleration or not profile.hardware)
+        and capabilities.get(profile.name, {}).get("works")
+    ]
+    if working:
+        return max(working, key=lambda profile: capabilities[profile.name]["fps"])
+    return get_profile(SOFTWARE_FALLBACK.get(codec, "libx264"))
@@ -0,0 +1,274 @@
+import csv
+import os
+import re
+import shutil
+import tempfile
+
+from concat_compat import normalize_mismatched_clips
+from ffmpeg_binaries import get_ffmpeg_path
+from ffmpeg_wrapper import FfmpegWrapper
+from hardware_encoder_util import merge_input_args, select_encoder
+from job_control import CPU_BOUND, IO_BOUND, JobControl
+from jobs import VIDEO_BITRATE
+from preflight import OutputPlan, PreflightError, estimate_copy_size, estimate_encode_size
+from timeline import Timeline
+from utils import parse_time
+
+# Highlights closer together than this share one FFmpeg run, reading the gap is cheaper than another seek and startup
+MAX_GROUP_GAP = 30
+
+
+class Highlight:
+    def __init__(self, start, end, name):
+        self.start = start
+        self.end = end
+        self.name = name
+
+    @property
+    def duration(self):
+        return self.end - self.start
+
+    def __repr__(self):
+        return f"Highlight({self.name!r}, {self.start:.3f}, {self.end:.3f})"
+
+
+def safe_file_name(name):
+    return re.sub(r'[^\w\-. ]', '_', name).strip() or "highlight"
+
+
+def parse_highlights(ranges_file):
+    """Reads "start,end[,name]" lines, skipping blank lines, comments and a header row."""
+    highlights = []
+    with open(ranges_file, newline="") as f:
+        for row in csv.reader(f):
+            if not row or not row[0].strip() or row[0].strip().startswith("#"):
+                continue
+            try:
+                start = parse_time(row[0].strip())
+                end = parse_time(row[1].strip())
+            except (IndexError, ValueError):
+                if not highlights:
+                    continue  # header row
+                raise ValueError(f"Invalid highlight range: {','.join(row)}")
+            name = row[2].strip() if len(row) > 2 and row[2].strip() else f"highlight_{len(highlights) + 1}"
+            highlights.append(Highlight(start, end, name))
+    return highlights
+
+
+def write_highlights(ranges_file, highlights):
+    """Writes highlights in the format parse_highlights reads."""
+    with open(ranges_file, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["start", "end", "name"])
+        for highlight in highlights:
+            writer.writerow([f"{highlight.start:.3f}", f"{highlight.end:.3f}", highlight.name])
+
+
+def output_names(highlights):
+    """File names for the highlights, numbering repeated names instead of letting them overwrite each other."""
+    names = {}
+    used = set()
+    for highlight in highlights:
+        base_name = safe_file_name(highlight.name)
+        name, number = base_name, 1
+        # Case-insensitive, so the outputs do not collide on Windows and macOS drives either
+        while name.lower() in used:
+            number += 1
+            name = f"{base_name}_{number}"
+        used.add(name.lower())
+        names[highlight] = f"{name}.mp4"
+    return names
+
+
+def group_highlights(highlights, max_gap=MAX_GROUP_GAP):
+    groups = []
+    for highlight in sorted(highlights, key=lambda highlight: highlight.start):
+        if groups and highlight.start - max(h.end for h in groups[-1]) <= max_gap:
+            groups[-1].append(highlight)
+        else:
+            groups.append([highlight])
+    return groups
+
+
+class HighlightExportJob:
+    """Exports many highlight ranges. Re-encodes decode each stretch of the source once for every highlight in it."""
+
+    def __init__(self, highlights, output_dir, mute=False, re_encode=False, hw_acceleration=False, input_file=None,
+                 clip_dir=None, video_bitrate=VIDEO_BITRATE, scratch_dir=None, control=None):
+        self.highlights = highlights
+        self.control = control or JobControl()
+        self.output_dir = output_dir
+        self.mute = mute
+        self.re_encode = re_encode
+        self.hw_acceleration = hw_acceleration
+        self.input_file = input_file
+        self.clip_dir = clip_dir
+        self.video_bitrate = video_bitrate
+        self.scratch_dir = scratch_dir
+
+    @property
+    def resource(self):
+        return CPU_BOUND if self.re_encode else IO_BOUND
+
+    def cancel(self):
+        self.control.cancel()
+
+    def _output_plan(self, timeline, highlight, file_name):
+        if self.re_encode:
+            estimated_size = estimate_encode_size(highlight.duration, self.video_bitrate, self.mute)
+        else:
+            estimated_size = estimate_copy_size(timeline.segments(highlight.start, highlight.end))
+        return OutputPlan(os.path.join(self.output_dir, file_name), estimated_size, self.scratch_dir)
+
+    def _group_command(self, timeline, group, plans, list_dir, group_index, encoder, normalized=False):
+        group_start = group[0].start
+        group_end = min(max(highlight.end for highlight in group), timeline.total_duration)
+
+        hwaccel_args = ["-hwaccel", "auto"] if self.hw_acceleration and self.re_encode else []
+        command = [get_ffmpeg_path()] + merge_input_args(encoder.input_args if encoder else [], hwaccel_args)
+
+        if self.clip_dir:
+            filelist_path = os.path.join(list_dir, f"highlight_group_{group_index}.txt")
+            timeline.write_filelist(filelist_path, group_start, group_end)
+            command.extend(["-f", "concat", "-safe", "0", "-t", f"{group_end - group_start:.6f}",
+                            "-i", filelist_path])
+        else:
+            command.extend(["-ss", f"{group_start:.6f}", "-t", f"{group_end - group_start:.6f}",
+                            "-i", self.input_file])
+
+        # Every highlight is one output of the same input, so the shared stretch is only decoded once
+        for highlight in group:
+            if highlight.start > group_start:
+                command.extend(["-ss", f"{highlight.start - group_start:.6f}"])
+            command.extend(["-t", f"{highlight.duration:.6f}", "-map", "0:v:0"])
+            command.extend(["-an"] if self.mute else ["-map", "0:a?"])
+            command.extend(encoder.video_args(self.video_bitrate) if encoder else ["-c", "copy"])
+            if normalized and not encoder:
+                # Converted and original clips each keep their own decoder headers, as in a concat
+                command.extend(["-bsf:v", "dump_extra=freq=keyframe"])
+            command.extend([plans[highlight].temp_file])
+        command.extend(["-y"])
+        return command, group_end - group_start
+
+    def run(self, progress_handler=None, success_handler=None, error_handler=None, message_handler=None):
+        if self.clip_dir:
+            timeline = Timeline.from_directory(self.clip_dir)
+        else:
+            timeline = Timeline.from_files([self.input_file])
+
+        highlights, skipped = [], []
+        for highlight in self.highlights:
+            if highlight.duration > 0 and highlight.start < timeline.total_duration:
+                highlights.append(highlight)
+            else:
+                skipped.append(highlight)
+        if skipped:
+            message = f"Skipping highlights that are empty or past the end of the source: " \
+                      f"{', '.join(highlight.name for highlight in skipped)}"
+            if message_handler:
+                message_handler(message)
+            else:
+                print(message)
+        if not highlights:
+            if error_handler:
+                error_handler("No highlight ranges to export")
+            return
+
+        if self.re_encode:
+            groups = group_highlights(highlights)
+        else:
+            # A stream copy can only start on a keyframe, so every highlight seeks on the input side on its own.
+            # Cutting a shared copy on the output side would drop the video up to the next keyframe.
+            groups = [[highlight] for highlight in sorted(highlights, key=lambda highlight: highlight.start)]
+
+        normalized_dir = os.path.join(self.scratch_dir or self.output_dir, ".highlights.normalized")
+        try:
+            self._run_groups(timeline, groups, skipped, normalized_dir, progress_handler, success_handler,
+                             error_handler, message_handler)
+        finally:
+            shutil.rmtree(normalized_dir, ignore_errors=True)
+
+    def _run_groups(self, timeline, groups, skipped, normalized_dir, progress_handler, success_handler, error_handler,
+                    message_handler):
+        normalized = {}
+        if self.clip_dir:
+            # Read through the concat demuxer like a concat, so clips in another format are converted the same way
+            clip_paths = [segment.path for group in groups
+                          for segment in timeline.segments(group[0].start, max(h.end for h in group))]
+            normalized = normalize_mismatched_clips(clip_paths, normalized_dir, self.hw_acceleration, self.control,
+                                                    progress_handler, message_handler)
+            if normalized is None:
+                if error_handler:
+                    error_handler("Converting mismatched clips failed")
+                return
+            if normalized:
+                timeline = Timeline([(normalized.get(path, path), duration) for path, duration in timeline.clips])
+
+        names = output_names(highlight for group in groups for highlight in group)
+        plans = {highlight: self._output_plan(timeline, highlight, name) for highlight, name in names.items()}
+        try:
+            for plan in plans.values():
+                plan.check()
+        except PreflightError as e:
+            if error_handler:
+                error_handler(str(e))
+            return
+
+        with tempfile.TemporaryDirectory(prefix="highlights_") as list_dir:
+            self._export(timeline, groups, skipped, plans, list_dir, bool(normalized), progress_handler,
+                         success_handler, error_handler, message_handler)
+
+    def _export(self, timeline, groups, skipped, plans, list_dir, normalized, progress_handler, success_handler,
+                error_handler, message_handler):
+        encoder = select_encoder(hw_acceleration=self.hw_acceleration) if self.re_encode else None
+        commands = [self._group_command(timeline, group, plans, list_dir, index, encoder, normalized)
+                    for index, group in enumerate(groups)]
+        total_duration = sum(duration for _, duration in commands)
+
+        completed_duration = 0
+        failed = []
+        for index, (command, duration) in enumerate(commands):
+            if self.control.cancelled:
+                break
+
+            message = f"Exporting highlight group {index + 1}/{len(groups)} ({len(groups[index])} clips).."
+            if message_handler:
+                message_handler(message)
+            else:
+                print(message)
+
+            group_progress_handler = None
+            if progress_handler is not None:
+                def group_progress_handler(percentage, speed, eta, estimated_filesize, done=completed_duration,
+                                           group_duration=duration):
+                    overall_done = done + group_duration * percentage / 100
+                    overall_eta = (total_duration - overall_done) / speed if speed else None
+                    progress_handler(overall_done / total_duration * 100, speed, overall_eta, None)
+
+            def handle_group_success(group=groups[index], group_index=index):
+                try:
+                    for highlight in group:
+                        plans[highlight].commit()
+                except OSError as e:
+                    print(f"Could not move highlight group {group_index + 1} into place: {e}")
+                    failed.append(group_index)
+
+            process = FfmpegWrapper(command, expected_duration=duration, control=self.control)
+            process.run(progress_handler=group_progress_handler, success_handler=handle_group_success,
+                        error_handler=lambda: failed.append(index))
+            completed_duration += duration
+
+        for plan in plans.values():
+            plan.discard()
+        if failed or self.control.cancelled:
+            if error_handler:
+                error_handler(f"{len(failed)} of {len(groups)} highlight groups failed")
+            return
+        if skipped:
+            if error_handler:
+                error_handler(f"Exported {len(plans)} highlights, skipped {len(skipped)} that are empty or past the "
+                              f"end of the source: {', '.join(highlight.name for highlight in skipped)}")
+            return
+
+        if success_handler:
+            success_handler()
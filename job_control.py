@@ -0,0 +1,60 @@
+import shutil
+import subprocess
+import sys
+import threading
+
+# Scheduling classes, the scheduler limits how many jobs of each class run at once
+CPU_BOUND = "cpu"
+IO_BOUND = "io"
+
+
+def low_priority_prefix():
+    """Command prefix that starts a child at lower CPU and I/O priority, so the UI and other work stay responsive."""
+    if sys.platform.startswith("win"):
+        return []  # Windows uses a creation flag instead, see low_priority_creationflags
+
+    prefix = []
+    if shutil.which("nice"):
+        prefix.extend(["nice", "-n", "10"])
+    if sys.platform.startswith("linux") and shutil.which("ionice"):
+        prefix.extend(["ionice", "-c", "2", "-n", "7"])
+    return prefix
+
+
+def low_priority_creationflags():
+    if sys.platform.startswith("win"):
+        return subprocess.BELOW_NORMAL_PRIORITY_CLASS
+    return 0
+
+
+class JobControl:
+    """Shared by every FFmpeg process a job starts, so the whole job can be cancelled at once."""
+
+    def __init__(self, low_priority=False):
+        self.low_priority = low_priority
+        self._cancelled = threading.Event()
+        self._lock = threading.Lock()
+        self._processes = set()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def cancel(self):
+        self._cancelled.set()
+        with self._lock:
+            processes = list(self._processes)
+        for process in processes:
+            if process.poll() is None:
+                process.terminate()
+
+    def register(self, process):
+        with self._lock:
+            self._processes.add(process)
+        # A cancel may have raced with the process starting
+        if self.cancelled and process.poll() is None:
+            process.terminate()
+
+    def unregister(self, process):
+        with self._lock:
+            self._processes.discard(process)
@@ -0,0 +1,28 @@
+from PyQt5.QtCore import QObject, pyqtSignal
+
+from utils import format_eta
+
+
+class JobSignals(QObject):
+    """Turns the callbacks of a scheduled job into Qt signals, which are safe to emit from the job's worker thread."""
+
+    progress_update = pyqtSignal(int)  # Emit progress percentage
+    progress_message = pyqtSignal(str)  # Emit detailed progress message
+    finished = pyqtSignal(bool, str)  # Emit completion status and message
+
+    def __init__(self, label, success_message=None):
+        super().__init__()
+        self.label = label
+        self.success_message = success_message or f"{label} completed successfully!"
+
+    def handle_progress_info(self, percentage, speed, eta, estimated_filesize):
+        eta_str = format_eta(eta)
+        message = f"{self.label} Progress: {percentage:.2f}%, Speed: {speed}x, ETA: {eta_str}"
+        self.progress_update.emit(int(percentage))
+        self.progress_message.emit(message)
+
+    def handle_success(self):
+        self.finished.emit(True, self.success_message)
+
+    def handle_error(self, message="Failed"):
+        self.finished.emit(False, message)
@@ -0,0 +1,527 @@
+import os
+import shutil
+
+from chunked_encoder import ChunkedEncoder
+from concat_compat import normalize_mismatched_clips
+from concat_manifest import ConcatManifest
+from ffmpeg_binaries import get_ffmpeg_path
+from ffmpeg_wrapper import FfmpegWrapper
+from hardware_encoder_util import merge_input_args, select_encoder
+from job_control import CPU_BOUND, IO_BOUND, JobControl
+from mp4_index import Mp4IndexError, append_fragments, fragment_count
+from probe_service import get_probe_service
+from preflight import OutputPlan, PreflightError, estimate_copy_size, estimate_encode_size
+from renditions import rendition_args
+from smart_cut import SmartCutter, unsupported_codec
+from stream_planner import COPY, plan_streams
+from timeline import ClipSegment, Timeline, list_clips, write_segment_filelist
+from utils import parse_time
+
+VIDEO_BITRATE = "5M"
+# Every keyframe starts a fragment with its own sample tables, so the output plays while it is still being written
+FRAGMENTED_MOVFLAGS = "+frag_keyframe+empty_moov+default_base_moof"
+
+
+def _ffmpeg_error_handler(error_handler, message="Failed"):
+    # FfmpegWrapper and the encoders call their error handler without arguments
+    if error_handler is None:
+        return None
+    return lambda: error_handler(message)
+
+
+def _notify(message_handler, message):
+    if message_handler:
+        message_handler(message)
+    else:
+        print(message)
+
+
+def _planned_output(plan, success_handler, error_handler, cleanup_paths=(), extra_plans=()):
+    """Handlers that move the finished outputs into place, or throw the partial ones away."""
+    plans = [plan] + list(extra_plans)
+
+    def cleanup():
+        for path in cleanup_paths:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def handle_success():
+        cleanup()
+        try:
+            for output_plan in plans:
+                output_plan.commit()
+        except OSError as e:
+            for output_plan in plans:
+                output_plan.discard()
+            if error_handler:
+                error_handler(f"Could not move the output into place: {e}")
+            return
+        if success_handler:
+            success_handler()
+
+    def handle_error(message="Failed"):
+        cleanup()
+        for output_plan in plans:
+            output_plan.discard()
+        if error_handler:
+            error_handler(message)
+
+    return handle_success, handle_error
+
+
+def _fragmented_args(output_file):
+    if os.path.splitext(output_file)[1].lower() not in (".mp4", ".mov"):
+        return []
+    return ["-movflags", FRAGMENTED_MOVFLAGS]
+
+
+def _finalizing(temp_file, success_handler, error_handler, control, progress_handler=None, message_handler=None):
+    """Wraps success_handler so the fragmented temp_file is first rewritten as a regular faststart MP4.
+
+    This is a stream copy, it costs one more pass over the output but seeks faster than the fragmented file.
+    """
+    stem, extension = os.path.splitext(temp_file)
+    finalized_file = f"{stem}.faststart{extension}"
+
+    def handle_finalized():
+        try:
+            os.replace(finalized_file, temp_file)
+        except OSError as e:
+            error_handler(f"Could not finalize the output: {e}")
+            return
+        success_handler()
+
+    def handle_error():
+        if os.path.exists(finalized_file):
+            os.remove(finalized_file)
+        error_handler("Finalizing the fragmented output failed")
+
+    def handle_success():
+        _notify(message_handler, "Finalizing the fragmented output..")
+        process = FfmpegWrapper([get_ffmpeg_path(), "-i", temp_file, "-map", "0", "-c", "copy",
+                                 "-movflags", "+faststart", finalized_file, "-y"], control=control)
+        process.run(progress_handler=progress_handler, success_handler=handle_finalized, error_handler=handle_error)
+
+    return handle_success
+
+
+def partial_output(output_file, scratch_dir=None):
+    """The output a fragmented job is still writing, None unless there is something playable in it yet."""
+    temp_file = OutputPlan(output_file, scratch_dir=scratch_dir).temp_file
+    return temp_file if fragment_count(temp_file) else None
+
+
+def normalized_clip_dir(plan):
+    return os.path.join(plan.work_dir, f".{os.path.basename(plan.output_file)}.normalized")
+
+
+def _removing_dir(path, success_handler):
+    def handle_success():
+        shutil.rmtree(path, ignore_errors=True)
+        if success_handler:
+            success_handler()
+    return handle_success
+
+
+def _segment_sources(segments, video_outputs, audio_outputs, input_args=(), first_input=0):
+    """Opens every segment as its own input, seeking on the input side so an encode starts exactly on the inpoint.
+
+    Returns (input args, filter graph, video sources, audio sources) with one source per output. Several segments are
+    joined with the concat filter and its output is split once per output. first_input is the index of the first
+    segment's input in the command.
+    """
+    args = []
+    for segment in segments:
+        args.extend(input_args)
+        if segment.inpoint > 0:
+            args.extend(["-ss", f"{segment.inpoint:.6f}"])
+        args.extend(["-t", f"{segment.duration:.6f}", "-i", segment.path])
+    if len(segments) == 1:
+        return args, [], [f"{first_input}:v:0"] * video_outputs, [f"{first_input}:a:0?"] * audio_outputs
+
+    streams = "".join(f"[{index}:v:0]" + (f"[{index}:a:0]" if audio_outputs else "")
+                      for index in range(first_input, first_input + len(segments)))
+    video_sources = [f"[video{index}]" for index in range(video_outputs)]
+    audio_sources = [f"[audio{index}]" for index in range(audio_outputs)]
+    graph = [f"{streams}concat=n={len(segments)}:v=1:a={1 if audio_outputs else 0}[video]"
+             + ("[audio]" if audio_outputs else ""),
+             f"[video]split={video_outputs}{''.join(video_sources)}"]
+    if audio_outputs:
+        graph.append(f"[audio]asplit={audio_outputs}{''.join(audio_sources)}")
+    return args, graph, video_sources, audio_sources
+
+
+def _check_plan(plan, error_handler):
+    try:
+        plan.check()
+    except PreflightError as e:
+        if error_handler:
+            error_handler(str(e))
+        return False
+    return True
+
+
+class ConcatJob:
+    resource = IO_BOUND
+
+    def __init__(self, clip_dir, output_file, skip_unchanged=True, clip_paths=None, scratch_dir=None,
+                 fragmented=False, finalize=True, control=None):
+        self.clip_dir = clip_dir
+        self.output_file = output_file
+        # Concatenates these clips instead of everything in clip_dir
+        self.clip_paths = clip_paths
+        # Keep the existing output when it was built from the same, unchanged clips
+        self.skip_unchanged = skip_unchanged
+        # Temporary files and the output in progress go here instead of next to the output
+        self.scratch_dir = scratch_dir
+        # Write fragmented MP4 so the output can be previewed while the job runs, then optionally remux it to faststart
+        self.fragmented = fragmented
+        self.finalize = finalize
+        self.control = control or JobControl()
+
+    def cancel(self):
+        self.control.cancel()
+
+    def run(self, progress_handler=None, success_handler=None, error_handler=None, message_handler=None):
+        output_path = os.path.abspath(self.output_file)
+        clip_paths = [path for path in self.clip_paths or list_clips(self.clip_dir)
+                      if os.path.abspath(path) != output_path]
+
+        manifest = ConcatManifest.load(self.output_file) if self.skip_unchanged else None
+        if manifest is not None and manifest.is_up_to_date(clip_paths):
+            _notify(message_handler, "Concatenated output is already up to date")
+            if success_handler:
+                success_handler()
+            return
+
+        new_paths = manifest.new_clips(clip_paths) if manifest is not None else None
+        if new_paths:
+            if self.fragmented and not self.finalize and fragment_count(self.output_file):
+                self._append(manifest, new_paths, clip_paths, progress_handler, success_handler, error_handler,
+                             message_handler)
+                return
+            _notify(message_handler, "Rebuilding the whole output, only a fragmented output that is not finalized "
+                                     "can be appended to")
+        self._rebuild(clip_paths, progress_handler, success_handler, error_handler, message_handler)
+
+    def _concat_command(self, timeline, filelist_path, normalized):
+        total_duration = timeline.write_filelist(filelist_path)
+        concat_cmd = [get_ffmpeg_path(), "-f", "concat", "-safe", "0", "-i", filelist_path, "-c", "copy"]
+        if normalized:
+            # MP4 keeps one set of decoder headers per track, repeating them in-band at every keyframe lets the
+            # converted clips and the original ones each decode with their own
+            concat_cmd.extend(["-bsf:v", "dump_extra=freq=keyframe"])
+        return concat_cmd, total_duration
+
+    def _normalized_timeline(self, timeline, normalized_dir, progress_handler, message_handler, reference_path=None):
+        """Returns the timeline with clips in another format swapped for converted copies and {original: converted}.
+
+        Both are None when converting failed.
+        """
+        # The concat demuxer copies streams as they are, clips in another format are converted on their own first
+        normalized = normalize_mismatched_clips([path for path, _ in timeline.clips], normalized_dir,
+                                                control=self.control, progress_handler=progress_handler,
+                                                message_handler=message_handler, reference_path=reference_path)
+        if normalized is None:
+            return None, None
+        return Timeline([(normalized.get(path, path), duration) for path, duration in timeline.clips]), normalized
+
+    def _append(self, manifest, new_paths, clip_paths, progress_handler, success_handler, error_handler,
+                message_handler):
+        """Concatenates only the new clips and appends their fragments to the end of the fragmented output."""
+        timeline = Timeline.from_files(new_paths)
+        plan = OutputPlan(self.output_file, sum(os.path.getsize(path) for path, _ in timeline.clips),
+                          self.scratch_dir)
+        if not _check_plan(plan, error_handler):
+            return
+        output_name = os.path.basename(self.output_file)
+        part_file = os.path.join(plan.work_dir, f".{output_name}.append{os.path.splitext(output_name)[1]}")
+        filelist_path = os.path.join(plan.work_dir, f".{output_name}.filelist.txt")
+        normalized_dir = normalized_clip_dir(plan)
+
+        concat_timeline, normalized = self._normalized_timeline(timeline, normalized_dir, progress_handler,
+                                                                message_handler, reference_path=self.output_file)
+        if concat_timeline is None:
+            if error_handler:
+                error_handler("Converting mismatched clips failed")
+            return
+
+        def cleanup():
+            shutil.rmtree(normalized_dir, ignore_errors=True)
+            for path in (filelist_path, part_file):
+                if os.path.exists(path):
+                    os.remove(path)
+
+        def handle_part_success():
+            try:
+                append_fragments(self.output_file, part_file, manifest.duration)
+            except (Mp4IndexError, OSError) as e:
+                cleanup()
+                _notify(message_handler, f"Could not append to the output ({e}), rebuilding it")
+                self._rebuild(clip_paths, progress_handler, success_handler, error_handler, message_handler)
+                return
+            cleanup()
+            manifest.appended(timeline).save()
+            if success_handler:
+                success_handler()
+
+        def handle_part_error(message="Failed"):
+            cleanup()
+            if error_handler:
+                error_handler(message)
+
+        concat_cmd, total_duration = self._concat_command(concat_timeline, filelist_path, normalized)
+        process = FfmpegWrapper(concat_cmd + _fragmented_args(self.output_file) + [part_file, "-y"],
+                                expected_duration=total_duration, control=self.control)
+
+        _notify(message_handler, f"Appending {len(new_paths)} new clips..")
+        process.run(progress_handler=progress_handler, success_handler=handle_part_success,
+                    error_handler=_ffmpeg_error_handler(handle_part_error))
+
+    def _rebuild(self, clip_paths, progress_handler, success_handler, error_handler, message_handler):
+        timeline = Timeline.from_files(clip_paths)
+        plan = OutputPlan(self.output_file, sum(os.path.getsize(path) for path, _ in timeline.clips),
+                          self.scratch_dir)
+        if not _check_plan(plan, error_handler):
+            return
+
+        normalized_dir = normalized_clip_dir(plan)
+        concat_timeline, normalized = self._normalized_timeline(timeline, normalized_dir, progress_handler,
+                                                                message_handler)
+        if concat_timeline is None:
+            if error_handler:
+                error_handler("Converting mismatched clips failed")
+            return
+
+        filelist_path = os.path.join(plan.work_dir, f".{os.path.basename(self.output_file)}.filelist.txt")
+
+        def handle_concat_success():
+            shutil.rmtree(normalized_dir, ignore_errors=True)
+            ConcatManifest.from_timeline(self.output_file, timeline).save()
+            if success_handler:
+                success_handler()
+
+        handle_success, handle_error = _planned_output(plan, handle_concat_success, error_handler, [filelist_path])
+        if self.fragmented and self.finalize:
+            handle_success = _finalizing(plan.temp_file, handle_success, handle_error, self.control, progress_handler,
+                                         message_handler)
+
+        concat_cmd, total_duration = self._concat_command(concat_timeline, filelist_path, normalized)
+        print(f"Total Duration: {total_duration}")
+        if self.fragmented:
+            concat_cmd.extend(_fragmented_args(self.output_file))
+        process = FfmpegWrapper(concat_cmd + [plan.temp_file, "-y"], expected_duration=total_duration,
+                                control=self.control)
+
+        _notify(message_handler, "Starting concatenation..")
+
+        process.run(progress_handler=progress_handler, success_handler=handle_success,
+                    error_handler=_ffmpeg_error_handler(handle_error))
+
+
+class ProcessJob:
+    def __init__(self, input_file, output_file, start_time, end_time, mute, re_encode, hw_acceleration,
+                 clip_dir=None, smart_cut=False, scratch_dir=None, renditions=None, fragmented=False, finalize=True,
+                 control=None):
+        # When clip_dir is set the trim range is read straight from the clips instead of input_file
+        self.clip_dir = clip_dir
+        self.input_file = input_file
+        self.output_file = output_file
+        self.start_time = start_time
+        self.end_time = end_time
+        self.mute = mute
+        self.re_encode = re_encode
+        self.hw_acceleration = hw_acceleration
+        # Smart cut only applies to stream copies, a full re-encode is frame accurate already
+        self.smart_cut = smart_cut and not re_encode
+        self.scratch_dir = scratch_dir
+        # Extra encoded outputs, made from the same decode as the trim itself
+        self.renditions = renditions or []
+        # Only the single FFmpeg command writes its output progressively, smart cuts and chunked encodes join at the end
+        self.fragmented = fragmented
+        self.finalize = finalize
+        self.control = control or JobControl()
+
+    @property
+    def resource(self):
+        return CPU_BOUND if self.re_encode or self.renditions else IO_BOUND
+
+    def cancel(self):
+        self.control.cancel()
+
+    def run(self, progress_handler=None, success_handler=None, error_handler=None, message_handler=None):
+        segments = self.trim_segments()
+        duration = sum(segment.duration for segment in segments)
+        if duration <= 0:
+            if error_handler:
+                error_handler("Trim range is outside of the clips")
+            return
+
+        re_encode, smart_cut = self.re_encode, self.smart_cut
+        if smart_cut:
+            codec = unsupported_codec([segment.path for segment in segments])
+            if codec:
+                # Copied pieces in one codec cannot be joined with encoded pieces in another
+                _notify(message_handler, f"Smart cut cannot encode {codec}, re-encoding the whole trim instead")
+                re_encode, smart_cut = True, False
+
+        if re_encode:
+            estimated_size = estimate_encode_size(duration, VIDEO_BITRATE, self.mute)
+        else:
+            estimated_size = estimate_copy_size(segments)
+        plan = OutputPlan(self.output_file, estimated_size, self.scratch_dir)
+        if not _check_plan(plan, error_handler):
+            return
+        rendition_plans = [
+            OutputPlan(rendition.output_path(self.output_file),
+                       estimate_encode_size(duration, rendition.bitrate, self.mute), self.scratch_dir)
+            for rendition in self.renditions
+        ]
+        if not all(_check_plan(rendition_plan, error_handler) for rendition_plan in rendition_plans):
+            return
+
+        normalized = {}
+        if self.clip_dir:
+            # The trim reads the clips through the concat demuxer as well, so clips in another format are converted
+            # the same way a concat converts them
+            normalized_dir = normalized_clip_dir(plan)
+            normalized = normalize_mismatched_clips([segment.path for segment in segments], normalized_dir,
+                                                    self.hw_acceleration, self.control, progress_handler,
+                                                    message_handler)
+            if normalized is None:
+                if error_handler:
+                    error_handler("Converting mismatched clips failed")
+                return
+            if normalized:
+                segments = [ClipSegment(normalized.get(segment.path, segment.path), segment.inpoint,
+                                        segment.outpoint, segment.clip_duration) for segment in segments]
+                success_handler = _removing_dir(normalized_dir, success_handler)
+
+        # Renditions need every output in one FFmpeg run, so they always take the single command path
+        if smart_cut and not self.renditions:
+            handle_success, handle_error = _planned_output(plan, success_handler, error_handler)
+            self.run_smart_cut(segments, plan.temp_file, progress_handler, handle_success, handle_error,
+                               message_handler)
+            return
+
+        encoder = select_encoder(hw_acceleration=self.hw_acceleration) if re_encode else None
+        stream_plan = plan_streams(get_probe_service().streams(segments[0].path), re_encode, self.mute,
+                                   self.output_file, encoder.video_args(VIDEO_BITRATE) if encoder else None)
+        _notify(message_handler, stream_plan.describe(duration))
+
+        same_container = os.path.splitext(segments[0].path)[1].lower() == os.path.splitext(self.output_file)[1].lower()
+        if stream_plan.copies_everything and not self.renditions and len(segments) == 1 and \
+                segments[0].is_whole_clip and same_container:
+            # Nothing to cut, drop or convert, so FFmpeg would only rewrite the same file
+            handle_success, handle_error = _planned_output(plan, success_handler, error_handler)
+            _notify(message_handler, "Copying the file as it is..")
+            try:
+                shutil.copyfile(segments[0].path, plan.temp_file)
+            except OSError as e:
+                handle_error(str(e))
+                return
+            handle_success()
+            return
+
+        if encoder and not encoder.hardware and not self.renditions:
+            # Software encodes are split into chunks so every core is busy
+            handle_success, handle_error = _planned_output(plan, success_handler, error_handler)
+            self.run_chunked_encode(encoder, segments, plan.temp_file, progress_handler, handle_success,
+                                    handle_error, message_handler, stream_plan.audio_output_args())
+            return
+
+        duration_args = ["-t", f"{duration:.3f}"] if self.end_time and not self.clip_dir else []
+        hwaccel_args = ["-hwaccel", "auto"] if self.hw_acceleration else []
+        segment_inputs, source_graph = [], []
+        video_sources, audio_sources = ["0:v:0"], []
+        if self.clip_dir and (re_encode or self.renditions):
+            # The concat demuxer starts every clip at the keyframe before its inpoint. That is all a copy can do, but
+            # an encode would keep up to a GOP of frames before every cut. A copied trim still reads the demuxer as
+            # its first input, only the encoded outputs read the segments.
+            encoded_outputs = int(re_encode) + len(self.renditions)
+            segment_inputs, source_graph, video_sources, audio_sources = _segment_sources(
+                segments, int(re_encode) + bool(self.renditions),
+                encoded_outputs if stream_plan.action_for("audio") else 0, hwaccel_args, 0 if re_encode else 1)
+            hwaccel_args = []
+
+        rendition_input_args, rendition_output_args = [], []
+        if self.renditions:
+            rendition_input_args, rendition_output_args = rendition_args(
+                self.renditions, [rendition_plan.temp_file for rendition_plan in rendition_plans],
+                self.hw_acceleration, stream_plan.audio_output_args(filtered=bool(source_graph)), video_sources[-1],
+                duration_args, audio_sources[int(re_encode):] or None, source_graph)
+            _notify(message_handler, f"Also encoding {', '.join(str(rendition) for rendition in self.renditions)}")
+
+        ffmpeg_cmd = [get_ffmpeg_path()] + merge_input_args(
+            encoder.input_args if encoder else [], rendition_input_args, hwaccel_args)
+
+        cleanup_paths = []
+        if self.clip_dir and not re_encode:
+            filelist_path = os.path.join(plan.work_dir, f".{os.path.basename(self.output_file)}.filelist.txt")
+            write_segment_filelist(filelist_path, segments)
+            cleanup_paths.append(filelist_path)
+            ffmpeg_cmd.extend(["-f", "concat", "-safe", "0", "-i", filelist_path])
+        if self.clip_dir:
+            ffmpeg_cmd.extend(segment_inputs)
+        else:
+            # Seeking on the input side skips straight to the start instead of decoding everything before it
+            if self.start_time:
+                ffmpeg_cmd.extend(["-ss", self.start_time])
+            ffmpeg_cmd.extend(["-i", self.input_file])
+            ffmpeg_cmd.extend(duration_args)
+
+        stream_maps = {}
+        if source_graph and re_encode:
+            stream_maps = dict(zip(("video", "audio"), (video_sources[0], *audio_sources[:1])))
+            if not self.renditions:
+                ffmpeg_cmd.extend(["-filter_complex", ";".join(source_graph)])
+        ffmpeg_cmd.extend(stream_plan.output_args(stream_maps))
+        if normalized and stream_plan.action_for("video") and stream_plan.action_for("video").action == COPY:
+            # Converted and original clips each keep their own decoder headers, as in a concat
+            ffmpeg_cmd.extend(["-bsf:v", "dump_extra=freq=keyframe"])
+        if self.fragmented:
+            ffmpeg_cmd.extend(_fragmented_args(self.output_file))
+
+        # overwrite
+        ffmpeg_cmd.extend(["-y", plan.temp_file] + rendition_output_args)
+
+        handle_success, handle_error = _planned_output(plan, success_handler, error_handler, cleanup_paths,
+                                                       rendition_plans)
+        if self.fragmented and self.finalize:
+            handle_success = _finalizing(plan.temp_file, handle_success, handle_error, self.control, progress_handler,
+                                         message_handler)
+        process = FfmpegWrapper(ffmpeg_cmd, expected_duration=duration, control=self.control)
+
+        _notify(message_handler, "Starting processing..")
+
+        process.run(progress_handler=progress_handler, success_handler=handle_success,
+                    error_handler=_ffmpeg_error_handler(handle_error))
+
+    def trim_segments(self):
+        start = parse_time(self.start_time) if self.start_time else 0
+        end = parse_time(self.end_time) if self.end_time else None
+
+        if self.clip_dir:
+            timeline = Timeline.from_directory(self.clip_dir)
+        else:
+            timeline = Timeline.from_files([self.input_file])
+        return timeline.segments(start, end)
+
+    def run_smart_cut(self, segments, output_file, progress_handler, success_handler, error_handler,
+                      message_handler):
+        cutter = SmartCutter(segments, output_file, self.mute, self.hw_acceleration, control=self.control)
+
+        _notify(message_handler, "Starting smart cut..")
+
+        cutter.run(progress_handler=progress_handler, success_handler=success_handler,
+                   error_handler=_ffmpeg_error_handler(error_handler))
+
+    def run_chunked_encode(self, profile, segments, output_file, progress_handler, success_handler, error_handler,
+                           message_handler, audio_args=None):
+        encoder = ChunkedEncoder(segments, output_file, profile.video_args(VIDEO_BITRATE), self.mute,
+                                 audio_args=audio_args, control=self.control)
+
+        _notify(message_handler, f"Starting encode with {encoder.workers} workers..")
+
+        encoder.run(progress_handler=progress_handler, success_handler=success_handler,
+                    error_handler=_ffmpeg_error_handler(error_handler))
@@ -4,11 +4,22 @@ import os
 
 from PyQt5.QtGui import QIcon
 from PyQt5.QtWidgets import QApplication, QMainWindow, QFileDialog, QLabel, QLineEdit, QPushButton, QVBoxLayout, \
-    QWidget, QCheckBox, QFrame, QMessageBox
-
-from concatenation_thread import ConcatenationThread
-from process_thread import ProcessThread
+    QWidget, QCheckBox, QFrame, QMessageBox, QComboBox
+
+from audio_analysis import AudioHighlightJob
+from camera_grouping import camera_concat_jobs, camera_output_path, group_cameras
+from highlight_export import HighlightExportJob, parse_highlights
+from job_signals import JobSignals
+from jobs import ConcatJob, ProcessJob, partial_output
+from motion_scan import MotionScanJob
+from proxy import ProxyJob, ThumbnailIndex, current_proxy
+from renditions import PRESETS
+from scheduler import JobScheduler, QUEUED, RUNNING
+from scrubber import ScrubberDialog
+from suggestions_dialog import RangeSuggestionsDialog
 from time_utilities import TimeUtilitiesDialog
+from timeline import list_clips
+from watch_folder import FolderWatcher
 
 
 def open_video(video_path):
@@ -24,14 +35,15 @@ def open_video(video_path):
 class MainWindow(QMainWindow):
     def __init__(self):
         super().__init__()
-        self.process_thread = None
         self.output_dir = None
+        self.scratch_dir = None
         self.clip_dir = None
         self.end_time = None
         self.start_time = None
         self.process_file = None
         self.concatenated_file = None
-        self.concatenation_thread = None
+        self.scheduler = JobScheduler()
+        self.watcher = None
         self.setWindowTitle("Video Trimming and Concatenation Tool")
         self.setWindowIcon(self.load_icon("icon.png"))
         self.setGeometry(100, 100, 600, 400)
@@ -51,13 +63,30 @@ class MainWindow(QMainWindow):
         self.output_dir_button = QPushButton("Browse")
         self.output_dir_button.clicked.connect(self.browse_output_dir)
 
+        self.scratch_dir_label = QLabel("Scratch Directory (optional, a fast drive for work in progress):")
+        self.scratch_dir_input = QLineEdit()
+        self.scratch_dir_button = QPushButton("Browse")
+        self.scratch_dir_button.clicked.connect(self.browse_scratch_dir)
+
         self.reencode_checkbox = QCheckBox("Re-encode")
         self.mute_checkbox = QCheckBox("Mute")
         self.hw_acceleration_checkbox = QCheckBox("HW Acceleration")
+        self.smart_cut_checkbox = QCheckBox("Smart Cut (frame accurate copy)")
+        self.review_rendition_checkbox = QCheckBox("Also Export 720p Review Copy")
+        self.social_rendition_checkbox = QCheckBox("Also Export 540p Social Copy")
 
         self.process_button = QPushButton("Process")
         self.process_button.clicked.connect(self.process)
 
+        self.export_highlights_button = QPushButton("Export Highlights...")
+        self.export_highlights_button.clicked.connect(self.export_highlights)
+
+        self.loud_moments_button = QPushButton("Find Loud Moments...")
+        self.loud_moments_button.clicked.connect(self.find_loud_moments)
+
+        self.motion_button = QPushButton("Find Motion...")
+        self.motion_button.clicked.connect(self.find_motion)
+
         self.start_time_label = QLabel("Start Time (HH:MM:SS):")
         self.start_time_input = TimeLineEdit()
 
@@ -67,9 +96,26 @@ class MainWindow(QMainWindow):
         self.concat_button = QPushButton("Concat Videos")
         self.concat_button.clicked.connect(self.concat_videos)
 
+        self.watch_checkbox = QCheckBox("Watch Clip Directory (concat as clips are copied in)")
+        self.watch_checkbox.toggled.connect(self.toggle_watch)
+
+        self.proxy_checkbox = QCheckBox("Build Preview Proxy")
+        self.split_cameras_checkbox = QCheckBox("One Output per Camera")
+        self.split_cameras_checkbox.toggled.connect(self.refresh_cameras)
+        self.camera_label = QLabel("Camera to trim, preview and analyse:")
+        self.camera_combo = QComboBox()
+        self.camera_combo.setEnabled(False)
+        self.fragmented_checkbox = QCheckBox("Fragmented Output (preview while running)")
+
         self.preview_button = QPushButton("Preview Video")
         self.preview_button.clicked.connect(self.show_preview)
 
+        self.scrub_button = QPushButton("Scrub Preview...")
+        self.scrub_button.clicked.connect(self.open_scrubber)
+
+        self.cancel_jobs_button = QPushButton("Cancel All Jobs")
+        self.cancel_jobs_button.clicked.connect(self.cancel_jobs)
+
         self.time_utilities_button = QPushButton("Time Utilities")
         self.time_utilities_button.clicked.connect(self.open_time_utilities)
 
@@ -83,20 +129,38 @@ class MainWindow(QMainWindow):
         layout.addWidget(self.output_dir_input)
         layout.addWidget(self.output_dir_button)
 
+        layout.addWidget(self.scratch_dir_label)
+        layout.addWidget(self.scratch_dir_input)
+        layout.addWidget(self.scratch_dir_button)
+
         layout.addWidget(self.concat_button)
+        layout.addWidget(self.watch_checkbox)
+        layout.addWidget(self.proxy_checkbox)
+        layout.addWidget(self.split_cameras_checkbox)
+        layout.addWidget(self.camera_label)
+        layout.addWidget(self.camera_combo)
+        layout.addWidget(self.fragmented_checkbox)
         layout.addWidget(self.preview_button)
+        layout.addWidget(self.scrub_button)
 
         layout.addWidget(self.reencode_checkbox)
         layout.addWidget(self.mute_checkbox)
         layout.addWidget(self.hw_acceleration_checkbox)
+        layout.addWidget(self.smart_cut_checkbox)
+        layout.addWidget(self.review_rendition_checkbox)
+        layout.addWidget(self.social_rendition_checkbox)
 
         # In the layout
+        layout.addWidget(self.loud_moments_button)
+        layout.addWidget(self.motion_button)
         layout.addWidget(self.start_time_label)
         layout.addWidget(self.start_time_input)
         layout.addWidget(self.end_time_label)
         layout.addWidget(self.end_time_input)
 
         layout.addWidget(self.process_button)
+        layout.addWidget(self.export_highlights_button)
+        layout.addWidget(self.cancel_jobs_button)
         layout.addWidget(self.separator)
         layout.addWidget(self.time_utilities_button)
 
@@ -120,6 +184,11 @@ class MainWindow(QMainWindow):
         if directory:
             self.output_dir_input.setText(directory)
 
+    def browse_scratch_dir(self):
+        directory = QFileDialog.getExistingDirectory(self, "Select Scratch Directory")
+        if directory:
+            self.scratch_dir_input.setText(directory)
+
     def concat_videos(self):
         self.set_fields()
 
@@ -133,18 +202,114 @@ class MainWindow(QMainWindow):
             self.display_error_message(error_message)
             return
 
-        # Start the concatenation thread
-        self.concatenation_thread = ConcatenationThread(self.clip_dir, self.concatenated_file)
-        self.setup_connections(self.concatenation_thread)
-        self.concatenation_thread.start()
+        fragmented = self.fragmented_checkbox.isChecked()
+        if self.split_cameras_checkbox.isChecked():
+            # Each camera is its own job, so the scheduler runs them side by side
+            camera_jobs = camera_concat_jobs(self.clip_dir, self.concatenated_file, scratch_dir=self.scratch_dir,
+                                             fragmented=fragmented)
+            self.set_cameras([camera_name for camera_name, _, _ in camera_jobs])
+            for camera_name, camera_output, job in camera_jobs:
+                self.submit_job(job, f"Concat {camera_name}",
+                                f"Concatenated {camera_name} into {os.path.basename(camera_output)}")
+        else:
+            self.submit_job(ConcatJob(self.clip_dir, self.concatenated_file, scratch_dir=self.scratch_dir,
+                                      fragmented=fragmented), "Concat", "Concatenation completed successfully!")
+        if self.proxy_checkbox.isChecked():
+            # Reads the clips directly, so it runs alongside the concat instead of after it
+            self.submit_job(ProxyJob(self.output_dir, clip_paths=self.active_clip_paths(),
+                                     scratch_dir=self.scratch_dir), "Preview proxy", "Preview proxy is ready")
+
+    def refresh_cameras(self, checked=None):
+        self.set_fields()
+        if self.split_cameras_checkbox.isChecked() and os.path.isdir(self.clip_dir):
+            self.set_cameras([camera.name for camera in group_cameras(list_clips(self.clip_dir))])
+        else:
+            self.set_cameras([])
+
+    def set_cameras(self, camera_names):
+        current = self.camera_combo.currentText()
+        self.camera_combo.clear()
+        # A single camera keeps the plain output name, there is nothing to choose
+        if len(camera_names) > 1:
+            self.camera_combo.addItems(camera_names)
+            if current in camera_names:
+                self.camera_combo.setCurrentText(current)
+        self.camera_combo.setEnabled(self.camera_combo.count() > 0)
+
+    def active_concatenated_file(self):
+        """The concatenated output of the selected camera, or the one output when clips are not split by camera."""
+        if self.split_cameras_checkbox.isChecked() and self.camera_combo.count():
+            return camera_output_path(self.concatenated_file, self.camera_combo.currentText())
+        return self.concatenated_file
+
+    def active_clip_paths(self):
+        """The clips of the selected camera, or every clip when clips are not split by camera."""
+        clip_paths = list_clips(self.clip_dir)
+        if self.split_cameras_checkbox.isChecked() and self.camera_combo.count():
+            camera_name = self.camera_combo.currentText()
+            for camera in group_cameras(clip_paths):
+                if camera.name == camera_name:
+                    return camera.clip_paths
+        return clip_paths
+
+    def current_proxy(self):
+        """The preview proxy when it was built from the clips of the active output, None when it is out of date."""
+        if not os.path.isdir(self.clip_dir):
+            return None
+        return current_proxy(self.output_dir, self.active_clip_paths())
+
+    def toggle_watch(self, checked):
+        if self.watcher is not None:
+            self.watcher.stop()
+            self.watcher = None
+        if not checked:
+            self.statusBar().showMessage("Stopped watching the clip directory")
+            return
+
+        self.set_fields()
+        if not os.path.isdir(self.clip_dir) or not os.path.isdir(self.output_dir):
+            self.display_error_message("Choose a valid clip directory and output directory first")
+            self.watch_checkbox.setChecked(False)
+            return
+
+        signals = JobSignals("Watch concat", "Concatenated output is up to date")
+        self.setup_connections(signals)
+        self.watcher = FolderWatcher(self.clip_dir, self.concatenated_file, self.scheduler,
+                                     scratch_dir=self.scratch_dir, progress_handler=signals.handle_progress_info,
+                                     success_handler=signals.handle_success, error_handler=signals.handle_error,
+                                     message_handler=signals.progress_message.emit)
+        self.watcher.start()
 
     def show_preview(self):
         self.set_fields()
-        open_video(self.concatenated_file)
+        # A fragmented job still running is what the user wants to check, ahead of the finished outputs
+        concatenated_file = self.active_concatenated_file()
+        for output_file in (concatenated_file, self.process_file):
+            partial_file = partial_output(output_file, self.scratch_dir)
+            if partial_file:
+                self.statusBar().showMessage(f"Previewing {os.path.basename(output_file)} while it is being written")
+                open_video(partial_file)
+                return
+        proxy_file = self.current_proxy()
+        open_video(proxy_file or concatenated_file)
+
+    def open_scrubber(self):
+        self.set_fields()
+        # The thumbnails are taken from the proxy, so they are only as current as the proxy is
+        thumbnail_index = ThumbnailIndex.load(self.output_dir) if self.current_proxy() else None
+        if thumbnail_index is None:
+            self.display_error_message("No up to date preview proxy, check Build Preview Proxy and concat first")
+            return
+
+        scrubber = ScrubberDialog(thumbnail_index, self)
+        scrubber.start_time_selected.connect(self.start_time_input.setText)
+        scrubber.end_time_selected.connect(self.end_time_input.setText)
+        scrubber.show()
 
     def set_fields(self):
         self.clip_dir = self.clip_dir_input.text()
         self.output_dir = self.output_dir_input.text()
+        self.scratch_dir = self.scratch_dir_input.text() or None
         self.start_time = self.start_time_input.text()
         self.end_time = self.end_time_input.text()
 
@@ -154,34 +319,129 @@ class MainWindow(QMainWindow):
         self.concatenated_file = os.path.join(self.output_dir, "concatenated_output.mp4")
         self.process_file = os.path.join(self.output_dir, "process_output.mp4")
 
+    def trim_source(self):
+        """Returns (valid, input_file, clip_dir), clip_dir is None when input_file has to be used instead."""
+        input_file = self.active_concatenated_file()
+        # The clips of several cameras interleave in clip_dir, only a camera's own output is one timeline
+        split = input_file != self.concatenated_file
+        # Otherwise read straight from the clips when they are available so the full concatenation is never needed
+        if not split and os.path.isdir(self.clip_dir) and list_clips(self.clip_dir):
+            return True, input_file, self.clip_dir
+        if not os.path.isfile(input_file):
+            error_message = f"Invalid concatenated file: {input_file}"
+            if split:
+                error_message += ", concat the cameras first"
+            self.display_error_message(error_message)
+            return False, None, None
+        return True, input_file, None
+
     def process(self):
         self.set_fields()
 
         re_encode = self.reencode_checkbox.isChecked()
         mute = self.mute_checkbox.isChecked()
         hw_acceleration = self.hw_acceleration_checkbox.isChecked()
+        smart_cut = self.smart_cut_checkbox.isChecked()
+        renditions = []
+        if self.review_rendition_checkbox.isChecked():
+            renditions.append(PRESETS["review"])
+        if self.social_rendition_checkbox.isChecked():
+            renditions.append(PRESETS["social"])
 
         if not os.path.isdir(self.output_dir):
             error_message = f"Invalid output directory: {self.output_dir}"
             self.display_error_message(error_message)
             return
 
-        if not os.path.isfile(self.concatenated_file):
-            error_message = f"Invalid concatenated file: {self.concatenated_file}"
+        valid, input_file, clip_dir = self.trim_source()
+        if not valid:
+            return
+
+        job = ProcessJob(input_file, self.process_file, self.start_time, self.end_time, mute, re_encode,
+                         hw_acceleration, clip_dir=clip_dir, smart_cut=smart_cut, scratch_dir=self.scratch_dir,
+                         renditions=renditions, fragmented=self.fragmented_checkbox.isChecked())
+        self.submit_job(job, "Process", "Process completed successfully!")
+
+    def export_highlights(self):
+        self.set_fields()
+
+        if not os.path.isdir(self.output_dir):
+            error_message = f"Invalid output directory: {self.output_dir}"
             self.display_error_message(error_message)
             return
 
-        # Start the concatenation thread
-        self.process_thread = ProcessThread(self.concatenated_file, self.process_file, self.start_time, self.end_time,
-                                            mute, re_encode, hw_acceleration)
-        self.setup_connections(self.process_thread)
-        self.process_thread.start()
+        valid, input_file, clip_dir = self.trim_source()
+        if not valid:
+            return
 
-    def setup_connections(self, thread):
-        # Setup connections once the thread is created somewhere like in concat_videos
-        thread.progress_update.connect(self.update_progress_bar)
-        thread.progress_message.connect(self.display_progress_message)
-        thread.finished.connect(self.process_finished)
+        ranges_file, _ = QFileDialog.getOpenFileName(self, "Select Highlight Ranges (start,end,name)", self.output_dir,
+                                                     "Highlight ranges (*.csv *.txt);;All files (*)")
+        if not ranges_file:
+            return
+
+        try:
+            highlights = parse_highlights(ranges_file)
+        except (OSError, ValueError) as e:
+            self.display_error_message(f"Could not read highlight ranges: {e}")
+            return
+
+        job = HighlightExportJob(highlights, self.output_dir, mute=self.mute_checkbox.isChecked(),
+                                 re_encode=self.reencode_checkbox.isChecked(),
+                                 hw_acceleration=self.hw_acceleration_checkbox.isChecked(),
+                                 input_file=input_file, clip_dir=clip_dir, scratch_dir=self.scratch_dir)
+        self.submit_job(job, "Highlight export")
+
+    def find_loud_moments(self):
+        self.set_fields()
+        valid, input_file, clip_dir = self.trim_source()
+        if valid:
+            self.submit_suggestion_job(AudioHighlightJob(input_file=input_file, clip_dir=clip_dir),
+                                       "Audio analysis", "Loud Moments")
+
+    def find_motion(self):
+        self.set_fields()
+        valid, input_file, clip_dir = self.trim_source()
+        if valid:
+            self.submit_suggestion_job(MotionScanJob(input_file=input_file, clip_dir=clip_dir),
+                                       "Motion scan", "Motion")
+
+    def submit_suggestion_job(self, job, label, title):
+        signals = self.submit_job(job, label, f"{label} completed successfully!")
+
+        def suggestions_finished(success, message):
+            if success:
+                self.show_suggestions(job.highlights, title)
+
+        signals.finished.connect(suggestions_finished)
+
+    def show_suggestions(self, highlights, title):
+        dialog = RangeSuggestionsDialog(highlights, title, self)
+        dialog.range_selected.connect(self.set_trim_range)
+        dialog.show()
+
+    def set_trim_range(self, start_time, end_time):
+        self.start_time_input.setText(start_time)
+        self.end_time_input.setText(end_time)
+
+    def submit_job(self, job, label, success_message=None):
+        signals = JobSignals(label, success_message)
+        self.setup_connections(signals)
+        self.scheduler.submit(job, name=label, progress_handler=signals.handle_progress_info,
+                              success_handler=signals.handle_success, error_handler=signals.handle_error,
+                              message_handler=signals.progress_message.emit)
+
+        queued = len(self.scheduler.jobs(QUEUED))
+        if queued:
+            self.statusBar().showMessage(f"{label} queued ({queued} waiting)")
+        return signals
+
+    def cancel_jobs(self):
+        self.scheduler.cancel_all()
+
+    def setup_connections(self, signals):
+        signals.progress_update.connect(self.update_progress_bar)
+        signals.progress_message.connect(self.display_progress_message)
+        signals.finished.connect(self.process_finished)
 
     def update_progress_bar(self, value):
         # self.progress_bar.setValue(value)
@@ -191,10 +451,19 @@ class MainWindow(QMainWindow):
         self.statusBar().showMessage(message)
 
     def process_finished(self, success, message):
+        running = len(self.scheduler.jobs(RUNNING))
+        queued = len(self.scheduler.jobs(QUEUED))
+        if running or queued:
+            message = f"{message} ({running} running, {queued} queued)"
         self.statusBar().showMessage(message)
 
     def open_time_utilities(self):
-        time_utilities_dialog = TimeUtilitiesDialog(self)
+        self.set_fields()
+        input_file = self.active_concatenated_file()
+        clip_dir = self.clip_dir if input_file == self.concatenated_file else None
+        time_utilities_dialog = TimeUtilitiesDialog(self, clip_dir=clip_dir, input_file=input_file,
+                                                   submit_job=self.submit_job)
+        time_utilities_dialog.range_selected.connect(self.set_trim_range)
         time_utilities_dialog.setWindowIcon(self.load_icon('icon.png'))
         time_utilities_dialog.show()
 
@@ -0,0 +1,124 @@
+import time
+
+import numpy as np
+
+from ffmpeg_pipe import FfmpegPipe
+from job_control import CPU_BOUND, JobControl
+from range_suggestions import suggest_ranges
+
+# Tiny grayscale frames are enough to tell an empty scene from one with people moving through it
+SCAN_WIDTH = 64
+SCAN_HEIGHT = 36
+SCAN_FPS = 2
+# Frames compared per NumPy batch, the ring buffer holds one more for the last frame of the previous batch
+BATCH_FRAMES = 256
+# Mean absolute difference in gray levels below which a change is treated as sensor noise
+MIN_ACTIVITY = 1.0
+NOISE_FACTOR = 4
+
+
+class ActivityTimeline:
+    def __init__(self, times, scores, frame_interval=1 / SCAN_FPS):
+        self.times = times
+        self.scores = scores
+        self.frame_interval = frame_interval
+
+    @property
+    def duration(self):
+        return float(self.times[-1] + self.frame_interval) if len(self.times) else 0.0
+
+
+def frame_differences(frames):
+    """Mean absolute difference of every frame to the one before it, frames[0] being the previous batch's last."""
+    frames = frames.astype(np.int16)
+    return np.abs(frames[1:] - frames[:-1]).mean(axis=(1, 2))
+
+
+class MotionScanJob:
+    """Scores motion on a decimated grayscale stream and suggests the ranges where something happens."""
+
+    resource = CPU_BOUND
+
+    def __init__(self, input_file=None, clip_dir=None, threshold=None, max_ranges=20, control=None):
+        self.input_file = input_file
+        self.clip_dir = clip_dir
+        self.threshold = threshold
+        self.max_ranges = max_ranges
+        self.control = control or JobControl()
+        self.activity = None
+        self.highlights = []
+
+    def cancel(self):
+        self.control.cancel()
+
+    def run(self, progress_handler=None, success_handler=None, error_handler=None, message_handler=None):
+        if message_handler:
+            message_handler("Scanning for motion..")
+
+        self.activity = self.scan(progress_handler)
+        if self.activity is None or self.control.cancelled:
+            if error_handler:
+                error_handler("Motion scan failed")
+            return
+
+        threshold = self.threshold
+        if threshold is None:
+            threshold = self.default_threshold(self.activity.scores)
+        self.highlights = suggest_ranges(self.activity.times, self.activity.scores, threshold,
+                                         self.activity.frame_interval, self.activity.duration, padding_before=2,
+                                         padding_after=2, merge_gap=5, max_ranges=self.max_ranges,
+                                         name_prefix="motion")
+
+        if message_handler:
+            message_handler(f"Found {len(self.highlights)} ranges with motion above {threshold:.2f}")
+        if success_handler:
+            success_handler()
+
+    @staticmethod
+    def default_threshold(scores):
+        if not len(scores):
+            return MIN_ACTIVITY
+        # Mostly empty footage puts the median at the noise floor
+        median = np.median(scores)
+        deviation = np.median(np.abs(scores - median))
+        return max(median + NOISE_FACTOR * deviation, median * 2, MIN_ACTIVITY)
+
+    def scan(self, progress_handler=None):
+        """Returns an ActivityTimeline with one score per scanned frame, read in constant memory."""
+        pipe = FfmpegPipe(["-an", "-sn", "-dn", "-map", "0:v:0",
+                           "-vf", f"fps={SCAN_FPS},scale={SCAN_WIDTH}:{SCAN_HEIGHT}:flags=area,format=gray",
+                           "-f", "rawvideo"],
+                          input_file=self.input_file, clip_dir=self.clip_dir, control=self.control,
+                          log_name="motion_scan")
+        frame_interval = 1 / SCAN_FPS
+
+        # Slot 0 keeps the last frame of the previous batch so differences carry across batch boundaries
+        ring = np.zeros((BATCH_FRAMES + 1, SCAN_HEIGHT, SCAN_WIDTH), dtype=np.uint8)
+        frame_bytes = SCAN_WIDTH * SCAN_HEIGHT
+        score_blocks = []
+        frames_read = 0
+
+        start = time.perf_counter()
+        for byte_count in pipe.read_into(ring[1:]):
+            count = byte_count // frame_bytes
+            if not count:
+                continue
+            scores = frame_differences(ring[:count + 1])
+            if frames_read == 0:
+                scores[0] = 0  # The first frame has nothing to compare to
+            score_blocks.append(scores.astype(np.float32))
+            ring[0] = ring[count]
+            frames_read += count
+
+            if progress_handler and pipe.duration > 0:
+                seconds = frames_read * frame_interval
+                elapsed = time.perf_counter() - start
+                speed = seconds / elapsed if elapsed > 0 else 0
+                eta = max(pipe.duration - seconds, 0) / speed if speed else None
+                progress_handler(min(seconds / pipe.duration * 100, 100), round(speed, 1), eta, None)
+
+        if pipe.returncode != 0:
+            return None
+
+        scores = np.concatenate(score_blocks) if score_blocks else np.empty(0, dtype=np.float32)
+        return ActivityTimeline(np.arange(len(scores)) * frame_interval, scores, frame_interval)
@@ -0,0 +1,527 @@
+import mmap
+import struct
+import sys
+from array import array
+from datetime import datetime, timedelta
+
+# MP4 creation times count seconds from midnight, January 1 1904 UTC
+MP4_EPOCH = datetime(1904, 1, 1)
+CONTAINER_BOXES = {b"moov", b"trak", b"mdia", b"minf", b"stbl", b"edts"}
+TOP_LEVEL_BOXES = {b"ftyp", b"moov", b"mdat", b"free", b"skip", b"wide", b"uuid", b"pdin", b"meta"}
+
+
+class Mp4IndexError(Exception):
+    pass
+
+
+def _uint32_array(data):
+    # Sample tables are big-endian 32-bit integers, byteswap once instead of unpacking them one by one
+    values = array("I")
+    if values.itemsize != 4:
+        values = array("L")
+    values.frombytes(data)
+    if sys.byteorder == "little":
+        values.byteswap()
+    return values
+
+
+def _int32_array(data):
+    values = array("i")
+    if values.itemsize != 4:
+        values = array("l")
+    values.frombytes(data)
+    if sys.byteorder == "little":
+        values.byteswap()
+    return values
+
+
+def _boxes(buffer, start, end):
+    """Yields (type, payload start, box end) for the boxes between start and end, reading only their headers."""
+    position = start
+    while position + 8 <= end:
+        size, box_type = struct.unpack_from(">I4s", buffer, position)
+        header = 8
+        if size == 1:
+            if position + 16 > end:
+                raise Mp4IndexError("Truncated box header")
+            size = struct.unpack_from(">Q", buffer, position + 8)[0]
+            header = 16
+        elif size == 0:
+            size = end - position
+        if size < header or position + size > end:
+            raise Mp4IndexError(f"Box {box_type!r} runs past its parent")
+        yield box_type, position + header, position + size
+        position += size
+
+
+def _find(buffer, start, end, box_type):
+    for found_type, payload, box_end in _boxes(buffer, start, end):
+        if found_type == box_type:
+            return payload, box_end
+    return None
+
+
+class Track:
+    def __init__(self, handler, timescale, duration):
+        self.handler = handler
+        self.timescale = timescale
+        self.duration = duration
+        self.stts = None  # (sample counts, sample deltas)
+        self.ctts = None  # (sample counts, composition offsets)
+        self.stss = None  # 1-based sync sample numbers, None when every sample is a sync sample
+        self.media_time = 0  # First edit list entry, where presentation starts in the media
+        self.empty_edit = 0  # Leading empty edit in movie timescale units
+        self.tmcd = None  # (frame duration, frames per second) of a timecode track
+        self.first_chunk_offset = None
+
+
+class Mp4Index:
+    """Duration, creation time, timecode and keyframe times of an MP4, read straight from its moov box."""
+
+    def __init__(self, duration, creation_time, timecode=None, keyframes_ms=None, video_duration=None):
+        self.duration = duration
+        self.creation_time = creation_time
+        self.timecode = timecode
+        self.keyframes_ms = keyframes_ms if keyframes_ms is not None else array("q")
+        self.video_duration = video_duration
+
+    @property
+    def keyframes(self):
+        return [keyframe / 1000 for keyframe in self.keyframes_ms]
+
+    @classmethod
+    def read(cls, path):
+        """Raises Mp4IndexError for anything that is not a plain, non-fragmented MP4/MOV."""
+        with open(path, "rb") as f:
+            try:
+                buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                raise Mp4IndexError("Empty file")
+        try:
+            return cls._parse(buffer)
+        except struct.error as e:
+            raise Mp4IndexError(f"Truncated box: {e}")
+        finally:
+            buffer.close()
+
+    @classmethod
+    def _parse(cls, buffer):
+        if len(buffer) < 8 or buffer[4:8] not in TOP_LEVEL_BOXES:
+            raise Mp4IndexError("Not an MP4 file")
+        moov = _find(buffer, 0, len(buffer), b"moov")
+        if moov is None:
+            raise Mp4IndexError("No moov box")
+        if _find(buffer, moov[0], moov[1], b"mvex") is not None:
+            raise Mp4IndexError("Fragmented MP4, the sample tables are in the fragments")
+
+        mvhd = _find(buffer, moov[0], moov[1], b"mvhd")
+        if mvhd is None:
+            raise Mp4IndexError("No mvhd box")
+        creation, movie_timescale, movie_duration = cls._parse_header(buffer, mvhd[0])
+        if not movie_timescale:
+            raise Mp4IndexError("Movie timescale is zero")
+
+        tracks = [cls._parse_track(buffer, payload, end, movie_timescale)
+                  for box_type, payload, end in _boxes(buffer, moov[0], moov[1]) if box_type == b"trak"]
+
+        video = next((track for track in tracks if track.handler == b"vide"), None)
+        keyframes_ms = cls._keyframes_ms(video, movie_timescale) if video and video.stts else array("q")
+        timecode_track = next((track for track in tracks if track.tmcd and track.first_chunk_offset is not None), None)
+        timecode = cls._timecode(buffer, timecode_track) if timecode_track else None
+        creation_time = (MP4_EPOCH + timedelta(seconds=creation)).strftime("%Y-%m-%dT%H:%M:%S.000000Z") \
+            if creation else None
+        video_duration = video.duration / video.timescale if video and video.timescale else None
+        return cls(movie_duration / movie_timescale, creation_time, timecode, keyframes_ms, video_duration)
+
+    @staticmethod
+    def _parse_header(buffer, payload):
+        """Returns (creation time, timescale, duration) of an mvhd or mdhd box."""
+        version = buffer[payload]
+        if version == 1:
+            creation, _, timescale, duration = struct.unpack_from(">QQIQ", buffer, payload + 4)
+        else:
+            creation, _, timescale, duration = struct.unpack_from(">IIII", buffer, payload + 4)
+        return creation, timescale, duration
+
+    @classmethod
+    def _parse_track(cls, buffer, start, end, movie_timescale):
+        mdia = _find(buffer, start, end, b"mdia")
+        if mdia is None:
+            return Track(None, 0, 0)
+        mdhd = _find(buffer, mdia[0], mdia[1], b"mdhd")
+        hdlr = _find(buffer, mdia[0], mdia[1], b"hdlr")
+        _, timescale, duration = cls._parse_header(buffer, mdhd[0]) if mdhd else (0, 0, 0)
+        track = Track(bytes(buffer[hdlr[0] + 8:hdlr[0] + 12]) if hdlr else None, timescale, duration)
+
+        edts = _find(buffer, start, end, b"edts")
+        elst = _find(buffer, edts[0], edts[1], b"elst") if edts else None
+        if elst:
+            cls._parse_edit_list(buffer, elst[0], track)
+
+        minf = _find(buffer, mdia[0], mdia[1], b"minf")
+        stbl = _find(buffer, minf[0], minf[1], b"stbl") if minf else None
+        if stbl is None:
+            return track
+        for box_type, payload, box_end in _boxes(buffer, stbl[0], stbl[1]):
+            count = struct.unpack_from(">I", buffer, payload + 4)[0] if box_end - payload >= 8 else 0
+            table = payload + 8
+            if box_type == b"stts":
+                runs = _uint32_array(buffer[table:table + count * 8])
+                track.stts = (runs[0::2], runs[1::2])
+            elif box_type == b"ctts":
+                runs = _int32_array(buffer[table:table + count * 8])
+                # Version 0 offsets are unsigned, but encoders only ever write small positive values there
+                track.ctts = (runs[0::2], runs[1::2])
+            elif box_type == b"stss":
+                track.stss = _uint32_array(buffer[table:table + count * 4])
+            elif box_type == b"stsd" and track.handler == b"tmcd" and count:
+                # tmcd sample entry: size, type, 6 reserved, data reference index, 4 reserved, flags, timescale,
+                # frame duration, frames per second
+                entry = table
+                tmcd_timescale, frame_duration, frames = struct.unpack_from(">IIB", buffer, entry + 8 + 8 + 8)
+                if tmcd_timescale and frames:
+                    track.tmcd = (frame_duration / tmcd_timescale, frames)
+            elif box_type in (b"stco", b"co64") and count:
+                if box_type == b"stco":
+                    track.first_chunk_offset = struct.unpack_from(">I", buffer, table)[0]
+                else:
+                    track.first_chunk_offset = struct.unpack_from(">Q", buffer, table)[0]
+        return track
+
+    @staticmethod
+    def _parse_edit_list(buffer, payload, track):
+        version = buffer[payload]
+        count = struct.unpack_from(">I", buffer, payload + 4)[0]
+        position = payload + 8
+        entry_format, entry_size = (">Qq", 16) if version == 1 else (">Ii", 8)
+        for _ in range(count):
+            segment_duration, media_time = struct.unpack_from(entry_format, buffer, position)
+            position += entry_size + 4  # media rate
+            if media_time == -1:
+                track.empty_edit += segment_duration
+                continue
+            track.media_time = media_time
+            break
+
+    @staticmethod
+    def _keyframes_ms(track, movie_timescale):
+        """Presentation times of the sync samples in milliseconds, decoded by walking the run-length tables once."""
+        counts, deltas = track.stts
+        total_samples = sum(counts)
+        sync_samples = track.stss if track.stss is not None else range(1, total_samples + 1)
+        if track.ctts:
+            ctts_counts, ctts_offsets = track.ctts
+        else:
+            ctts_counts, ctts_offsets = (), ()
+        shift = track.empty_edit * track.timescale / movie_timescale - track.media_time
+
+        keyframes = array("q")
+        run, run_first, dts = 0, 1, 0  # stts run, its first sample number and that sample's decode time
+        ctts_run, ctts_first = 0, 1
+        for sample in sync_samples:
+            while run < len(counts) and sample >= run_first + counts[run]:
+                dts += counts[run] * deltas[run]
+                run_first += counts[run]
+                run += 1
+            if run >= len(counts):
+                break
+            sample_dts = dts + (sample - run_first) * deltas[run]
+            offset = 0
+            while ctts_run < len(ctts_counts) and sample >= ctts_first + ctts_counts[ctts_run]:
+                ctts_first += ctts_counts[ctts_run]
+                ctts_run += 1
+            if ctts_run < len(ctts_counts):
+                offset = ctts_offsets[ctts_run]
+            pts = (sample_dts + offset + shift) / track.timescale
+            keyframes.append(round(pts * 1000))
+        return keyframes
+
+    @staticmethod
+    def _timecode(buffer, track):
+        """Formats the first frame number of a timecode track as HH:MM:SS:FF."""
+        offset = track.first_chunk_offset
+        if offset + 4 > len(buffer):
+            return None
+        frame_number = struct.unpack_from(">I", buffer, offset)[0]
+        frames = track.tmcd[1]
+        seconds, frame = divmod(frame_number, frames)
+        minutes, seconds = divmod(seconds, 60)
+        hours, minutes = divmod(minutes, 60)
+        return f"{hours % 24:02d}:{minutes:02d}:{seconds:02d}:{frame:02d}"
+
+
+def fragment_count(path):
+    """Number of complete fragments in a fragmented MP4, 0 for anything else.
+
+    A fragment is a moof box followed by the mdat holding its samples. Safe on a file FFmpeg is still writing, a
+    fragment only counts once its mdat is complete.
+    """
+    try:
+        with open(path, "rb") as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return 0
+    count = 0
+    fragmented = False
+    pending_moof = False
+    try:
+        for box_type, payload, end in _boxes(buffer, 0, len(buffer)):
+            if box_type == b"moov":
+                fragmented = _find(buffer, payload, end, b"mvex") is not None
+                if not fragmented:
+                    return 0
+            elif box_type == b"moof" and fragmented:
+                pending_moof = True
+            elif box_type == b"mdat" and pending_moof:
+                count += 1
+                pending_moof = False
+    except (Mp4IndexError, struct.error):
+        pass
+    finally:
+        buffer.close()
+    return count
+
+
+class _Fragmented:
+    """The track layout and fragments of a fragmented MP4, read for append_fragments."""
+
+    def __init__(self, buffer):
+        self.buffer = buffer
+        self.tracks = {}  # track id: [timescale, default sample duration]
+        self.fragments = []  # (moof payload, moof end, mdat end)
+        self.tail = len(buffer)  # Where the fragments end, a trailing mfra index is dropped when appending
+        moof = None
+        for box_type, payload, end in _boxes(buffer, 0, len(buffer)):
+            if box_type == b"moov":
+                self._parse_moov(payload, end)
+            elif box_type == b"moof":
+                moof = (payload, end)
+            elif box_type == b"mdat" and moof is not None:
+                self.fragments.append((moof[0], moof[1], end))
+                moof = None
+            elif box_type == b"mfra":
+                self.tail = payload - 8
+            elif box_type == b"sidx":
+                raise Mp4IndexError("Segment indexes would no longer match the appended fragments")
+        if not self.tracks:
+            raise Mp4IndexError("Not a fragmented MP4")
+        if not self.fragments:
+            raise Mp4IndexError("No complete fragments")
+        if self.fragments[-1][2] != self.tail:
+            raise Mp4IndexError("Unexpected data after the last fragment")
+
+    def _parse_moov(self, start, end):
+        if _find(self.buffer, start, end, b"mvex") is None:
+            raise Mp4IndexError("Not a fragmented MP4")
+        for box_type, payload, box_end in _boxes(self.buffer, start, end):
+            if box_type == b"trak":
+                tkhd = _find(self.buffer, payload, box_end, b"tkhd")
+                mdia = _find(self.buffer, payload, box_end, b"mdia")
+                mdhd = _find(self.buffer, mdia[0], mdia[1], b"mdhd") if mdia else None
+                if tkhd is None or mdhd is None:
+                    raise Mp4IndexError("Track without a header")
+                track_id_offset = 20 if self.buffer[tkhd[0]] == 1 else 12
+                track_id = struct.unpack_from(">I", self.buffer, tkhd[0] + track_id_offset)[0]
+                self.tracks.setdefault(track_id, [0, 0])[0] = Mp4Index._parse_header(self.buffer, mdhd[0])[1]
+            elif box_type == b"mvex":
+                for mvex_type, trex, _ in _boxes(self.buffer, payload, box_end):
+                    if mvex_type == b"trex":
+                        track_id, _, duration = struct.unpack_from(">III", self.buffer, trex + 4)
+                        self.tracks.setdefault(track_id, [0, 0])[1] = duration
+
+    def track_fragments(self, moof_start, moof_end):
+        """Yields (track id, tfdt payload, sample durations, first trun payload) for every track fragment."""
+        for box_type, payload, end in _boxes(self.buffer, moof_start, moof_end):
+            if box_type != b"traf":
+                continue
+            tfhd = _find(self.buffer, payload, end, b"tfhd")
+            tfdt = _find(self.buffer, payload, end, b"tfdt")
+            if tfhd is None or tfdt is None:
+                raise Mp4IndexError("Track fragment without a header or decode time")
+            flags, track_id = struct.unpack_from(">II", self.buffer, tfhd[0])
+            flags &= 0xFFFFFF
+            if flags & 0x1:
+                raise Mp4IndexError("Track fragment with an absolute base data offset")
+            if track_id not in self.tracks:
+                raise Mp4IndexError(f"Track fragment for unknown track {track_id}")
+            default_duration = self.tracks[track_id][1]
+            if flags & 0x8:
+                default_duration = struct.unpack_from(">I", self.buffer, tfhd[0] + 8 + (4 if flags & 0x2 else 0))[0]
+            durations = []
+            first_trun = None
+            for traf_type, trun, _ in _boxes(self.buffer, payload, end):
+                if traf_type != b"trun":
+                    continue
+                first_trun = first_trun or trun
+                trun_flags, count = struct.unpack_from(">II", self.buffer, trun)
+                trun_flags &= 0xFFFFFF
+                if not trun_flags & 0x100:
+                    durations.extend([default_duration] * count)
+                    continue
+                fields = bin(trun_flags & 0xF00).count("1")
+                table = trun + 8 + (4 if trun_flags & 0x1 else 0) + (4 if trun_flags & 0x4 else 0)
+                durations.extend(_uint32_array(self.buffer[table:table + count * fields * 4])[0::fields])
+            yield track_id, tfdt[0], durations, first_trun
+
+    def sequence_number(self, moof_start, moof_end):
+        mfhd = _find(self.buffer, moof_start, moof_end, b"mfhd")
+        return struct.unpack_from(">I", self.buffer, mfhd[0] + 4)[0] if mfhd else 0
+
+
+def _decode_time(buffer, tfdt):
+    return struct.unpack_from(">Q" if buffer[tfdt] == 1 else ">I", buffer, tfdt + 4)[0]
+
+
+def _read_fragmented(path):
+    with open(path, "rb") as f:
+        try:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            raise Mp4IndexError("Empty file")
+    try:
+        return _Fragmented(buffer)
+    except struct.error as e:
+        buffer.close()
+        raise Mp4IndexError(f"Truncated box: {e}")
+    except Mp4IndexError:
+        buffer.close()
+        raise
+
+
+def _sample_table(moof, trun):
+    flags = struct.unpack_from(">I", moof, trun)[0] & 0xFFFFFF
+    return flags, trun + 8 + (4 if flags & 0x1 else 0) + (4 if flags & 0x4 else 0)
+
+
+def _shorten_first_sample(moof, trun, durations, delta):
+    """Shortens the first sample of the trun box whose payload starts at trun in moof by delta ticks.
+
+    A trun without per sample durations gets them written out, which grows the moof, so the box sizes and the data
+    offsets into the mdat behind it move along.
+    """
+    flags, table = _sample_table(moof, trun)
+    if durations[0] <= delta:
+        raise Mp4IndexError("The first sample is too short to start later")
+    if flags & 0x100:
+        struct.pack_into(">I", moof, table, durations[0] - delta)
+        return
+
+    count = struct.unpack_from(">I", moof, trun + 4)[0]
+    record_size = bin(flags & 0xF00).count("1") * 4
+    size = struct.unpack_from(">I", moof, trun - 8)[0]
+    records = bytearray()
+    for index in range(count):
+        records += struct.pack(">I", durations[index] - (delta if index == 0 else 0))
+        records += moof[table + index * record_size:table + (index + 1) * record_size]
+    growth = count * 4
+    header = bytearray(moof[trun - 8:table])
+    struct.pack_into(">II", header, 0, size + growth, struct.unpack_from(">I", header, 4)[0])
+    struct.pack_into(">I", header, 8, (struct.unpack_from(">I", header, 8)[0] & 0xFF000000) | flags | 0x100)
+
+    traf_start = next(payload - 8 for box_type, payload, end in _boxes(moof, 8, len(moof))
+                      if box_type == b"traf" and payload <= trun < end)
+    moof[trun - 8:trun - 8 + size] = header + records
+    for box_start in (0, traf_start):
+        if struct.unpack_from(">I", moof, box_start)[0] == 1:
+            raise Mp4IndexError("64-bit box sizes are not supported")
+        struct.pack_into(">I", moof, box_start, struct.unpack_from(">I", moof, box_start)[0] + growth)
+    for box_type, payload, end in _boxes(moof, 8, len(moof)):
+        if box_type != b"traf":
+            continue
+        tfhd = _find(moof, payload, end, b"tfhd")
+        if not struct.unpack_from(">I", moof, tfhd[0])[0] & 0x20000:
+            raise Mp4IndexError("Track fragment data is not addressed from its moof")
+        for traf_type, run, _ in _boxes(moof, payload, end):
+            if traf_type == b"trun" and struct.unpack_from(">I", moof, run)[0] & 0x1:
+                struct.pack_into(">i", moof, run + 8, struct.unpack_from(">i", moof, run + 8)[0] + growth)
+
+
+def _shifted_fragments(output, part, offset):
+    """Part's moof boxes rewritten to continue output's sequence numbers and timestamps, offset seconds later.
+
+    A first sample that would decode before the output's last one starts right after it instead, shortened so the
+    samples behind it keep their times, like the concat demuxer does at a clip boundary.
+    """
+    last_decode_times = {}
+    for moof_start, moof_end, _ in output.fragments:
+        for track_id, tfdt, durations, _ in output.track_fragments(moof_start, moof_end):
+            if durations:
+                last_decode_times[track_id] = _decode_time(output.buffer, tfdt) + sum(durations) - durations[-1]
+    sequence = output.sequence_number(*output.fragments[-1][:2])
+
+    moofs = []
+    first_fragment = set()
+    for moof_start, moof_end, _ in part.fragments:
+        moof = bytearray(part.buffer[moof_start - 8:moof_end])
+        base = moof_start - 8
+        sequence += 1
+        mfhd = _find(part.buffer, moof_start, moof_end, b"mfhd")
+        if mfhd:
+            struct.pack_into(">I", moof, mfhd[0] - base + 4, sequence)
+        shortened = []
+        for track_id, tfdt, durations, first_trun in part.track_fragments(moof_start, moof_end):
+            decode_time = _decode_time(part.buffer, tfdt) + round(offset * output.tracks[track_id][0])
+            last = last_decode_times.get(track_id)
+            if track_id not in first_fragment and last is not None and durations and decode_time <= last:
+                delta = last + 1 - decode_time
+                shortened.append((first_trun - base, durations, delta))
+                decode_time += delta
+            first_fragment.add(track_id)
+            if part.buffer[tfdt] == 1:
+                struct.pack_into(">Q", moof, tfdt - base + 4, decode_time)
+            elif decode_time <= 0xFFFFFFFF:
+                struct.pack_into(">I", moof, tfdt - base + 4, decode_time)
+            else:
+                raise Mp4IndexError(f"Track {track_id} decode time does not fit its fragment header")
+        # From the back, so growing one trun does not move the ones still to do
+        for trun, durations, delta in sorted(shortened, reverse=True):
+            _shorten_first_sample(moof, trun, durations, delta)
+        moofs.append(bytes(moof))
+    return moofs
+
+
+def append_fragments(path, part_path, offset, chunk_size=8 * 1024 * 1024):
+    """Appends the fragments of the fragmented MP4 part_path to the fragmented MP4 at path, offset seconds in.
+
+    Both files must come from the same muxer with the same tracks, like two concats of clips in one format. Only the
+    small moof headers are rewritten, the media data is copied as it is. Raises Mp4IndexError, leaving path untouched,
+    when the files cannot be joined this way.
+    """
+    output = _read_fragmented(path)
+    try:
+        part = _read_fragmented(part_path)
+        try:
+            if {track_id: track[0] for track_id, track in part.tracks.items()} != \
+                    {track_id: track[0] for track_id, track in output.tracks.items()}:
+                raise Mp4IndexError("The tracks differ")
+            moofs = _shifted_fragments(output, part, offset)
+            tail_start = output.tail
+            tail = bytes(output.buffer[tail_start:])
+            mdats = [(moof_end, mdat_end) for _, moof_end, mdat_end in part.fragments]
+        except struct.error as e:
+            raise Mp4IndexError(f"Truncated box: {e}")
+        finally:
+            part.buffer.close()
+    finally:
+        output.buffer.close()
+
+    with open(path, "r+b") as f, open(part_path, "rb") as source:
+        try:
+            f.seek(tail_start)
+            for moof, (mdat_start, mdat_end) in zip(moofs, mdats):
+                f.write(moof)
+                source.seek(mdat_start)
+                remaining = mdat_end - mdat_start
+                while remaining:
+                    data = source.read(min(chunk_size, remaining))
+                    if not data:
+                        raise Mp4IndexError("The part ended early")
+                    f.write(data)
+                    remaining -= len(data)
+            f.truncate()
+        except BaseException:
+            # Put back what was there, the output stays the file it was before
+            f.seek(tail_start)
+            f.write(tail)
+            f.truncate()
+            raise
@@ -0,0 +1,107 @@
+import os
+import shutil
+
+# Headroom on top of the estimate, container overhead and bitrate spikes
+SPACE_MARGIN = 1.1
+MIN_FREE_BYTES = 200 * 1024 * 1024
+AUDIO_BITRATE = 192_000
+
+
+class PreflightError(Exception):
+    pass
+
+
+def parse_bitrate(bitrate):
+    """Converts FFmpeg style bitrates such as "5M" or "800k" to bits per second."""
+    bitrate = str(bitrate).strip()
+    multipliers = {"k": 1_000, "m": 1_000_000, "g": 1_000_000_000}
+    if bitrate and bitrate[-1].lower() in multipliers:
+        return float(bitrate[:-1]) * multipliers[bitrate[-1].lower()]
+    return float(bitrate)
+
+
+def format_size(size):
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024:
+            return f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} TB"
+
+
+def estimate_copy_size(segments):
+    """A stream copy is about as large as the part of each source file it covers."""
+    total = 0
+    for segment in segments:
+        if segment.clip_duration > 0:
+            total += os.path.getsize(segment.path) * segment.duration / segment.clip_duration
+    return int(total)
+
+
+def estimate_encode_size(duration, video_bitrate, mute=False):
+    bits_per_second = parse_bitrate(video_bitrate) + (0 if mute else AUDIO_BITRATE)
+    return int(duration * bits_per_second / 8)
+
+
+def _existing_dir(path):
+    path = os.path.abspath(path)
+    while not os.path.isdir(path):
+        path = os.path.dirname(path)
+    return path
+
+
+def check_free_space(directory, needed):
+    directory = _existing_dir(directory)
+    free = shutil.disk_usage(directory).free
+    required = needed * SPACE_MARGIN + MIN_FREE_BYTES
+    if free < required:
+        raise PreflightError(f"Not enough free space in {directory}: about {format_size(required)} needed, "
+                             f"{format_size(free)} free")
+
+
+class OutputPlan:
+    """Writes an output to a temporary file, optionally on a faster scratch volume, and moves it into place at the end.
+
+    The final path only ever holds a complete file, a failed or cancelled run leaves nothing half-written behind.
+    """
+
+    def __init__(self, output_file, estimated_size=0, scratch_dir=None):
+        self.output_file = os.path.abspath(output_file)
+        self.estimated_size = estimated_size
+        output_dir, output_name = os.path.split(self.output_file)
+        self.work_dir = os.path.abspath(scratch_dir) if scratch_dir else output_dir
+        # The name only depends on the output, so resumable work next to it is found again on the next run
+        self.temp_file = os.path.join(self.work_dir, f".{output_name}.partial{os.path.splitext(output_name)[1]}")
+
+    @property
+    def uses_scratch(self):
+        return self.work_dir != os.path.dirname(self.output_file)
+
+    def check(self):
+        """Raises PreflightError when the estimated output will not fit."""
+        os.makedirs(self.work_dir, exist_ok=True)
+        output_dir = os.path.dirname(self.output_file)
+        if self.uses_scratch and os.stat(self.work_dir).st_dev != os.stat(_existing_dir(output_dir)).st_dev:
+            check_free_space(self.work_dir, self.estimated_size)
+        check_free_space(output_dir, self.estimated_size)
+
+    def commit(self):
+        output_dir = os.path.dirname(self.output_file)
+        if os.stat(self.work_dir).st_dev == os.stat(output_dir).st_dev:
+            os.replace(self.temp_file, self.output_file)
+            return
+
+        # Across volumes the copy lands next to the output first, so the final rename is still atomic
+        output_name = os.path.basename(self.output_file)
+        staging_file = os.path.join(output_dir, f".{output_name}.partial{os.path.splitext(output_name)[1]}")
+        try:
+            shutil.copyfile(self.temp_file, staging_file)
+            os.replace(staging_file, self.output_file)
+        except OSError:
+            if os.path.exists(staging_file):
+                os.remove(staging_file)
+            raise
+        os.remove(self.temp_file)
+
+    def discard(self):
+        if os.path.exists(self.temp_file):
+            os.remove(self.temp_file)
@@ -0,0 +1,180 @@
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from ffmpeg import probe
+
+from ffmpeg_binaries import get_ffprobe_path
+from mp4_index import Mp4Index, Mp4IndexError
+from utils import get_cache_dir
+
+MAX_PROBE_WORKERS = 8
+
+
+class ProbeService:
+    """Runs ffprobe on a bounded thread pool and remembers the results on disk, keyed by path, size and mtime.
+
+    Durations and keyframes of plain MP4s are read from the file's own index without starting ffprobe.
+    """
+
+    def __init__(self, cache_path=None, max_workers=None):
+        if cache_path is None:
+            cache_path = os.path.join(get_cache_dir(), "probe_cache.sqlite")
+        if max_workers is None:
+            max_workers = min(MAX_PROBE_WORKERS, os.cpu_count() or 1)
+
+        self.max_workers = max_workers
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(cache_path, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS probes ("
+                "path TEXT NOT NULL, kind TEXT NOT NULL, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, "
+                "data TEXT NOT NULL, PRIMARY KEY (path, kind))"
+            )
+
+        if sys.platform.startswith("win"):
+            self.creationflags = subprocess.CREATE_NO_WINDOW
+        else:
+            self.creationflags = 0
+
+    def probe(self, path):
+        return self._cached(path, "probe", lambda: probe(path, cmd=get_ffprobe_path()))
+
+    def probe_many(self, paths):
+        """Probes all paths in parallel, returning results in the same order with None for files that failed."""
+        def probe_or_none(path):
+            try:
+                return self.probe(path)
+            except Exception as e:
+                print(f"Error probing {os.path.basename(path)}: {e}")
+                return None
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return list(executor.map(probe_or_none, paths))
+
+    def index(self, path):
+        """Returns {"duration", "creation_time", "timecode"} from the MP4 index, or None when ffprobe is needed."""
+        data = self._load(path, "index")
+        if data is not None:
+            return data or None
+        try:
+            mp4_index = Mp4Index.read(path)
+        except (Mp4IndexError, OSError) as e:
+            print(f"Falling back to ffprobe for {os.path.basename(path)}: {e}")
+            self._store(path, "index", {})
+            return None
+        data = {"duration": mp4_index.duration, "creation_time": mp4_index.creation_time,
+                "timecode": mp4_index.timecode}
+        self._store(path, "index", data)
+        if mp4_index.keyframes_ms:
+            self._store(path, "keyframes", mp4_index.keyframes)
+        return data
+
+    def duration(self, path):
+        index = self.index(path)
+        if index is not None and index["duration"] > 0:
+            return index["duration"]
+        return float(self.probe(path)["format"]["duration"])
+
+    def durations(self, paths):
+        """Returns the duration of every path in order, None for files that could not be read."""
+        def duration_or_none(path):
+            try:
+                return self.duration(path)
+            except Exception as e:
+                print(f"Error reading video duration for {os.path.basename(path)}: {e}")
+                return None
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return list(executor.map(duration_or_none, paths))
+
+    def streams(self, path, codec_type=None):
+        streams = self.probe(path)["streams"]
+        if codec_type is None:
+            return streams
+        return [stream for stream in streams if stream.get("codec_type") == codec_type]
+
+    def video_stream(self, path):
+        video_streams = self.streams(path, "video")
+        return video_streams[0] if video_streams else None
+
+    def codec_name(self, path, codec_type="video"):
+        streams = self.streams(path, codec_type)
+        return streams[0].get("codec_name") if streams else None
+
+    def keyframes(self, path, read_intervals=None):
+        """Returns sorted keyframe timestamps of the first video stream, optionally only inside read_intervals."""
+        if read_intervals is None:
+            if self._load(path, "keyframes") is None:
+                self.index(path)  # Stores the keyframes as well when the file has an MP4 index
+            return self._cached(path, "keyframes", lambda: self._probe_keyframes(path))
+
+        # A full index answers any window, otherwise only read the requested parts of the file
+        cached = self._load(path, "keyframes")
+        if cached is None and self.index(path) is not None:
+            cached = self._load(path, "keyframes")
+        if cached is not None:
+            return cached
+        return self._probe_keyframes(path, read_intervals)
+
+    def _probe_keyframes(self, path, read_intervals=None):
+        command = [get_ffprobe_path(), "-v", "error", "-select_streams", "v:0"]
+        if read_intervals:
+            command.extend(["-read_intervals", read_intervals])
+        command.extend(["-show_entries", "packet=pts_time,flags", "-of", "csv=p=0", path])
+
+        output = subprocess.check_output(command, creationflags=self.creationflags).decode()
+
+        keyframes = set()
+        for line in output.splitlines():
+            pts_time, _, flags = line.partition(",")
+            if "K" in flags and pts_time not in ("", "N/A"):
+                keyframes.add(float(pts_time))
+        return sorted(keyframes)
+
+    def _file_key(self, path):
+        stat = os.stat(path)
+        return os.path.abspath(path), stat.st_size, stat.st_mtime_ns
+
+    def _load(self, path, kind):
+        abs_path, size, mtime_ns = self._file_key(path)
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT size, mtime_ns, data FROM probes WHERE path = ? AND kind = ?", (abs_path, kind)
+            ).fetchone()
+        if row is None or row[0] != size or row[1] != mtime_ns:
+            return None
+        return json.loads(row[2])
+
+    def _store(self, path, kind, data):
+        abs_path, size, mtime_ns = self._file_key(path)
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO probes (path, kind, size, mtime_ns, data) VALUES (?, ?, ?, ?, ?)",
+                (abs_path, kind, size, mtime_ns, json.dumps(data))
+            )
+
+    def _cached(self, path, kind, compute):
+        data = self._load(path, kind)
+        if data is None:
+            data = compute()
+            self._store(path, kind, data)
+        return data
+
+
+_probe_service = None
+_probe_service_lock = threading.Lock()
+
+
+def get_probe_service():
+    global _probe_service
+    with _probe_service_lock:
+        if _probe_service is None:
+            _probe_service = ProbeService()
+        return _probe_service
@@ -0,0 +1,213 @@
+import bisect
+import json
+import os
+import re
+
+from concat_manifest import file_state
+from ffmpeg_binaries import get_ffmpeg_path
+from ffmpeg_wrapper import FfmpegWrapper
+from job_control import CPU_BOUND, JobControl
+from preflight import OutputPlan, PreflightError, estimate_encode_size
+from timeline import Timeline, list_clips
+
+PROXY_HEIGHT = 360
+PROXY_BITRATE = "600k"
+THUMBNAIL_WIDTH = 320
+# At most one thumbnail per this many seconds, taken from the first keyframe after each step
+THUMBNAIL_INTERVAL = 2
+
+SHOWINFO_PATTERN = re.compile(r"Parsed_showinfo.*\bn:\s*(\d+)\s+pts:\s*\S+\s+pts_time:\s*([-\d.]+)")
+
+
+def preview_dir(output_dir):
+    return os.path.join(output_dir, "preview")
+
+
+def proxy_path(output_dir):
+    return os.path.join(preview_dir(output_dir), "proxy.mp4")
+
+
+def _source_path(output_dir):
+    return os.path.join(preview_dir(output_dir), "source.json")
+
+
+def _source_state(source_paths):
+    try:
+        return [file_state(path) for path in source_paths]
+    except OSError:
+        return None
+
+
+def current_proxy(output_dir, source_paths):
+    """The proxy in output_dir when it was built from exactly these files and none of them changed, otherwise None."""
+    try:
+        with open(_source_path(output_dir)) as f:
+            recorded = json.load(f)
+    except (OSError, ValueError):
+        return None
+    state = _source_state(source_paths)
+    if state is None or recorded != state or not os.path.isfile(proxy_path(output_dir)):
+        return None
+    return proxy_path(output_dir)
+
+
+class ThumbnailIndex:
+    """Keyframe thumbnails of the preview, sorted by their time in seconds."""
+
+    def __init__(self, directory, times, files, duration):
+        self.directory = directory
+        self.times = times
+        self.files = files
+        self.duration = duration
+
+    @classmethod
+    def load(cls, output_dir):
+        directory = os.path.join(preview_dir(output_dir), "thumbnails")
+        try:
+            with open(os.path.join(directory, "index.json")) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return cls(directory, data["times"], data["files"], data["duration"])
+
+    def save(self):
+        with open(os.path.join(self.directory, "index.json"), "w") as f:
+            json.dump({"duration": self.duration, "times": self.times, "files": self.files}, f)
+
+    def nearest(self, position):
+        """Returns (time, thumbnail path) of the last thumbnail at or before position."""
+        if not self.times:
+            return None
+        index = max(bisect.bisect_right(self.times, position) - 1, 0)
+        return self.times[index], os.path.join(self.directory, self.files[index])
+
+
+class ProxyJob:
+    """Builds a small preview proxy and a keyframe thumbnail index, decoding the source once for both."""
+
+    resource = CPU_BOUND
+
+    def __init__(self, output_dir, input_file=None, clip_dir=None, clip_paths=None, scratch_dir=None, control=None):
+        self.output_dir = output_dir
+        self.input_file = input_file
+        self.clip_dir = clip_dir
+        # Builds the proxy from these clips instead of everything in clip_dir, such as one camera's
+        self.clip_paths = clip_paths
+        self.scratch_dir = scratch_dir
+        self.control = control or JobControl()
+
+    def cancel(self):
+        self.control.cancel()
+
+    def source_paths(self):
+        if self.input_file:
+            return [self.input_file]
+        return self.clip_paths or list_clips(self.clip_dir)
+
+    def run(self, progress_handler=None, success_handler=None, error_handler=None, message_handler=None):
+        source_paths = self.source_paths()
+        if current_proxy(self.output_dir, source_paths) and ThumbnailIndex.load(self.output_dir) is not None:
+            if message_handler:
+                message_handler("Preview proxy is already up to date")
+            if success_handler:
+                success_handler()
+            return
+
+        thumbnail_dir = os.path.join(preview_dir(self.output_dir), "thumbnails")
+        os.makedirs(thumbnail_dir, exist_ok=True)
+        for name in os.listdir(thumbnail_dir):
+            os.remove(os.path.join(thumbnail_dir, name))
+        # The old proxy no longer matches anything until this one is done
+        if os.path.exists(_source_path(self.output_dir)):
+            os.remove(_source_path(self.output_dir))
+
+        timeline = Timeline.from_files(source_paths)
+        duration = timeline.total_duration
+        plan = OutputPlan(proxy_path(self.output_dir), estimate_encode_size(duration, PROXY_BITRATE),
+                          self.scratch_dir)
+        try:
+            plan.check()
+        except PreflightError as e:
+            if error_handler:
+                error_handler(str(e))
+            return
+
+        command = [get_ffmpeg_path()]
+        filelist_path = None
+        if self.input_file:
+            command.extend(["-i", self.input_file])
+        else:
+            filelist_path = os.path.join(preview_dir(self.output_dir), "filelist.txt")
+            timeline.write_filelist(filelist_path)
+            command.extend(["-f", "concat", "-safe", "0", "-i", filelist_path])
+
+        # One decode feeds both outputs, showinfo logs the time of every thumbnail that is written
+        select = f"eq(pict_type\\,I)*(isnan(prev_selected_t)+gte(t-prev_selected_t\\,{THUMBNAIL_INTERVAL}))"
+        command.extend([
+            "-filter_complex",
+            f"[0:v:0]split=2[proxy_in][thumbnail_in];"
+            f"[proxy_in]scale=-2:{PROXY_HEIGHT}[proxy];"
+            f"[thumbnail_in]select='{select}',scale={THUMBNAIL_WIDTH}:-2,showinfo[thumbnails]",
+            "-map", "[proxy]", "-map", "0:a:0?",
+            "-c:v", "libx264", "-preset", "veryfast", "-b:v", PROXY_BITRATE,
+            # Frequent keyframes keep seeking in the proxy instant
+            "-force_key_frames", "expr:gte(t,n_forced*1)",
+            "-c:a", "aac", "-b:a", "64k", "-ac", "2",
+            plan.temp_file,
+            "-map", "[thumbnails]", "-fps_mode", "passthrough", "-q:v", "5",
+            os.path.join(thumbnail_dir, "thumb_%05d.jpg"),
+            "-y"
+        ])
+
+        log_path = os.path.join(preview_dir(self.output_dir), "ffmpeg_log.txt")
+        if os.path.exists(log_path):
+            os.remove(log_path)
+
+        def handle_success():
+            try:
+                plan.commit()
+            except OSError as e:
+                plan.discard()
+                if error_handler:
+                    error_handler(f"Could not move the preview proxy into place: {e}")
+                return
+            index = self._read_index(log_path, thumbnail_dir, duration)
+            index.save()
+            with open(_source_path(self.output_dir), "w") as f:
+                json.dump(_source_state(source_paths), f)
+            if message_handler:
+                message_handler(f"Preview proxy ready with {len(index.times)} thumbnails")
+            if success_handler:
+                success_handler()
+
+        def handle_error():
+            plan.discard()
+            if error_handler:
+                error_handler("Building the preview proxy failed")
+
+        if message_handler:
+            message_handler("Building preview proxy..")
+
+        process = FfmpegWrapper(command, expected_duration=duration, control=self.control)
+        try:
+            process.run(progress_handler=progress_handler, ffmpeg_output_file=log_path, success_handler=handle_success,
+                        error_handler=handle_error)
+        finally:
+            if filelist_path and os.path.exists(filelist_path):
+                os.remove(filelist_path)
+
+    def _read_index(self, log_path, thumbnail_dir, duration):
+        times = {}
+        with open(log_path, errors="replace") as f:
+            for line in f:
+                match = SHOWINFO_PATTERN.search(line)
+                if match:
+                    times[int(match.group(1))] = float(match.group(2))
+
+        # The image muxer numbers its files from 1 in the order showinfo saw the frames
+        entries = []
+        for frame, time in sorted(times.items()):
+            file_name = f"thumb_{frame + 1:05d}.jpg"
+            if os.path.exists(os.path.join(thumbnail_dir, file_name)):
+                entries.append((time, file_name))
+        return ThumbnailIndex(thumbnail_dir, [time for time, _ in entries], [name for _, name in entries], duration)
@@ -0,0 +1,50 @@
+import numpy as np
+
+from highlight_export import Highlight
+
+
+def suggest_ranges(times, scores, threshold, window, total_duration, padding_before=5, padding_after=3,
+                   merge_gap=3, min_duration=0, max_ranges=None, name_prefix="suggestion"):
+    """Turns per-window scores into highlight ranges around every stretch at or above threshold.
+
+    times holds the start of each window in seconds. Stretches closer than merge_gap are joined, and the strongest
+    max_ranges are returned as Highlights in time order.
+    """
+    times = np.asarray(times, dtype=np.float64)
+    scores = np.asarray(scores, dtype=np.float64)
+    if not len(scores):
+        return []
+
+    above = np.concatenate(([0], (scores >= threshold).astype(np.int8), [0]))
+    edges = np.diff(above)
+    run_starts = np.flatnonzero(edges == 1)
+    run_ends = np.flatnonzero(edges == -1)
+
+    ranges = []  # [start, end, strength]
+    for run_start, run_end in zip(run_starts, run_ends):
+        start = times[run_start]
+        end = times[run_end - 1] + window
+        strength = scores[run_start:run_end].max()
+        if ranges and start - ranges[-1][1] <= merge_gap:
+            ranges[-1][1] = end
+            ranges[-1][2] = max(ranges[-1][2], strength)
+        else:
+            ranges.append([start, end, strength])
+
+    padded = []
+    for start, end, strength in ranges:
+        if end - start < min_duration:
+            continue
+        start = max(start - padding_before, 0)
+        end = min(end + padding_after, total_duration)
+        # Padding can make neighbours overlap
+        if padded and start <= padded[-1][1]:
+            padded[-1][1] = end
+            padded[-1][2] = max(padded[-1][2], strength)
+        else:
+            padded.append([start, end, strength])
+
+    if max_ranges is not None:
+        padded = sorted(sorted(padded, key=lambda item: -item[2])[:max_ranges], key=lambda item: item[0])
+    return [Highlight(float(start), float(end), f"{name_prefix}_{index + 1}")
+            for index, (start, end, _) in enumerate(padded)]
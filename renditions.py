@@ -0,0 +1,78 @@
+import os
+import re
+
+from hardware_encoder_util import merge_input_args, select_encoder, split_filter_args
+
+RENDITION_PATTERN = re.compile(r"^(?:([\w-]+)=)?(\d+)p?(?::(\d+(?:\.\d+)?[kKmM]?))?(?::(h264|hevc))?$")
+
+
+class Rendition:
+    """An extra output of a trim at its own height, bitrate and codec, encoded from the same decode as the trim."""
+
+    def __init__(self, name, height, bitrate="2M", codec="h264"):
+        self.name = name
+        self.height = height
+        self.bitrate = bitrate
+        self.codec = codec
+
+    def output_path(self, output_file):
+        stem, extension = os.path.splitext(output_file)
+        return f"{stem}_{self.name}{extension}"
+
+    def __repr__(self):
+        return f"Rendition({self.name!r}, {self.height}p, {self.bitrate}, {self.codec})"
+
+
+PRESETS = {
+    "review": Rendition("review", 720, "2M"),
+    "social": Rendition("social", 540, "1500k"),
+}
+
+
+def parse_rendition(value):
+    """Reads a preset name or "[name=]HEIGHT[:BITRATE[:CODEC]]", for example "review" or "square=1080:4M:hevc"."""
+    value = value.strip()
+    if value in PRESETS:
+        return PRESETS[value]
+    match = RENDITION_PATTERN.match(value)
+    if not match:
+        raise ValueError(f"Unrecognised rendition: {value}, expected a preset ({', '.join(PRESETS)}) "
+                         f"or [name=]HEIGHT[:BITRATE[:CODEC]]")
+    name, height, bitrate, codec = match.groups()
+    return Rendition(name or f"{height}p", int(height), bitrate or "2M", codec or "h264")
+
+
+def _graph_input(spec):
+    # Filter outputs are already labelled, input streams are given as "0:v:0"
+    return spec if spec.startswith("[") else f"[{spec}]"
+
+
+def rendition_args(renditions, output_files, hw_acceleration=False, audio_args=("-an",), video_input="0:v:0",
+                   common_args=(), audio_inputs=None, source_graph=()):
+    """Returns (input args, output args) that encode every rendition from one decode of video_input.
+
+    The filter graph splits the decoded video once per rendition and scales each branch down, never up.
+    common_args, such as a duration limit, are repeated for every output. When video_input and audio_inputs, one
+    per rendition, are filter outputs, source_graph holds the filters that make them.
+    """
+    input_args = []
+    branches = []
+    outputs = []
+    for index, (rendition, output_file) in enumerate(zip(renditions, output_files)):
+        encoder = select_encoder(rendition.codec, hw_acceleration)
+        input_args = merge_input_args(input_args, encoder.input_args)
+        video_args, encoder_filter = split_filter_args(encoder.video_args(rendition.bitrate))
+
+        branch = f"[r{index}]scale=w=-2:h='min(ih,{rendition.height})'"
+        if encoder_filter:
+            branch += f",{encoder_filter}"
+        branches.append(f"{branch}[r{index}out]")
+
+        outputs.extend(["-map", f"[r{index}out]"] + video_args)
+        if list(audio_args) != ["-an"]:
+            outputs.extend(["-map", audio_inputs[index] if audio_inputs else "0:a:0?"])
+        outputs.extend(list(audio_args) + list(common_args) + [output_file])
+
+    labels = "".join(f"[r{index}]" for index in range(len(renditions)))
+    graph = ";".join(list(source_graph) + [f"{_graph_input(video_input)}split={len(renditions)}{labels}"] + branches)
+    return input_args, ["-filter_complex", graph] + outputs
@@ -0,0 +1,174 @@
+import heapq
+import itertools
+import threading
+import time
+
+from job_control import CPU_BOUND, IO_BOUND
+from telemetry import record
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+# Re-encodes already use every core, stream copies mostly wait on the disk
+DEFAULT_LIMITS = {
+    CPU_BOUND: 1,
+    IO_BOUND: 2,
+}
+
+
+class ScheduledJob:
+    def __init__(self, job_id, job, name, priority, resource, handlers):
+        self.id = job_id
+        self.job = job
+        self.name = name
+        self.priority = priority
+        self.resource = resource
+        self.state = QUEUED
+        self.message = None
+        self.queued_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._handlers = handlers
+
+    @property
+    def done(self):
+        return self.state in (SUCCEEDED, FAILED, CANCELLED)
+
+    def __repr__(self):
+        return f"ScheduledJob({self.id}, {self.name!r}, {self.state})"
+
+
+class JobScheduler:
+    """Queues jobs and runs them on worker threads, with a separate concurrency limit per resource class.
+
+    Higher priorities start first, jobs of equal priority start in submission order. Every job gets its FFmpeg
+    children started at lower OS priority unless low_priority is turned off.
+    """
+
+    def __init__(self, limits=None, low_priority=True):
+        self.limits = dict(DEFAULT_LIMITS)
+        if limits:
+            self.limits.update(limits)
+        self.low_priority = low_priority
+
+        self._lock = threading.Condition()
+        self._ids = itertools.count(1)
+        self._queue = []
+        self._jobs = []
+        self._running = {resource: 0 for resource in self.limits}
+
+    def submit(self, job, name=None, priority=0, progress_handler=None, success_handler=None, error_handler=None,
+               message_handler=None):
+        resource = getattr(job, "resource", CPU_BOUND)
+        if resource not in self.limits:
+            resource = CPU_BOUND
+        if self.low_priority and hasattr(job, "control"):
+            job.control.low_priority = True
+
+        handlers = (progress_handler, success_handler, error_handler, message_handler)
+        with self._lock:
+            job_id = next(self._ids)
+            scheduled = ScheduledJob(job_id, job, name or type(job).__name__, priority, resource, handlers)
+            self._jobs.append(scheduled)
+            heapq.heappush(self._queue, (-priority, job_id, scheduled))
+        self._dispatch()
+        return scheduled
+
+    def cancel(self, scheduled):
+        with self._lock:
+            state = scheduled.state
+            if state == QUEUED:
+                scheduled.state = CANCELLED
+                scheduled.message = "Cancelled"
+                self._lock.notify_all()
+
+        if state == QUEUED:
+            error_handler = scheduled._handlers[2]
+            if error_handler:
+                error_handler(scheduled.message)
+        elif state == RUNNING:
+            # Running jobs stop their FFmpeg processes and report back through the worker thread
+            scheduled.job.cancel()
+
+    def cancel_all(self):
+        for scheduled in self.jobs():
+            self.cancel(scheduled)
+
+    def jobs(self, state=None):
+        with self._lock:
+            return [scheduled for scheduled in self._jobs if state is None or scheduled.state == state]
+
+    def wait(self, timeout=None):
+        """Blocks until nothing is queued or running and returns whether every job succeeded."""
+        with self._lock:
+            self._lock.wait_for(lambda: all(scheduled.done for scheduled in self._jobs), timeout)
+            return all(scheduled.state == SUCCEEDED for scheduled in self._jobs)
+
+    def _dispatch(self):
+        to_start = []
+        with self._lock:
+            deferred = []
+            while self._queue:
+                entry = heapq.heappop(self._queue)
+                scheduled = entry[2]
+                if scheduled.state != QUEUED:
+                    continue
+                if self._running[scheduled.resource] >= self.limits[scheduled.resource]:
+                    deferred.append(entry)
+                    continue
+                self._running[scheduled.resource] += 1
+                scheduled.state = RUNNING
+                to_start.append(scheduled)
+            for entry in deferred:
+                heapq.heappush(self._queue, entry)
+
+        for scheduled in to_start:
+            threading.Thread(target=self._run, args=(scheduled,), name=f"job-{scheduled.id}", daemon=True).start()
+
+    def _run(self, scheduled):
+        progress_handler, success_handler, error_handler, message_handler = scheduled._handlers
+        result = {}
+        scheduled.started_at = time.time()
+
+        def handle_success():
+            result["success"] = True
+
+        def handle_error(message="Failed"):
+            result["error"] = message
+
+        try:
+            scheduled.job.run(progress_handler=progress_handler, success_handler=handle_success,
+                              error_handler=handle_error, message_handler=message_handler)
+        except Exception as e:
+            print(f"Job {scheduled.name} crashed: {e}")
+            result["error"] = str(e)
+
+        with self._lock:
+            if getattr(scheduled.job, "control", None) is not None and scheduled.job.control.cancelled:
+                scheduled.state = CANCELLED
+                scheduled.message = "Cancelled"
+            elif "error" in result or "success" not in result:
+                scheduled.state = FAILED
+                scheduled.message = result.get("error", "Failed")
+            else:
+                scheduled.state = SUCCEEDED
+            scheduled.finished_at = time.time()
+            self._running[scheduled.resource] -= 1
+            self._lock.notify_all()
+
+        thread = threading.current_thread()
+        record({"type": "job", "id": scheduled.id, "name": scheduled.name, "resource": scheduled.resource,
+                "state": scheduled.state, "message": scheduled.message, "thread": thread.name,
+                "thread_id": thread.ident, "queued_at": scheduled.queued_at, "started_at": scheduled.started_at,
+                "finished_at": scheduled.finished_at, "queued_seconds": scheduled.started_at - scheduled.queued_at})
+
+        if scheduled.state == SUCCEEDED:
+            if success_handler:
+                success_handler()
+        elif error_handler:
+            error_handler(scheduled.message)
+
+        self._dispatch()
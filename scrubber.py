@@ -0,0 +1,56 @@
+from PyQt5.QtCore import Qt, pyqtSignal
+from PyQt5.QtGui import QPixmap
+from PyQt5.QtWidgets import QDialog, QHBoxLayout, QLabel, QPushButton, QSlider, QVBoxLayout
+
+from utils import format_time
+
+
+class ScrubberDialog(QDialog):
+    """Scrubs through the keyframe thumbnails of the preview proxy to pick trim points without decoding anything."""
+
+    start_time_selected = pyqtSignal(str)
+    end_time_selected = pyqtSignal(str)
+
+    def __init__(self, thumbnail_index, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Scrub Preview")
+        self.index = thumbnail_index
+        self._pixmaps = {}
+
+        self.image_label = QLabel()
+        self.image_label.setAlignment(Qt.AlignCenter)
+        self.image_label.setMinimumSize(320, 180)
+        self.time_label = QLabel(format_time(0))
+        self.time_label.setAlignment(Qt.AlignCenter)
+
+        self.slider = QSlider(Qt.Horizontal)
+        self.slider.setRange(0, int(self.index.duration))
+        self.slider.valueChanged.connect(self.show_position)
+
+        self.set_start_button = QPushButton("Set Start")
+        self.set_start_button.clicked.connect(lambda: self.start_time_selected.emit(self.time_label.text()))
+        self.set_end_button = QPushButton("Set End")
+        self.set_end_button.clicked.connect(lambda: self.end_time_selected.emit(self.time_label.text()))
+
+        button_layout = QHBoxLayout()
+        button_layout.addWidget(self.set_start_button)
+        button_layout.addWidget(self.set_end_button)
+
+        layout = QVBoxLayout()
+        layout.addWidget(self.image_label)
+        layout.addWidget(self.time_label)
+        layout.addWidget(self.slider)
+        layout.addLayout(button_layout)
+        self.setLayout(layout)
+
+        self.show_position(0)
+
+    def show_position(self, position):
+        self.time_label.setText(format_time(position))
+        nearest = self.index.nearest(position)
+        if nearest is None:
+            return
+        _, path = nearest
+        if path not in self._pixmaps:
+            self._pixmaps[path] = QPixmap(path)
+        self.image_label.setPixmap(self._pixmaps[path])
@@ -0,0 +1,182 @@
+import bisect
+import os
+import shutil
+import tempfile
+
+from ffmpeg_binaries import get_ffmpeg_path
+from ffmpeg_wrapper import FfmpegWrapper
+from hardware_encoder_util import SOFTWARE_FALLBACK, select_encoder
+from job_control import JobControl
+from probe_service import get_probe_service
+from timeline import escape_concat_path
+
+# Timestamps closer than this are treated as the same frame
+KEYFRAME_TOLERANCE = 0.001
+# How far past each cut point to look for a keyframe before giving up and re-encoding the whole segment
+KEYFRAME_SEARCH_WINDOW = 30
+
+
+def unsupported_codec(paths):
+    """The first video codec in paths that smart cut has no encoder for, None if every clip can be smart cut."""
+    for path in dict.fromkeys(paths):
+        codec = get_probe_service().codec_name(path)
+        if codec not in SOFTWARE_FALLBACK:
+            return codec or "unknown"
+    return None
+
+
+class SmartCutPiece:
+    def __init__(self, mode, start, end):
+        self.mode = mode  # "copy" or "encode"
+        self.start = start
+        self.end = end  # None means until the end of the clip
+
+    def __repr__(self):
+        return f"SmartCutPiece({self.mode!r}, {self.start}, {self.end})"
+
+
+def plan_smart_cut(keyframes, start, end, clip_duration):
+    """Splits [start, end) into stream-copied whole GOPs and re-encoded partial GOPs at either cut point."""
+    to_end_of_clip = end >= clip_duration - KEYFRAME_TOLERANCE
+
+    first_index = bisect.bisect_left(keyframes, start - KEYFRAME_TOLERANCE)
+    copy_start = keyframes[first_index] if first_index < len(keyframes) else None
+
+    if to_end_of_clip:
+        copy_end = end
+    else:
+        last_index = bisect.bisect_right(keyframes, end + KEYFRAME_TOLERANCE) - 1
+        copy_end = keyframes[last_index] if last_index >= 0 else None
+
+    if copy_start is None or copy_end is None or copy_end - copy_start <= KEYFRAME_TOLERANCE:
+        return [SmartCutPiece("encode", start, end)]
+
+    pieces = []
+    if copy_start - start > KEYFRAME_TOLERANCE:
+        pieces.append(SmartCutPiece("encode", start, copy_start))
+    pieces.append(SmartCutPiece("copy", copy_start, None if to_end_of_clip else copy_end))
+    if not to_end_of_clip and end - copy_end > KEYFRAME_TOLERANCE:
+        pieces.append(SmartCutPiece("encode", copy_end, end))
+    return pieces
+
+
+class SmartCutter:
+    """Cuts a list of clip segments frame-accurately while stream-copying everything between the cut points."""
+
+    def __init__(self, segments, output_file, mute=False, hw_acceleration=False, control=None):
+        self.segments = segments
+        self.control = control or JobControl()
+        self.output_file = output_file
+        self.mute = mute
+        self.hw_acceleration = hw_acceleration
+        self.total_duration = sum(segment.duration for segment in segments)
+
+        self._completed_duration = 0
+        self._current_duration = 0
+        self._failed = False
+
+    def plan(self, segment):
+        if segment.is_whole_clip:
+            return [SmartCutPiece("copy", 0, None)]
+
+        windows = [f"{segment.inpoint}%+{KEYFRAME_SEARCH_WINDOW}"]
+        if segment.outpoint < segment.clip_duration:
+            windows.append(f"{max(segment.outpoint - KEYFRAME_SEARCH_WINDOW, 0)}%{segment.outpoint}")
+        keyframes = get_probe_service().keyframes(segment.path, ",".join(windows))
+        return plan_smart_cut(keyframes, segment.inpoint, segment.outpoint, segment.clip_duration)
+
+    def _encode_args(self, path):
+        video_stream = get_probe_service().video_stream(path) or {}
+        codec = video_stream.get("codec_name", "h264")
+
+        # The re-encoded pieces have to match the copied ones, so stay on the source codec, see unsupported_codec
+        encoder = select_encoder(codec, self.hw_acceleration)
+
+        args = encoder.video_args(video_stream.get("bit_rate"))
+        if video_stream.get("pix_fmt") and not encoder.hardware:
+            args.extend(["-pix_fmt", video_stream["pix_fmt"]])
+        args.extend(["-c:a", "aac"])
+        return encoder.input_args, args
+
+    def _piece_command(self, segment, piece, piece_path, encode_args):
+        command = [get_ffmpeg_path()]
+        if piece.mode == "encode":
+            command.extend(encode_args[0])
+        if piece.start > 0:
+            command.extend(["-ss", f"{piece.start:.6f}"])
+        command.extend(["-i", segment.path])
+        if piece.end is not None:
+            command.extend(["-t", f"{piece.end - piece.start:.6f}"])
+
+        command.extend(["-map", "0:v:0"])
+        if self.mute:
+            command.extend(["-an"])
+        else:
+            command.extend(["-map", "0:a?"])
+
+        if piece.mode == "copy":
+            command.extend(["-c", "copy"])
+        else:
+            command.extend(encode_args[1])
+
+        # MPEG-TS keeps SPS/PPS in-band, so copied and re-encoded pieces can be joined without mismatched headers
+        command.extend(["-f", "mpegts", piece_path, "-y"])
+        return command
+
+    def run(self, progress_handler=None, success_handler=None, error_handler=None):
+        work_dir = tempfile.mkdtemp(prefix=".smart_cut_", dir=os.path.dirname(os.path.abspath(self.output_file)))
+        try:
+            piece_paths = []
+            for segment in self.segments:
+                pieces = self.plan(segment)
+                print(f"Smart cut plan for {segment}: {pieces}")
+                encode_args = None
+                for piece in pieces:
+                    if piece.mode == "encode" and encode_args is None:
+                        encode_args = self._encode_args(segment.path)
+
+                    piece_path = os.path.join(work_dir, f"piece_{len(piece_paths):04d}.ts")
+                    piece_duration = (piece.end if piece.end is not None else segment.clip_duration) - piece.start
+                    self._current_duration = piece_duration
+
+                    process = FfmpegWrapper(self._piece_command(segment, piece, piece_path, encode_args),
+                                            expected_duration=piece_duration, control=self.control)
+                    process.run(progress_handler=self._progress_handler(progress_handler),
+                                error_handler=self._handle_piece_error)
+                    if self._failed:
+                        if error_handler:
+                            error_handler()
+                        return
+
+                    self._completed_duration += piece_duration
+                    piece_paths.append(piece_path)
+
+            piecelist_path = os.path.join(work_dir, "pieces.txt")
+            with open(piecelist_path, "w") as piecelist:
+                for piece_path in piece_paths:
+                    piecelist.write(f"file '{escape_concat_path(piece_path)}'\n")
+
+            self._current_duration = 0
+            process = FfmpegWrapper([
+                get_ffmpeg_path(), "-f", "concat", "-safe", "0", "-i", piecelist_path, "-map", "0", "-c", "copy",
+                self.output_file, "-y"
+            ], expected_duration=self.total_duration, control=self.control)
+            process.run(progress_handler=self._progress_handler(progress_handler), success_handler=success_handler,
+                        error_handler=error_handler)
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    def _handle_piece_error(self):
+        self._failed = True
+
+    def _progress_handler(self, progress_handler):
+        if progress_handler is None:
+            return None
+
+        def handle_progress(percentage, speed, eta, estimated_filesize):
+            done = self._completed_duration + self._current_duration * percentage / 100
+            overall = done / self.total_duration * 100 if self.total_duration > 0 else 0
+            overall_eta = (self.total_duration - done) / speed if speed else None
+            progress_handler(min(overall, 100), speed, overall_eta, estimated_filesize)
+
+        return handle_progress
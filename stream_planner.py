@@ -0,0 +1,141 @@
+import os
+
+COPY = "copy"
+TRANSCODE = "transcode"
+DROP = "drop"
+
+# Codecs a container takes as they are, None means anything goes
+CONTAINER_CODECS = {
+    ".mp4": {
+        "video": {"h264", "hevc", "av1", "vp9", "mpeg4"},
+        "audio": {"aac", "mp3", "alac", "opus", "ac3", "eac3", "flac"},
+    },
+    ".mov": {
+        "video": {"h264", "hevc", "prores", "mpeg4", "mjpeg"},
+        "audio": {"aac", "mp3", "alac", "ac3", "pcm_s16le", "pcm_s24le"},
+    },
+    ".mkv": None,
+}
+# Rough seconds of work per second of media, for comparing plans rather than predicting wall time
+ACTION_COST = {
+    (COPY, "video"): 0.005,
+    (COPY, "audio"): 0.001,
+    (TRANSCODE, "video"): 1.0,
+    (TRANSCODE, "audio"): 0.02,
+}
+AUDIO_CODEC = "aac"
+# Used when a copy has to convert video that does not fit the output and no encoder was chosen
+VIDEO_CODEC = "libx264"
+
+
+class StreamAction:
+    def __init__(self, stream, action, reason):
+        self.index = stream.get("index", 0)
+        self.codec_type = stream.get("codec_type")
+        self.codec_name = stream.get("codec_name") or stream.get("codec_tag_string")
+        self.action = action
+        self.reason = reason
+
+    def __repr__(self):
+        return f"StreamAction({self.index}, {self.codec_type}, {self.codec_name}, {self.action}: {self.reason})"
+
+
+class StreamPlan:
+    """What happens to each input stream, with the FFmpeg output arguments that carry it out."""
+
+    def __init__(self, actions, video_args=None, container=".mp4"):
+        self.actions = actions
+        self.video_args = video_args or []
+        self.container = container
+
+    @property
+    def kept(self):
+        return [action for action in self.actions if action.action != DROP]
+
+    def action_for(self, codec_type):
+        return next((action for action in self.kept if action.codec_type == codec_type), None)
+
+    @property
+    def copies_everything(self):
+        return all(action.action == COPY for action in self.actions)
+
+    def video_output_args(self):
+        video = self.action_for("video")
+        if video is None:
+            return ["-vn"]
+        if video.action == COPY:
+            return ["-c:v", "copy"]
+        return list(self.video_args) or ["-c:v", VIDEO_CODEC]
+
+    def audio_output_args(self, filtered=False):
+        """filtered is set when the audio goes through a filter graph, decoded audio cannot be copied."""
+        audio = self.action_for("audio")
+        if audio is None:
+            return ["-an"]
+        return ["-c:a", "copy"] if audio.action == COPY and not filtered else ["-c:a", AUDIO_CODEC]
+
+    def output_args(self, stream_maps=None):
+        """stream_maps replaces the input stream of a codec type, for example with a filter output like "[video]"."""
+        stream_maps = stream_maps or {}
+        args = []
+        for action in self.kept:
+            args.extend(["-map", stream_maps.get(action.codec_type, f"0:{action.index}")])
+        args += self.video_output_args() + self.audio_output_args(stream_maps.get("audio", "").startswith("["))
+        dropped_timecode = any(action.action == DROP and action.codec_name == "tmcd" for action in self.actions)
+        if dropped_timecode and self.container in (".mp4", ".mov"):
+            # The muxer would otherwise write a new timecode track from the copied timecode tag
+            args.extend(["-write_tmcd", "0"])
+        return args
+
+    def cost(self, duration):
+        return sum(ACTION_COST.get((action.action, action.codec_type), 0) for action in self.actions) * duration
+
+    def describe(self, duration=None):
+        lines = [f"  #{action.index} {action.codec_type} ({action.codec_name}): {action.action}, {action.reason}"
+                 for action in self.actions]
+        summary = "Stream plan:"
+        if duration:
+            summary += f" about {self.cost(duration):.0f} s of work for {duration:.0f} s of media"
+        return "\n".join([summary] + lines)
+
+
+def plan_streams(streams, re_encode=False, mute=False, output_file="output.mp4", video_args=None):
+    """Picks the cheapest action per stream: copy what the output can hold as it is, drop what is not needed.
+
+    Only the first video and audio stream are kept, as before. Data tracks such as GoPro telemetry and timecode are
+    dropped since an edited clip no longer lines up with them.
+    """
+    container = os.path.splitext(output_file)[1].lower()
+    allowed = CONTAINER_CODECS.get(container, CONTAINER_CODECS[".mp4"])
+    actions = []
+    have_video = have_audio = False
+    for stream in streams:
+        codec_type = stream.get("codec_type")
+        codec_name = stream.get("codec_name")
+        fits = allowed is None or codec_name in allowed.get(codec_type, ())
+
+        if codec_type == "video" and stream.get("disposition", {}).get("attached_pic"):
+            actions.append(StreamAction(stream, DROP, "cover image"))
+        elif codec_type == "video":
+            if have_video:
+                actions.append(StreamAction(stream, DROP, "only the first video stream is kept"))
+            elif re_encode:
+                actions.append(StreamAction(stream, TRANSCODE, "re-encode requested"))
+            elif not fits:
+                actions.append(StreamAction(stream, TRANSCODE, f"{codec_name} does not fit the container"))
+            else:
+                actions.append(StreamAction(stream, COPY, "unchanged"))
+            have_video = True
+        elif codec_type == "audio":
+            if mute:
+                actions.append(StreamAction(stream, DROP, "muted"))
+            elif have_audio:
+                actions.append(StreamAction(stream, DROP, "only the first audio stream is kept"))
+            elif not fits:
+                actions.append(StreamAction(stream, TRANSCODE, f"{codec_name} does not fit the container"))
+            else:
+                actions.append(StreamAction(stream, COPY, "unchanged"))
+            have_audio = True
+        else:
+            actions.append(StreamAction(stream, DROP, f"{codec_type} track not needed"))
+    return StreamPlan(actions, video_args, container)
@@ -0,0 +1,53 @@
+from PyQt5.QtCore import pyqtSignal
+from PyQt5.QtWidgets import QDialog, QFileDialog, QHBoxLayout, QListWidget, QMessageBox, QPushButton, QVBoxLayout
+
+from highlight_export import write_highlights
+from utils import format_time
+
+
+class RangeSuggestionsDialog(QDialog):
+    """Lists suggested highlight ranges, the selected one can be copied into the start and end fields."""
+
+    range_selected = pyqtSignal(str, str)
+
+    def __init__(self, highlights, title="Suggested Ranges", parent=None):
+        super().__init__(parent)
+        self.setWindowTitle(title)
+        self.setGeometry(150, 150, 400, 300)
+        self.highlights = highlights
+
+        self.range_list = QListWidget()
+        for highlight in highlights:
+            self.range_list.addItem(f"{format_time(highlight.start)} - {format_time(highlight.end)}  {highlight.name}")
+        self.range_list.itemDoubleClicked.connect(self.use_range)
+
+        self.use_button = QPushButton("Use Range")
+        self.use_button.clicked.connect(self.use_range)
+        self.save_button = QPushButton("Save as Highlights...")
+        self.save_button.clicked.connect(self.save_ranges)
+
+        button_layout = QHBoxLayout()
+        button_layout.addWidget(self.use_button)
+        button_layout.addWidget(self.save_button)
+
+        layout = QVBoxLayout()
+        layout.addWidget(self.range_list)
+        layout.addLayout(button_layout)
+        self.setLayout(layout)
+
+    def use_range(self):
+        row = self.range_list.currentRow()
+        if row < 0:
+            return
+        highlight = self.highlights[row]
+        self.range_selected.emit(format_time(highlight.start), format_time(highlight.end))
+
+    def save_ranges(self):
+        ranges_file, _ = QFileDialog.getSaveFileName(self, "Save Highlight Ranges", "highlights.csv",
+                                                     "Highlight ranges (*.csv)")
+        if not ranges_file:
+            return
+        try:
+            write_highlights(ranges_file, self.highlights)
+        except OSError as e:
+            QMessageBox.critical(self, "Error", f"Could not save highlight ranges: {e}")
@@ -0,0 +1,180 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import threading
+import time
+
+from utils import get_cache_dir
+
+MAX_TRACE_BYTES = 10 * 1024 * 1024
+TRACE_BACKUPS = 5
+MAX_LOG_BYTES = 5 * 1024 * 1024
+LOG_BACKUPS = 2
+# Longer runs keep every second, fourth, .. progress sample so a trace line stays small
+MAX_SERIES_POINTS = 500
+CHROME_TRACE_ENV = "EVENTVIDEOTOOL_CHROME_TRACE"
+
+_lock = threading.Lock()
+_logger = None
+_chrome_trace = None
+
+
+def trace_path():
+    return os.path.join(get_cache_dir(), "telemetry", "runs.jsonl")
+
+
+def _trace_logger():
+    global _logger
+    with _lock:
+        if _logger is None:
+            os.makedirs(os.path.dirname(trace_path()), exist_ok=True)
+            handler = logging.handlers.RotatingFileHandler(trace_path(), maxBytes=MAX_TRACE_BYTES,
+                                                           backupCount=TRACE_BACKUPS, encoding="utf-8")
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            logger = logging.getLogger("eventvideotool.telemetry")
+            logger.setLevel(logging.INFO)
+            logger.propagate = False
+            logger.addHandler(handler)
+            _logger = logger
+        return _logger
+
+
+def rotate_log(path, max_bytes=MAX_LOG_BYTES, backups=LOG_BACKUPS):
+    """Moves path to path.1 (and older ones further up) once it has grown past max_bytes."""
+    try:
+        if os.path.getsize(path) < max_bytes:
+            return
+    except OSError:
+        return
+    for index in range(backups - 1, 0, -1):
+        if os.path.exists(f"{path}.{index}"):
+            os.replace(f"{path}.{index}", f"{path}.{index + 1}")
+    os.replace(path, f"{path}.1")
+
+
+def record(trace):
+    """Appends one trace, a dict with a "type", to the JSON lines file and the Chrome trace if one is enabled."""
+    try:
+        _trace_logger().info(json.dumps(trace))
+    except OSError as e:
+        print(f"Could not write telemetry: {e}")
+    if _chrome_trace is not None:
+        _chrome_trace.add(trace)
+
+
+class ChromeTrace:
+    """Collects traces as trace events, which chrome://tracing and Perfetto can open."""
+
+    def __init__(self, path):
+        self.path = path
+        self.events = []
+        self._lock = threading.Lock()
+
+    def add(self, trace):
+        pid = os.getpid()
+        tid = trace.get("thread_id", 0)
+        events = []
+        if trace["type"] == "ffmpeg_run":
+            if trace.get("probe_seconds"):
+                events.append({"name": "probe", "cat": "ffmpeg", "ph": "X", "pid": pid, "tid": tid,
+                               "ts": (trace["created_at"]) * 1e6, "dur": trace["probe_seconds"] * 1e6})
+            if trace.get("started_at") and trace.get("finished_at"):
+                events.append({
+                    "name": trace.get("name") or "ffmpeg", "cat": "ffmpeg", "ph": "X", "pid": pid, "tid": tid,
+                    "ts": trace["started_at"] * 1e6, "dur": (trace["finished_at"] - trace["started_at"]) * 1e6,
+                    "args": {key: trace.get(key) for key in
+                             ("command", "exit_code", "time_to_first_progress", "output_size")},
+                })
+                for point in trace.get("series", []):
+                    events.append({"name": "progress", "cat": "ffmpeg", "ph": "C", "pid": pid, "tid": tid,
+                                   "ts": (trace["started_at"] + point["t"]) * 1e6,
+                                   "args": {"speed": point["speed"] or 0, "fps": point["fps"] or 0}})
+        elif trace["type"] == "job" and trace.get("started_at") and trace.get("finished_at"):
+            events.append({"name": trace["name"], "cat": "job", "ph": "X", "pid": pid, "tid": tid,
+                           "ts": trace["started_at"] * 1e6, "dur": (trace["finished_at"] - trace["started_at"]) * 1e6,
+                           "args": {"state": trace.get("state"), "queued_seconds": trace.get("queued_seconds")}})
+        with self._lock:
+            self.events.extend(events)
+
+    def save(self):
+        with self._lock:
+            events = list(self.events)
+        with open(self.path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+        print(f"Chrome trace written to {self.path}")
+
+
+def enable_chrome_trace(path):
+    global _chrome_trace
+    if _chrome_trace is None:
+        _chrome_trace = ChromeTrace(path)
+        atexit.register(_chrome_trace.save)
+
+
+class RunTrace:
+    """Timings of one FFmpeg run, from probing its input until it exits."""
+
+    def __init__(self, command, name=None):
+        self.command = command
+        self.name = name
+        self.created_at = time.time()
+        self.probe_seconds = None
+        self.started_at = None
+        self.first_progress_at = None
+        self.finished_at = None
+        self.exit_code = None
+        self.output_file = None
+        self.output_size = None
+        self.series = []
+        self._stride = 1
+        self._samples = 0
+
+    def progress(self, snapshot):
+        now = time.time()
+        if self.first_progress_at is None:
+            self.first_progress_at = now
+        self._samples += 1
+        if self._samples % self._stride:
+            return
+        self.series.append({"t": round(now - self.started_at, 3), "speed": snapshot.speed, "fps": snapshot.fps,
+                            "out_time": snapshot.out_time, "bitrate": snapshot.bitrate, "frame": snapshot.frame})
+        if len(self.series) >= MAX_SERIES_POINTS:
+            self.series = self.series[::2]
+            self._stride *= 2
+
+    def finish(self, exit_code, output_file=None):
+        self.finished_at = time.time()
+        self.exit_code = exit_code
+        self.output_file = output_file
+        if output_file:
+            try:
+                self.output_size = os.path.getsize(output_file)
+            except OSError:
+                pass
+
+    def to_dict(self):
+        thread = threading.current_thread()
+        return {
+            "type": "ffmpeg_run",
+            "name": self.name,
+            "command": self.command,
+            "thread": thread.name,
+            "thread_id": thread.ident,
+            "created_at": self.created_at,
+            "probe_seconds": self.probe_seconds,
+            "started_at": self.started_at,
+            "time_to_first_progress": (self.first_progress_at - self.started_at
+                                       if self.first_progress_at and self.started_at else None),
+            "finished_at": self.finished_at,
+            "duration": self.finished_at - self.started_at if self.finished_at and self.started_at else None,
+            "exit_code": self.exit_code,
+            "output_file": self.output_file,
+            "output_size": self.output_size,
+            "series": self.series,
+        }
+
+
+if os.environ.get(CHROME_TRACE_ENV):
+    enable_chrome_trace(os.environ[CHROME_TRACE_ENV])
@@ -0,0 +1,72 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ffmpeg_binaries import get_ffmpeg_path, get_ffprobe_path  # noqa: E402
+
+FRAME_RATE = 30
+
+
+@pytest.fixture(autouse=True)
+def work_dir(tmp_path, monkeypatch):
+    # FFmpeg logs go to the working directory, the probe cache to the user cache directory
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    return tmp_path
+
+
+@pytest.fixture
+def ffmpeg():
+    if not os.path.isfile(get_ffmpeg_path()) or not os.path.isfile(get_ffprobe_path()):
+        pytest.skip("FFmpeg binaries are not in ffmpeg_binaries")
+    return get_ffmpeg_path()
+
+
+def make_clip(path, duration, audio=True, size="320x180"):
+    """Writes a GoPro-like H.264 clip with a keyframe every two seconds."""
+    command = [get_ffmpeg_path(), "-v", "error", "-f", "lavfi", "-i",
+               f"testsrc=size={size}:rate={FRAME_RATE}:duration={duration}"]
+    if audio:
+        command.extend(["-f", "lavfi", "-i", f"sine=frequency=440:sample_rate=48000:duration={duration}"])
+    command.extend(["-c:v", "libx264", "-preset", "ultrafast", "-g", str(FRAME_RATE * 2), "-pix_fmt", "yuv420p"])
+    command.extend(["-c:a", "aac"] if audio else ["-an"])
+    subprocess.run(command + [str(path), "-y"], check=True)
+    return str(path)
+
+
+def run_job(job, messages=None):
+    """Runs a job to the end and returns {"success": True} or {"error": message}, collecting its messages."""
+    result = {}
+    job.run(success_handler=lambda: result.setdefault("success", True),
+            error_handler=lambda message="Failed": result.setdefault("error", message),
+            message_handler=messages.append if messages is not None else lambda message: None)
+    return result
+
+
+def stream_duration(path, stream):
+    """Duration of the first video ("v") or audio ("a") stream in seconds."""
+    output = subprocess.run([get_ffprobe_path(), "-v", "error", "-select_streams", f"{stream}:0",
+                             "-show_entries", "stream=duration", "-of", "csv=p=0", str(path)],
+                            check=True, capture_output=True, text=True).stdout
+    return float(output.strip())
+
+
+@pytest.fixture
+def clip_dir(ffmpeg, tmp_path):
+    directory = tmp_path / "clips"
+    directory.mkdir()
+    for name in ("GX010001.MP4", "GX020001.MP4"):
+        make_clip(directory / name, 12)
+    return str(directory)
+
+
+def frame_count(path):
+    """Decoded frames of the first video stream."""
+    output = subprocess.run([get_ffprobe_path(), "-v", "error", "-count_frames", "-select_streams", "v:0",
+                             "-show_entries", "stream=nb_read_frames", "-of", "csv=p=0", str(path)],
+                            check=True, capture_output=True, text=True).stdout
+    return int(output.strip())
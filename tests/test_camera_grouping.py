@@ -0,0 +1,90 @@
+import pytest
+
+import camera_grouping
+from camera_grouping import group_cameras, parse_chapter_name
+
+
+class FakeProbeService:
+    def __init__(self, video_infos):
+        self.video_infos = video_infos
+
+    def probe_many(self, paths):
+        return [self.video_infos.get(path) for path in paths]
+
+
+def video_info(start, duration, width=1920, firmware="H22.01.01.10.00"):
+    tags = {"firmware": firmware}
+    if start:
+        tags["creation_time"] = f"2024-05-01T{start}Z"
+    return {
+        "format": {"duration": str(duration), "tags": tags},
+        "streams": [{"codec_type": "video", "codec_name": "hevc", "width": width, "height": 1080,
+                     "r_frame_rate": "30/1"}],
+    }
+
+
+@pytest.mark.parametrize("name, expected", [
+    ("GX010001.MP4", ("GX", 1, 1)),
+    ("GX020001.MP4", ("GX", 2, 1)),
+    ("gh011234.mp4", ("GH", 1, 1234)),
+    ("GL010001.LRV", ("GL", 1, 1)),
+    ("GOPR0042.MP4", ("GP", 0, 42)),
+    ("GP010042.MP4", ("GP", 1, 42)),
+    ("GX0100001.MP4", None),
+    ("clip.mp4", None),
+])
+def test_parse_chapter_name(name, expected):
+    assert parse_chapter_name(f"/card/DCIM/100GOPRO/{name}") == expected
+
+
+CASES = {
+    "chapters play in chapter order": (
+        {"GX020001.MP4": video_info(None, 600), "GX010001.MP4": video_info("10:00:00", 600),
+         "GX010002.MP4": video_info("10:30:00", 300)},
+        [["GX010001.MP4", "GX020001.MP4", "GX010002.MP4"]],
+    ),
+    "legacy chapters follow their first file": (
+        {"GP010042.MP4": video_info(None, 600), "GOPR0042.MP4": video_info("10:00:00", 600)},
+        [["GOPR0042.MP4", "GP010042.MP4"]],
+    ),
+    "overlapping recordings are two cameras": (
+        {"GX010001.MP4": video_info("10:00:00", 600), "GX010002.MP4": video_info("10:05:00", 600),
+         "GX010003.MP4": video_info("10:20:00", 60)},
+        # The third recording goes to the camera that stopped last
+        [["GX010001.MP4"], ["GX010002.MP4", "GX010003.MP4"]],
+    ),
+    "a clock a second off still counts as one camera": (
+        {"GX010001.MP4": video_info("10:00:00", 600), "GX010002.MP4": video_info("10:09:59.500", 600)},
+        [["GX010001.MP4", "GX010002.MP4"]],
+    ),
+    "another resolution is another camera": (
+        {"GX010001.MP4": video_info("10:00:00", 600), "GX010002.MP4": video_info("10:20:00", 600, width=2704)},
+        [["GX010001.MP4"], ["GX010002.MP4"]],
+    ),
+    "another firmware is another camera": (
+        {"GX010001.MP4": video_info("10:00:00", 600),
+         "GX010002.MP4": video_info("10:20:00", 600, firmware="H21.01.01.62.00")},
+        [["GX010001.MP4"], ["GX010002.MP4"]],
+    ),
+    "another file name series is another camera": (
+        {"GX010001.MP4": video_info("10:00:00", 600), "GH010002.MP4": video_info("10:20:00", 600)},
+        [["GX010001.MP4"], ["GH010002.MP4"]],
+    ),
+    "undated recordings go last": (
+        {"GX010001.MP4": video_info(None, 600), "GX010002.MP4": video_info("10:00:00", 600)},
+        [["GX010002.MP4", "GX010001.MP4"]],
+    ),
+    "other file names are recordings of their own": (
+        {"clip.mp4": video_info("10:00:00", 60), "GX010001.MP4": video_info("10:05:00", 60)},
+        [["clip.mp4"], ["GX010001.MP4"]],
+    ),
+}
+
+
+@pytest.mark.parametrize("video_infos, expected", CASES.values(), ids=CASES.keys())
+def test_group_cameras(monkeypatch, video_infos, expected):
+    video_infos = {f"/card/{name}": info for name, info in video_infos.items()}
+    monkeypatch.setattr(camera_grouping, "get_probe_service", lambda: FakeProbeService(video_infos))
+    cameras = group_cameras(sorted(video_infos))
+    assert [[path[len("/card/"):] for path in camera.clip_paths] for camera in cameras] == expected
+    assert [camera.name for camera in cameras] == [f"camera_{index + 1}" for index in range(len(expected))]
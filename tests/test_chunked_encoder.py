@@ -0,0 +1,113 @@
+import os
+
+import pytest
+
+import chunked_encoder
+from chunked_encoder import WORK_DIR_PREFIX, ChunkedEncoder
+from conftest import FRAME_RATE, frame_count, make_clip, run_job, stream_duration
+from jobs import ProcessJob
+from timeline import ClipSegment
+
+
+@pytest.mark.parametrize("start, end", [("00:00:05", "00:00:20"), ("00:00:03", "00:00:09")])
+def test_chunked_encode_audio_matches_video(clip_dir, tmp_path, start, end):
+    output_file = str(tmp_path / "trim.mp4")
+    job = ProcessJob(None, output_file, start, end, mute=False, re_encode=True, hw_acceleration=False,
+                     clip_dir=clip_dir)
+    assert run_job(job) == {"success": True}
+
+    video = stream_duration(output_file, "v")
+    audio = stream_duration(output_file, "a")
+    assert video == pytest.approx(audio, abs=1 / FRAME_RATE)
+
+
+def test_chunked_encode_from_input_file(ffmpeg, tmp_path):
+    input_file = make_clip(tmp_path / "input.mp4", 24)
+    output_file = str(tmp_path / "trim.mp4")
+    job = ProcessJob(input_file, output_file, "00:00:05", "00:00:20", mute=False, re_encode=True,
+                     hw_acceleration=False)
+    assert run_job(job) == {"success": True}
+
+    assert stream_duration(output_file, "v") == pytest.approx(15, abs=1 / FRAME_RATE)
+    assert stream_duration(output_file, "a") == pytest.approx(15, abs=1 / FRAME_RATE)
+    assert not any(name.startswith(".chunked_encode_") for name in os.listdir(tmp_path))
+
+
+@pytest.fixture
+def small_chunks(monkeypatch):
+    # Lets a short clip be split, with one worker it becomes two chunks of 6 seconds
+    monkeypatch.setattr(chunked_encoder, "MIN_CHUNK_DURATION", 2)
+
+
+def work_dirs(directory):
+    return [name for name in os.listdir(directory) if name.startswith(WORK_DIR_PREFIX)]
+
+
+def encode_with_failing_chunk(encoder, monkeypatch, failing_key):
+    run_task = ChunkedEncoder._run_task
+
+    def run_task_or_fail(self, key, *args):
+        if key == failing_key:
+            self._handle_task_error()
+        else:
+            run_task(self, key, *args)
+
+    monkeypatch.setattr(ChunkedEncoder, "_run_task", run_task_or_fail)
+    result = {}
+    encoder.run(progress_handler=lambda *args: None, error_handler=lambda: result.setdefault("error", True))
+    monkeypatch.setattr(ChunkedEncoder, "_run_task", run_task)
+    return result
+
+
+def recorded_commands(monkeypatch):
+    commands = []
+    wrapper = chunked_encoder.FfmpegWrapper
+
+    def recording_wrapper(command, *args, **kwargs):
+        commands.append(command)
+        return wrapper(command, *args, **kwargs)
+
+    monkeypatch.setattr(chunked_encoder, "FfmpegWrapper", recording_wrapper)
+    return commands
+
+
+def new_encoder(clip, output_file):
+    # One worker runs the chunks in order, so the ones before a failing chunk are finished and the rest are not
+    return ChunkedEncoder([ClipSegment(clip, 0, 12, 12)], output_file, ["-c:v", "libx264", "-preset", "ultrafast"],
+                          workers=1)
+
+
+def test_resumed_encode_only_encodes_the_missing_chunks(ffmpeg, tmp_path, small_chunks, monkeypatch):
+    clip = make_clip(tmp_path / "clip.mp4", 12)
+    output_file = str(tmp_path / "trim.mp4")
+    assert encode_with_failing_chunk(new_encoder(clip, output_file), monkeypatch, 1) == {"error": True}
+
+    [work_dir] = work_dirs(tmp_path)
+    assert sorted(os.listdir(tmp_path / work_dir)) == ["chunk_0000.mp4", "manifest.json"]
+
+    commands = recorded_commands(monkeypatch)
+    result = {}
+    new_encoder(clip, output_file).run(progress_handler=lambda *args: None,
+                                       success_handler=lambda: result.setdefault("success", True))
+    assert result == {"success": True}
+
+    # The missing chunk, the audio and the join, not the chunk that was already done
+    written = [os.path.basename(command[-2]) for command in commands]
+    assert written == ["chunk_0001.mp4.partial.mp4", "audio.m4a.partial.m4a", "trim.mp4"]
+    assert frame_count(output_file) == 12 * FRAME_RATE
+    assert work_dirs(tmp_path) == []
+
+
+def test_changed_source_discards_the_unfinished_encode(ffmpeg, tmp_path, small_chunks, monkeypatch):
+    clip = make_clip(tmp_path / "clip.mp4", 12)
+    output_file = str(tmp_path / "trim.mp4")
+    assert encode_with_failing_chunk(new_encoder(clip, output_file), monkeypatch, 1) == {"error": True}
+    [old_work_dir] = work_dirs(tmp_path)
+
+    # The clip was copied over again, its chunks no longer match what was encoded
+    stat = os.stat(clip)
+    os.utime(clip, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    assert encode_with_failing_chunk(new_encoder(clip, output_file), monkeypatch, 1) == {"error": True}
+    [new_work_dir] = work_dirs(tmp_path)
+    assert new_work_dir != old_work_dir
+    assert sorted(os.listdir(tmp_path / new_work_dir)) == ["chunk_0000.mp4", "manifest.json"]
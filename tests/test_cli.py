@@ -0,0 +1,47 @@
+import json
+import os
+
+import pytest
+
+from cli import load_batch, main
+from conftest import FRAME_RATE, stream_duration
+
+
+def test_relative_paths(clip_dir, tmp_path):
+    # The working directory is tmp_path, every path below is relative to it
+    assert os.path.dirname(clip_dir) == str(tmp_path)
+    os.mkdir("out")
+
+    assert main(["concat", "clips", os.path.join("out", "concatenated.mp4")]) == 0
+    assert stream_duration(tmp_path / "out" / "concatenated.mp4", "v") == pytest.approx(24, abs=1 / FRAME_RATE)
+
+    assert main(["trim", "--clip-dir", "clips", "--start", "00:00:10", "--end", "00:00:14",
+                 os.path.join("out", "from_clips.mp4")]) == 0
+    assert main(["trim", "--input", os.path.join("out", "concatenated.mp4"), "--start", "00:00:02", "--end",
+                 "00:00:06", "--re-encode", os.path.join("out", "from_input.mp4")]) == 0
+    assert stream_duration(tmp_path / "out" / "from_input.mp4", "v") == pytest.approx(4, abs=1 / FRAME_RATE)
+
+
+def test_relative_paths_in_batch_file(clip_dir, tmp_path):
+    with open("jobs.json", "w") as f:
+        json.dump([{"clip_dir": "clips", "output_dir": "batch_out", "concat": True,
+                    "trims": [{"name": "first", "start": "00:00:10", "end": "00:00:14"}]}], f)
+
+    assert main(["batch", "jobs.json"]) == 0
+    assert os.path.isfile(tmp_path / "batch_out" / "concatenated_output.mp4")
+    assert os.path.isfile(tmp_path / "batch_out" / "first.mp4")
+
+
+@pytest.mark.parametrize("trim, message", [
+    ({"name": "goal", "start": "00:01:00"}, "Batch entry game1, trim goal needs end"),
+    ({}, "Batch entry game1, trim trim_1 needs start and end"),
+    ({"start": "00:02:00", "end": "00:01:00"}, "Batch entry game1, trim trim_1 ends before it starts"),
+    ({"start": "1:xx", "end": "00:01:00"}, "Batch entry game1, trim trim_1 has an invalid start or end"),
+])
+def test_invalid_batch_trim_names_the_entry(tmp_path, trim, message):
+    with open("jobs.json", "w") as f:
+        json.dump([{"name": "game1", "input_file": "game1.mp4", "output_dir": "batch_out", "trims": [trim]}], f)
+
+    with pytest.raises(ValueError, match=message):
+        load_batch("jobs.json")
+    assert not os.path.exists(tmp_path / "batch_out")
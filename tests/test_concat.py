@@ -0,0 +1,96 @@
+import os
+import subprocess
+
+import pytest
+
+from concat_manifest import ConcatManifest
+from conftest import FRAME_RATE, frame_count, make_clip, run_job, stream_duration
+from ffmpeg_binaries import get_ffprobe_path
+from jobs import ConcatJob
+
+
+def test_unchanged_clips_skip_the_concat(clip_dir, tmp_path):
+    output_file = str(tmp_path / "concatenated.mp4")
+    assert run_job(ConcatJob(clip_dir, output_file)) == {"success": True}
+    output_state = os.stat(output_file).st_mtime_ns
+
+    messages = []
+    assert run_job(ConcatJob(clip_dir, output_file), messages) == {"success": True}
+    assert "Concatenated output is already up to date" in messages
+    assert os.stat(output_file).st_mtime_ns == output_state
+
+
+def test_new_clip_rebuilds_from_the_clips(clip_dir, tmp_path):
+    output_file = str(tmp_path / "concatenated.mp4")
+    assert run_job(ConcatJob(clip_dir, output_file)) == {"success": True}
+
+    make_clip(os.path.join(clip_dir, "GX030001.MP4"), 6)
+    messages = []
+    assert run_job(ConcatJob(clip_dir, output_file), messages) == {"success": True}
+    assert "Starting concatenation.." in messages
+    assert stream_duration(output_file, "v") == pytest.approx(30, abs=1 / FRAME_RATE)
+    assert [clip["path"] for clip in ConcatManifest.load(output_file).clips] == \
+        [os.path.join(clip_dir, name) for name in ("GX010001.MP4", "GX020001.MP4", "GX030001.MP4")]
+
+
+def decode_times(path, stream):
+    output = subprocess.run([get_ffprobe_path(), "-v", "error", "-select_streams", f"{stream}:0",
+                             "-show_entries", "packet=dts", "-of", "csv=p=0", str(path)],
+                            check=True, capture_output=True, text=True).stdout
+    return [int(line) for line in output.split()]
+
+
+@pytest.mark.parametrize("size", ["320x180", "640x360"])
+def test_new_clip_is_appended_to_a_fragmented_output(clip_dir, tmp_path, size):
+    output_file = str(tmp_path / "concatenated.mp4")
+    assert run_job(ConcatJob(clip_dir, output_file, fragmented=True, finalize=False)) == {"success": True}
+    with open(output_file, "rb") as f:
+        written = f.read()
+    inode = os.stat(output_file).st_ino
+
+    # A clip in another format is converted to the output's format first
+    make_clip(os.path.join(clip_dir, "GX030001.MP4"), 6, size=size)
+    messages = []
+    assert run_job(ConcatJob(clip_dir, output_file, fragmented=True, finalize=False), messages) == {"success": True}
+    assert "Appending 1 new clips.." in messages
+    assert os.stat(output_file).st_ino == inode
+    with open(output_file, "rb") as f:
+        # Everything but the trailing fragment index stays where it was
+        assert f.read(len(written) - 1024) == written[:-1024]
+
+    assert frame_count(output_file) == 30 * FRAME_RATE
+    for stream in ("v", "a"):
+        times = decode_times(output_file, stream)
+        assert all(earlier < later for earlier, later in zip(times, times[1:]))
+    assert stream_duration(output_file, "v") == pytest.approx(30, abs=1 / FRAME_RATE)
+    manifest = ConcatManifest.load(output_file)
+    assert len(manifest.clips) == 3
+    assert manifest.duration == pytest.approx(30, abs=0.1)
+    assert ConcatManifest.load(output_file).is_up_to_date(
+        [os.path.join(clip_dir, name) for name in ("GX010001.MP4", "GX020001.MP4", "GX030001.MP4")])
+
+
+def test_finalized_output_is_rebuilt_for_a_new_clip(clip_dir, tmp_path):
+    output_file = str(tmp_path / "concatenated.mp4")
+    assert run_job(ConcatJob(clip_dir, output_file, fragmented=True)) == {"success": True}
+
+    make_clip(os.path.join(clip_dir, "GX030001.MP4"), 6)
+    messages = []
+    assert run_job(ConcatJob(clip_dir, output_file, fragmented=True), messages) == {"success": True}
+    assert "Starting concatenation.." in messages
+    assert frame_count(output_file) == 30 * FRAME_RATE
+
+
+def test_finalizing_reports_progress_to_the_job(clip_dir, tmp_path, capsys):
+    events = []
+    result = {}
+    ConcatJob(clip_dir, str(tmp_path / "concatenated.mp4"), fragmented=True).run(
+        progress_handler=lambda percentage, *args: events.append(percentage),
+        success_handler=lambda: result.setdefault("success", True),
+        message_handler=events.append)
+
+    assert result == {"success": True}
+    finalizing = events.index("Finalizing the fragmented output..")
+    assert events[finalizing + 1:] and all(isinstance(event, (int, float)) for event in events[finalizing + 1:])
+    # No progress bar of its own
+    assert "%|" not in capsys.readouterr().err
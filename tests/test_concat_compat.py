@@ -0,0 +1,72 @@
+import os
+import subprocess
+
+import pytest
+
+import concat_compat
+from concat_compat import ClipNormalizer, check_compatibility
+from conftest import make_clip, run_job
+from ffmpeg_binaries import get_ffmpeg_path, get_ffprobe_path
+from hardware_encoder_util import EncoderProfile
+from highlight_export import Highlight, HighlightExportJob
+from jobs import ProcessJob
+
+
+@pytest.fixture
+def mixed_clip_dir(clip_dir):
+    # A third camera setting in the middle of the event, at another resolution and without audio
+    make_clip(os.path.join(clip_dir, "GX030001.MP4"), 6, audio=False, size="640x360")
+    make_clip(os.path.join(clip_dir, "GX040001.MP4"), 6)
+    return clip_dir
+
+
+def decode_errors(path):
+    return subprocess.run([get_ffmpeg_path(), "-v", "error", "-i", str(path), "-f", "null", "-"],
+                          capture_output=True, text=True).stderr
+
+
+def frame_sizes(path):
+    output = subprocess.run([get_ffprobe_path(), "-v", "error", "-select_streams", "v:0", "-show_entries",
+                             "frame=width,height", "-of", "compact=p=0:nk=1", str(path)],
+                            check=True, capture_output=True, text=True).stdout
+    return {line.strip("|") for line in output.split()}
+
+
+@pytest.mark.parametrize("re_encode", [False, True])
+def test_trim_across_a_mismatched_clip(mixed_clip_dir, tmp_path, re_encode):
+    output_file = tmp_path / "trim.mp4"
+    job = ProcessJob(None, str(output_file), "00:00:20", "00:00:28", mute=False, re_encode=re_encode,
+                     hw_acceleration=False, clip_dir=mixed_clip_dir)
+    assert run_job(job) == {"success": True}
+
+    assert decode_errors(output_file) == ""
+    assert frame_sizes(output_file) == {"320|180"}
+    assert not os.path.exists(tmp_path / ".trim.mp4.normalized")
+
+
+def test_highlights_across_a_mismatched_clip(mixed_clip_dir, tmp_path):
+    output_dir = tmp_path / "highlights"
+    output_dir.mkdir()
+    job = HighlightExportJob([Highlight(20, 28, "across")], str(output_dir), clip_dir=mixed_clip_dir)
+    assert run_job(job) == {"success": True}
+
+    assert decode_errors(output_dir / "across.mp4") == ""
+    assert frame_sizes(output_dir / "across.mp4") == {"320|180"}
+    assert os.listdir(output_dir) == ["across.mp4"]
+
+
+def test_encoder_filters_follow_the_scaling(mixed_clip_dir, tmp_path, monkeypatch):
+    # Stands in for h264_vaapi, whose upload filter must run after the scaling instead of replacing it
+    encoder = EncoderProfile("libx264", "h264", True, output_args=["-preset", "ultrafast", "-vf", "format=nv12"])
+    monkeypatch.setattr(concat_compat, "select_encoder", lambda codec, hw_acceleration: encoder)
+    clip_paths = [os.path.join(mixed_clip_dir, name) for name in sorted(os.listdir(mixed_clip_dir))]
+    report = check_compatibility(clip_paths)
+    normalizer = ClipNormalizer(report, str(tmp_path / "normalized"))
+
+    mismatched = os.path.join(mixed_clip_dir, "GX030001.MP4")
+    command = normalizer._command(mismatched, "normalized.mp4")
+    assert command.count("-vf") == 1
+    assert command[command.index("-vf") + 1].endswith("setsar=1,format=nv12")
+
+    normalized = normalizer.run()
+    assert frame_sizes(normalized[mismatched]) == {"320|180"}
@@ -0,0 +1,19 @@
+import logging
+
+from conftest import make_clip
+from ffmpeg_wrapper import FfmpegWrapper
+
+
+def test_command_line_is_logged_not_printed(ffmpeg, tmp_path, capsys, caplog):
+    source = make_clip(tmp_path / "source.mp4", 1)
+    log_path = tmp_path / "ffmpeg.txt"
+    result = {}
+    with caplog.at_level(logging.INFO, logger="eventvideotool.ffmpeg"):
+        FfmpegWrapper([ffmpeg, "-i", source, "-c", "copy", str(tmp_path / "copy.mp4"), "-y"]).run(
+            progress_handler=lambda *args: None, ffmpeg_output_file=str(log_path),
+            success_handler=lambda: result.setdefault("success", True))
+
+    assert result == {"success": True}
+    assert "copy.mp4" not in capsys.readouterr().out
+    assert [record.getMessage() for record in caplog.records][0].startswith(f"Running: {ffmpeg} -i ")
+    assert log_path.read_text().startswith(f"Running: {ffmpeg} -i ")
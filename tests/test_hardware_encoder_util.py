@@ -0,0 +1,25 @@
+import pytest
+
+import jobs
+from conftest import FRAME_RATE, frame_count, run_job, stream_duration
+from hardware_encoder_util import EncoderProfile
+from jobs import ProcessJob
+from utils import parse_time
+
+# Stands in for a hardware encoder, which skips the chunked software encode
+HARDWARE_STYLE = EncoderProfile("libx264", "h264", True, output_args=["-preset", "ultrafast"])
+
+
+@pytest.mark.parametrize("start, end", [("00:00:05", "00:00:15"), ("00:00:03", "00:00:09"), ("00:00:13", "00:00:20")])
+def test_hardware_encode_from_clips_is_frame_accurate(clip_dir, tmp_path, monkeypatch, start, end):
+    monkeypatch.setattr(jobs, "select_encoder", lambda codec="h264", hw_acceleration=True: HARDWARE_STYLE)
+    output_file = str(tmp_path / "trim.mp4")
+    messages = []
+    job = ProcessJob(None, output_file, start, end, mute=False, re_encode=True, hw_acceleration=True,
+                     clip_dir=clip_dir)
+    assert run_job(job, messages) == {"success": True}
+    assert "Starting processing.." in messages
+
+    duration = parse_time(end) - parse_time(start)
+    assert frame_count(output_file) == duration * FRAME_RATE
+    assert stream_duration(output_file, "a") == pytest.approx(duration, abs=1 / FRAME_RATE)
@@ -0,0 +1,72 @@
+import os
+import subprocess
+
+import pytest
+
+from conftest import FRAME_RATE, make_clip, run_job, stream_duration
+from ffmpeg_binaries import get_ffprobe_path
+from hardware_encoder_util import select_encoder
+from highlight_export import Highlight, HighlightExportJob, group_highlights, output_names
+from timeline import Timeline
+
+
+def test_output_names_are_unique():
+    highlights = [Highlight(0, 1, "goal"), Highlight(2, 3, "Goal"), Highlight(4, 5, "goal"), Highlight(6, 7, "a/b")]
+    assert list(output_names(highlights).values()) == ["goal.mp4", "Goal_2.mp4", "goal_3.mp4", "a_b.mp4"]
+
+
+@pytest.mark.parametrize("re_encode", [False, True])
+def test_export_from_clips(clip_dir, tmp_path, re_encode):
+    output_dir = tmp_path / "highlights"
+    output_dir.mkdir()
+    highlights = [Highlight(2, 5, "goal"), Highlight(10, 14, "goal"), Highlight(40, 45, "save")]
+    job = HighlightExportJob(highlights, str(output_dir), re_encode=re_encode, clip_dir=clip_dir,
+                             video_bitrate="300k")
+    messages = []
+    assert run_job(job, messages) == {"error": "Exported 2 highlights, skipped 1 that are empty or past the end of "
+                                               "the source: save"}
+    assert "Skipping highlights that are empty or past the end of the source: save" in messages
+
+    # Nothing but the outputs is left behind
+    assert sorted(os.listdir(output_dir)) == ["goal.mp4", "goal_2.mp4"]
+    if re_encode:
+        assert stream_duration(output_dir / "goal_2.mp4", "v") == pytest.approx(4, abs=1 / FRAME_RATE)
+
+
+def test_bitrate_is_passed_to_the_encoder(clip_dir, tmp_path):
+    job = HighlightExportJob([Highlight(2, 5, "goal")], str(tmp_path), re_encode=True, clip_dir=clip_dir,
+                             video_bitrate="300k")
+
+    timeline = Timeline.from_directory(clip_dir)
+    highlight = job.highlights[0]
+    plans = {highlight: job._output_plan(timeline, highlight, "goal.mp4")}
+    command, _ = job._group_command(timeline, group_highlights(job.highlights)[0], plans, str(tmp_path), 0,
+                                    select_encoder())
+    assert "300k" in command
+    assert plans[highlight].temp_file in command
+
+
+def video_frames(path):
+    output = subprocess.run([get_ffprobe_path(), "-v", "error", "-count_frames", "-select_streams", "v:0",
+                             "-show_entries", "stream=start_time,nb_read_frames", "-of", "csv=p=0", str(path)],
+                            check=True, capture_output=True, text=True).stdout
+    start_time, frames = output.strip().split(",")
+    return float(start_time), int(frames)
+
+
+def test_copies_from_input_file_keep_every_frame(ffmpeg, tmp_path):
+    input_file = make_clip(tmp_path / "input.mp4", 24)
+    output_dir = tmp_path / "highlights"
+    output_dir.mkdir()
+    # Close enough to share a run, and neither starts on a keyframe
+    highlights = [Highlight(5, 9, "first"), Highlight(9.5, 10.5, "second")]
+    assert run_job(HighlightExportJob(highlights, str(output_dir), input_file=input_file)) == {"success": True}
+
+    assert video_frames(output_dir / "first.mp4") == (0, 4 * FRAME_RATE)
+    assert video_frames(output_dir / "second.mp4") == (0, FRAME_RATE)
+
+
+def test_only_empty_highlights(clip_dir, tmp_path):
+    highlights = [Highlight(5, 5, "empty"), Highlight(6, 4, "backwards")]
+    assert run_job(HighlightExportJob(highlights, str(tmp_path), clip_dir=clip_dir)) == \
+        {"error": "No highlight ranges to export"}
@@ -0,0 +1,73 @@
+import struct
+import subprocess
+
+import pytest
+
+from conftest import make_clip
+from ffmpeg_binaries import get_ffmpeg_path
+from mp4_index import Mp4Index, Mp4IndexError, append_fragments, fragment_count
+
+
+def top_level_boxes(path):
+    with open(path, "rb") as f:
+        data = f.read()
+    boxes = []
+    position = 0
+    while position + 8 <= len(data):
+        size, box_type = struct.unpack_from(">I4s", data, position)
+        boxes.append((box_type, position, size))
+        position += size
+    return data, boxes
+
+
+@pytest.fixture
+def fragmented_clip(ffmpeg, tmp_path):
+    source = make_clip(tmp_path / "source.mp4", 8)
+    output = str(tmp_path / "fragmented.mp4")
+    subprocess.run([get_ffmpeg_path(), "-v", "error", "-i", source, "-c", "copy", "-movflags",
+                    "+frag_keyframe+empty_moov+default_base_moof", output, "-y"], check=True)
+    return output
+
+
+def test_fragment_count_skips_an_incomplete_mdat(fragmented_clip, tmp_path):
+    data, boxes = top_level_boxes(fragmented_clip)
+    fragments = sum(1 for box_type, _, _ in boxes if box_type == b"moof")
+    assert fragments > 1
+    assert fragment_count(fragmented_clip) == fragments
+
+    # Cut the file inside the last fragment's mdat, as if FFmpeg were still writing it
+    _, last_mdat, last_mdat_size = [box for box in boxes if box[0] == b"mdat"][-1]
+    truncated = tmp_path / "truncated.mp4"
+    truncated.write_bytes(data[:last_mdat + last_mdat_size // 2])
+    assert fragment_count(str(truncated)) == fragments - 1
+
+    # A moof whose mdat has not been started yet does not count either
+    truncated.write_bytes(data[:last_mdat])
+    assert fragment_count(str(truncated)) == fragments - 1
+
+
+def test_append_refuses_other_tracks_and_leaves_the_output_alone(fragmented_clip, tmp_path):
+    source = make_clip(tmp_path / "silent.mp4", 4, audio=False)
+    part = str(tmp_path / "part.mp4")
+    subprocess.run([get_ffmpeg_path(), "-v", "error", "-i", source, "-c", "copy", "-movflags",
+                    "+frag_keyframe+empty_moov+default_base_moof", part, "-y"], check=True)
+    with open(fragmented_clip, "rb") as f:
+        data = f.read()
+
+    with pytest.raises(Mp4IndexError):
+        append_fragments(fragmented_clip, part, 8)
+    with open(fragmented_clip, "rb") as f:
+        assert f.read() == data
+
+
+def test_regular_mp4(ffmpeg, tmp_path):
+    clip = make_clip(tmp_path / "clip.mp4", 4)
+    assert fragment_count(clip) == 0
+    index = Mp4Index.read(clip)
+    assert index.duration == pytest.approx(4, abs=0.05)
+    assert index.keyframes == pytest.approx([0, 2], abs=0.05)
+
+
+def test_fragmented_mp4_is_left_to_ffprobe(fragmented_clip):
+    with pytest.raises(Mp4IndexError):
+        Mp4Index.read(fragmented_clip)
@@ -0,0 +1,41 @@
+import os
+
+import pytest
+
+from conftest import make_clip, run_job
+from proxy import ProxyJob, ThumbnailIndex, current_proxy, preview_dir, proxy_path
+from timeline import list_clips
+
+
+def test_proxy_from_clips_leaves_no_filelist(clip_dir, tmp_path):
+    output_dir = str(tmp_path / "output")
+    os.mkdir(output_dir)
+    assert run_job(ProxyJob(output_dir, clip_dir=clip_dir)) == {"success": True}
+
+    assert os.path.isfile(proxy_path(output_dir))
+    assert ThumbnailIndex.load(output_dir).times
+    assert not os.path.exists(os.path.join(preview_dir(output_dir), "filelist.txt"))
+
+    assert not [name for name in os.listdir(output_dir) if name.startswith(".")]
+
+
+def test_proxy_is_only_current_for_the_clips_it_was_built_from(clip_dir, tmp_path):
+    output_dir = str(tmp_path / "output")
+    os.mkdir(output_dir)
+    first_clip, second_clip = list_clips(clip_dir)
+    assert run_job(ProxyJob(output_dir, clip_paths=[first_clip])) == {"success": True}
+    assert current_proxy(output_dir, [first_clip]) == proxy_path(output_dir)
+    assert current_proxy(output_dir, [first_clip, second_clip]) is None
+
+    messages = []
+    assert run_job(ProxyJob(output_dir, clip_paths=[first_clip]), messages) == {"success": True}
+    assert "Preview proxy is already up to date" in messages
+
+    # A clip copied over again invalidates the proxy, the next run rebuilds it
+    make_clip(first_clip, 4)
+    assert current_proxy(output_dir, [first_clip]) is None
+    messages = []
+    assert run_job(ProxyJob(output_dir, clip_paths=[first_clip]), messages) == {"success": True}
+    assert "Building preview proxy.." in messages
+    assert current_proxy(output_dir, [first_clip]) == proxy_path(output_dir)
+    assert ThumbnailIndex.load(output_dir).duration == pytest.approx(4, abs=0.1)
@@ -0,0 +1,41 @@
+import pytest
+
+import renditions
+from conftest import FRAME_RATE, frame_count, run_job, stream_duration
+from hardware_encoder_util import EncoderProfile, merge_input_args
+from jobs import ProcessJob
+from renditions import Rendition, rendition_args
+from utils import parse_time
+
+CUDA = EncoderProfile("h264_nvenc", "h264", True, input_args=["-hwaccel", "cuda", "-hwaccel_output_format", "cuda"])
+VAAPI = EncoderProfile("hevc_vaapi", "hevc", True,
+                       input_args=["-hwaccel", "vaapi", "-vaapi_device", "/dev/dri/renderD128"])
+
+
+def test_merge_keeps_flag_value_pairs():
+    assert merge_input_args(CUDA.input_args, VAAPI.input_args, ["-hwaccel", "auto"]) == [
+        "-hwaccel", "cuda", "-hwaccel_output_format", "cuda", "-vaapi_device", "/dev/dri/renderD128"]
+    assert merge_input_args([], ["-hwaccel", "auto"]) == ["-hwaccel", "auto"]
+
+
+def test_rendition_input_args_keep_their_values(monkeypatch):
+    encoders = {"h264": CUDA, "hevc": VAAPI}
+    monkeypatch.setattr(renditions, "select_encoder", lambda codec, hw_acceleration: encoders[codec])
+    input_args, _ = rendition_args([Rendition("a", 720), Rendition("b", 540, codec="hevc"), Rendition("c", 360)],
+                                   ["a.mp4", "b.mp4", "c.mp4"], hw_acceleration=True)
+    assert input_args == ["-hwaccel", "cuda", "-hwaccel_output_format", "cuda", "-vaapi_device", "/dev/dri/renderD128"]
+
+
+@pytest.mark.parametrize("start, end", [("00:00:05", "00:00:15"), ("00:00:03", "00:00:09")])
+@pytest.mark.parametrize("re_encode", [True, False])
+def test_renditions_from_clips_are_frame_accurate(clip_dir, tmp_path, start, end, re_encode):
+    output_file = str(tmp_path / "trim.mp4")
+    job = ProcessJob(None, output_file, start, end, mute=False, re_encode=re_encode, hw_acceleration=False,
+                     clip_dir=clip_dir, renditions=[Rendition("small", 90, "200k")])
+    assert run_job(job) == {"success": True}
+
+    # A copied trim can only start on a keyframe, its renditions are encoded and start exactly
+    duration = parse_time(end) - parse_time(start)
+    for path in [str(tmp_path / "trim_small.mp4")] + ([output_file] if re_encode else []):
+        assert frame_count(path) == duration * FRAME_RATE
+        assert stream_duration(path, "a") == pytest.approx(duration, abs=1 / FRAME_RATE)
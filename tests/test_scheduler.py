@@ -0,0 +1,116 @@
+import threading
+import time
+
+from job_control import CPU_BOUND, IO_BOUND, JobControl
+from scheduler import CANCELLED, QUEUED, RUNNING, SUCCEEDED, JobScheduler
+
+
+class BlockingJob:
+    """Runs until the test releases or cancels it, logging when it starts."""
+
+    def __init__(self, name, log, resource=CPU_BOUND, released=False):
+        self.name = name
+        self.log = log
+        self.resource = resource
+        self.control = JobControl()
+        self.release = threading.Event()
+        if released:
+            self.release.set()
+
+    def cancel(self):
+        self.control.cancel()
+
+    def run(self, progress_handler=None, success_handler=None, error_handler=None, message_handler=None):
+        self.log.append(self.name)
+        while not self.release.wait(0.01):
+            if self.control.cancelled:
+                error_handler("Cancelled")
+                return
+        success_handler()
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "Timed out"
+        time.sleep(0.01)
+
+
+def test_limits_per_resource():
+    scheduler = JobScheduler(limits={CPU_BOUND: 1, IO_BOUND: 2}, low_priority=False)
+    log = []
+    jobs = [BlockingJob(f"cpu{index}", log) for index in range(2)] + \
+        [BlockingJob(f"io{index}", log, IO_BOUND) for index in range(3)]
+    scheduled = [scheduler.submit(job, name=job.name) for job in jobs]
+
+    wait_until(lambda: len(log) == 3)
+    assert sorted(log) == ["cpu0", "io0", "io1"]
+    assert [entry.state for entry in scheduled] == [RUNNING, QUEUED, RUNNING, RUNNING, QUEUED]
+
+    # A finished copy frees an I/O slot only, the second encode keeps waiting
+    jobs[2].release.set()
+    wait_until(lambda: len(log) == 4)
+    assert log[-1] == "io2"
+    assert scheduled[1].state == QUEUED
+
+    jobs[0].release.set()
+    wait_until(lambda: len(log) == 5)
+    for job in jobs:
+        job.release.set()
+    assert scheduler.wait(timeout=5)
+
+
+def test_priority_then_submission_order():
+    scheduler = JobScheduler(limits={CPU_BOUND: 1}, low_priority=False)
+    log = []
+    blocker = BlockingJob("blocker", log)
+    scheduler.submit(blocker)
+    wait_until(lambda: log == ["blocker"])
+
+    for name, priority in [("low1", 0), ("high", 5), ("low2", 0), ("middle", 1)]:
+        scheduler.submit(BlockingJob(name, log, released=True), priority=priority)
+    blocker.release.set()
+
+    assert scheduler.wait(timeout=5)
+    assert log == ["blocker", "high", "middle", "low1", "low2"]
+
+
+def test_cancel_queued_job():
+    scheduler = JobScheduler(limits={CPU_BOUND: 1}, low_priority=False)
+    log = []
+    blocker = BlockingJob("blocker", log)
+    scheduler.submit(blocker)
+    errors = []
+    queued = scheduler.submit(BlockingJob("queued", log, released=True), error_handler=errors.append)
+
+    scheduler.cancel(queued)
+    assert queued.state == CANCELLED
+    assert errors == ["Cancelled"]
+
+    blocker.release.set()
+    assert not scheduler.wait(timeout=5)
+    assert log == ["blocker"]
+    assert scheduler.jobs(SUCCEEDED)[0].job is blocker
+
+
+def test_cancel_running_job_starts_the_next():
+    scheduler = JobScheduler(limits={CPU_BOUND: 1}, low_priority=False)
+    log = []
+    errors = []
+    running = scheduler.submit(BlockingJob("running", log), error_handler=errors.append)
+    scheduler.submit(BlockingJob("next", log, released=True))
+    wait_until(lambda: log == ["running"])
+
+    scheduler.cancel(running)
+    assert not scheduler.wait(timeout=5)
+    assert running.state == CANCELLED
+    assert errors == ["Cancelled"]
+    assert log == ["running", "next"]
+
+
+def test_low_priority_is_set_on_the_job_control():
+    job = BlockingJob("job", [], released=True)
+    scheduler = JobScheduler()
+    scheduler.submit(job)
+    assert scheduler.wait(timeout=5)
+    assert job.control.low_priority
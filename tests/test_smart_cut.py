@@ -0,0 +1,55 @@
+import subprocess
+
+import pytest
+
+from conftest import FRAME_RATE, run_job, stream_duration
+from ffmpeg_binaries import get_ffmpeg_path
+from jobs import ProcessJob
+from probe_service import get_probe_service
+from smart_cut import plan_smart_cut
+
+KEYFRAMES = [0, 2, 4, 6, 8]
+
+
+def pieces(keyframes, start, end, clip_duration=10):
+    return [(piece.mode, piece.start, piece.end) for piece in plan_smart_cut(keyframes, start, end, clip_duration)]
+
+
+@pytest.mark.parametrize("start, end, expected", [
+    # Both cuts between keyframes, only the partial GOPs at either end are encoded
+    (3, 7, [("encode", 3, 4), ("copy", 4, 6), ("encode", 6, 7)]),
+    # Cuts on keyframes, within the tolerance, need no encode
+    (2, 6, [("copy", 2, 6)]),
+    (2.0005, 5.9995, [("copy", 2, 6)]),
+    (3, 6, [("encode", 3, 4), ("copy", 4, 6)]),
+    # To the end of the clip the copy runs to the end, even without a keyframe there
+    (3, 10, [("encode", 3, 4), ("copy", 4, None)]),
+    (7, 10, [("encode", 7, 8), ("copy", 8, None)]),
+    # No whole GOP inside the range
+    (4.5, 5.5, [("encode", 4.5, 5.5)]),
+    (3, 4.5, [("encode", 3, 4.5)]),
+])
+def test_plan(start, end, expected):
+    assert pieces(KEYFRAMES, start, end) == expected
+
+
+def test_plan_without_keyframes_in_the_search_window():
+    assert pieces([], 3, 7) == [("encode", 3, 7)]
+    assert pieces([0, 20], 3, 7, 30) == [("encode", 3, 7)]
+    assert pieces([0], 3, 10) == [("encode", 3, 10)]
+
+
+def test_codec_without_encoder_falls_back_to_a_full_encode(ffmpeg, tmp_path):
+    input_file = str(tmp_path / "input.mp4")
+    subprocess.run([get_ffmpeg_path(), "-v", "error", "-f", "lavfi", "-i",
+                    f"testsrc=size=320x180:rate={FRAME_RATE}:duration=12", "-c:v", "mpeg4", "-g", "60", input_file],
+                   check=True)
+    output_file = str(tmp_path / "trim.mp4")
+    messages = []
+    job = ProcessJob(input_file, output_file, "00:00:03", "00:00:09", mute=False, re_encode=False,
+                     hw_acceleration=False, smart_cut=True)
+    assert run_job(job, messages) == {"success": True}
+
+    assert "Smart cut cannot encode mpeg4, re-encoding the whole trim instead" in messages
+    assert get_probe_service().codec_name(output_file) == "h264"
+    assert stream_duration(output_file, "v") == pytest.approx(6, abs=1 / FRAME_RATE)
@@ -0,0 +1,77 @@
+import pytest
+
+from stream_planner import COPY, DROP, TRANSCODE, plan_streams
+
+# What ffprobe reports for a HERO clip: video, audio, then the timecode and GPMF telemetry data tracks
+GOPRO_STREAMS = [
+    {"index": 0, "codec_type": "video", "codec_name": "hevc"},
+    {"index": 1, "codec_type": "audio", "codec_name": "aac"},
+    {"index": 2, "codec_type": "data", "codec_tag_string": "tmcd"},
+    {"index": 3, "codec_type": "data", "codec_name": "bin_data", "codec_tag_string": "gpmd"},
+]
+PCM_STREAMS = [
+    {"index": 0, "codec_type": "video", "codec_name": "h264"},
+    {"index": 1, "codec_type": "audio", "codec_name": "pcm_s16le"},
+]
+EXTRA_STREAMS = [
+    {"index": 0, "codec_type": "video", "codec_name": "h264"},
+    {"index": 1, "codec_type": "audio", "codec_name": "aac"},
+    {"index": 2, "codec_type": "audio", "codec_name": "aac"},
+    {"index": 3, "codec_type": "video", "codec_name": "mjpeg", "disposition": {"attached_pic": 1}},
+]
+
+CASES = {
+    "gopro copy drops the data tracks": (
+        GOPRO_STREAMS, {}, [COPY, COPY, DROP, DROP],
+        ["-map", "0:0", "-map", "0:1", "-c:v", "copy", "-c:a", "copy", "-write_tmcd", "0"],
+    ),
+    "gopro re-encode": (
+        GOPRO_STREAMS, {"re_encode": True, "video_args": ["-c:v", "libx264"]}, [TRANSCODE, COPY, DROP, DROP],
+        ["-map", "0:0", "-map", "0:1", "-c:v", "libx264", "-c:a", "copy", "-write_tmcd", "0"],
+    ),
+    "gopro muted": (
+        GOPRO_STREAMS, {"mute": True}, [COPY, DROP, DROP, DROP],
+        ["-map", "0:0", "-c:v", "copy", "-an", "-write_tmcd", "0"],
+    ),
+    "gopro into mkv keeps no timecode flag": (
+        GOPRO_STREAMS, {"output_file": "trim.mkv"}, [COPY, COPY, DROP, DROP],
+        ["-map", "0:0", "-map", "0:1", "-c:v", "copy", "-c:a", "copy"],
+    ),
+    "pcm audio does not fit mp4": (
+        PCM_STREAMS, {}, [COPY, TRANSCODE],
+        ["-map", "0:0", "-map", "0:1", "-c:v", "copy", "-c:a", "aac"],
+    ),
+    "pcm audio fits mov": (
+        PCM_STREAMS, {"output_file": "trim.mov"}, [COPY, COPY],
+        ["-map", "0:0", "-map", "0:1", "-c:v", "copy", "-c:a", "copy"],
+    ),
+    "only the first audio stream and no cover image": (
+        EXTRA_STREAMS, {}, [COPY, COPY, DROP, DROP],
+        ["-map", "0:0", "-map", "0:1", "-c:v", "copy", "-c:a", "copy"],
+    ),
+}
+
+
+@pytest.mark.parametrize("streams, options, actions, output_args", CASES.values(), ids=CASES.keys())
+def test_plan_streams(streams, options, actions, output_args):
+    plan = plan_streams(streams, **options)
+    assert [action.action for action in plan.actions] == actions
+    assert plan.output_args() == output_args
+
+
+@pytest.mark.parametrize("streams, options, copies_everything", [
+    (PCM_STREAMS, {"output_file": "trim.mov"}, True),
+    (PCM_STREAMS, {}, False),
+    # Dropping the data tracks is not a copy of the whole file
+    (GOPRO_STREAMS, {}, False),
+    (GOPRO_STREAMS[:2], {}, True),
+    (GOPRO_STREAMS[:2], {"re_encode": True}, False),
+])
+def test_whole_file_copy(streams, options, copies_everything):
+    assert plan_streams(streams, **options).copies_everything == copies_everything
+
+
+def test_filter_outputs_replace_the_input_streams():
+    plan = plan_streams(GOPRO_STREAMS, re_encode=True, video_args=["-c:v", "libx264"])
+    assert plan.output_args({"video": "[video]", "audio": "[audio]"}) == \
+        ["-map", "[video]", "-map", "[audio]", "-c:v", "libx264", "-c:a", "aac", "-write_tmcd", "0"]
@@ -0,0 +1,118 @@
+import os
+import subprocess
+from datetime import datetime, time
+
+import pytest
+
+from conftest import make_clip, run_job
+from ffmpeg_binaries import get_ffmpeg_path
+from time_sync import SyncIndex, SyncIndexJob, clip_start_time, parse_schedule
+
+# Two ten minute clips either side of midnight, with a 30 second gap while the card was swapped
+SPANS = [
+    ("GX010001.MP4", datetime(2024, 5, 1, 23, 50), 600, 0),
+    ("GX020001.MP4", datetime(2024, 5, 2, 0, 0, 30), 600, 600),
+]
+
+
+@pytest.mark.parametrize("event_time, expected", [
+    (datetime(2024, 5, 1, 23, 50), ("GX010001.MP4", 0, 0)),
+    (datetime(2024, 5, 1, 23, 55), ("GX010001.MP4", 300, 300)),
+    (datetime(2024, 5, 2, 0, 0, 15), None),
+    (datetime(2024, 5, 2, 0, 5, 30), ("GX020001.MP4", 300, 900)),
+    (datetime(2024, 5, 2, 0, 10, 30), ("GX020001.MP4", 600, 1200)),
+    (datetime(2024, 5, 2, 0, 10, 31), None),
+    (datetime(2024, 5, 1, 23, 49, 59), None),
+])
+def test_locate_finds_the_clip_recording_at_a_time(event_time, expected):
+    position = SyncIndex(SPANS).locate(event_time)
+    if expected is None:
+        assert position is None
+    else:
+        assert (position.path, position.offset, position.position) == pytest.approx(expected)
+
+
+def test_overlapping_clips_prefer_the_latest_start():
+    spans = SPANS + [("GX010002.MP4", datetime(2024, 5, 1, 23, 58), 60, 1200)]
+    position = SyncIndex(spans).locate(datetime(2024, 5, 1, 23, 58, 30))
+    assert (position.path, position.offset, position.position) == ("GX010002.MP4", 30, 1230)
+
+
+@pytest.mark.parametrize("time_of_day, expected", [
+    (time(23, 55), datetime(2024, 5, 1, 23, 55)),
+    # After midnight belongs to the second day of the recording
+    (time(0, 5, 30), datetime(2024, 5, 2, 0, 5, 30)),
+    # Never recorded, it stays on the first day
+    (time(12, 0), datetime(2024, 5, 1, 12, 0)),
+])
+def test_times_of_day_roll_over_midnight(time_of_day, expected):
+    assert SyncIndex(SPANS).resolve(time_of_day) == expected
+
+
+def test_clock_offset_moves_events_onto_the_camera_clock():
+    # The camera clock runs 30 seconds ahead, the real 23:54:30 was recorded at 23:55:00 camera time
+    sync_index = SyncIndex(SPANS, clock_offset=30)
+    position = sync_index.locate(datetime(2024, 5, 1, 23, 54, 30))
+    assert position.position == pytest.approx(300)
+    assert sync_index.locate_many([time(0, 5)])[0].position == pytest.approx(900)
+
+
+def test_calibrate_from_one_known_event():
+    sync_index = SyncIndex(SPANS)
+    assert sync_index.calibrate(time(23, 54, 30), 300) == pytest.approx(30)
+    assert sync_index.locate(datetime(2024, 5, 1, 23, 54, 30)).position == pytest.approx(300)
+    with pytest.raises(ValueError):
+        sync_index.calibrate(time(0, 0), 5000)
+
+
+def test_event_ranges_are_clamped_and_report_missed_events():
+    highlights, missed = SyncIndex(SPANS).event_ranges(
+        [(time(23, 50, 5), "kickoff"), (time(0, 0, 15), "swap"), (time(0, 10, 20), "final")],
+        before=10, after=20, total_duration=1200)
+    assert [(highlight.start, highlight.end, highlight.name) for highlight in highlights] == \
+        [(0, 25, "kickoff"), (1180, 1200, "final")]
+    assert missed == ["swap"]
+
+
+def test_parse_schedule():
+    events = parse_schedule("# Heats\n\n23:55 heat 1\n00:05:30.5, heat 2\n2024-05-02 00:07:00\t\n")
+    assert events == [
+        (time(23, 55), "heat 1"),
+        (time(0, 5, 30, 500000), "heat 2"),
+        (datetime(2024, 5, 2, 0, 7), "event_3"),
+    ]
+
+
+def test_parse_schedule_names_the_bad_line():
+    with pytest.raises(ValueError, match="Line 2"):
+        parse_schedule("23:55 heat 1\nhalf time\n")
+
+
+def test_timecode_gives_the_start_to_the_frame():
+    video_info = {
+        "format": {"tags": {"creation_time": "2024-05-01T21:50:00.000000Z"}},
+        "streams": [{"codec_type": "video", "r_frame_rate": "30/1", "tags": {"timecode": "23:50:05:15"}}],
+    }
+    assert clip_start_time(video_info) == datetime(2024, 5, 1, 23, 50, 5, 500000)
+
+
+def test_sync_index_job(clip_dir, tmp_path):
+    for index, name in enumerate(sorted(os.listdir(clip_dir))):
+        path = os.path.join(clip_dir, name)
+        tagged = str(tmp_path / name)
+        subprocess.run([get_ffmpeg_path(), "-v", "error", "-i", path, "-c", "copy", "-metadata",
+                        f"creation_time=2024-05-01T23:5{index}:00Z", tagged, "-y"], check=True)
+        os.replace(tagged, path)
+
+    job = SyncIndexJob(clip_dir=clip_dir)
+    assert run_job(job) == {"success": True}
+    assert [span[1] for span in job.sync_index.spans] == [datetime(2024, 5, 1, 23, 50), datetime(2024, 5, 1, 23, 51)]
+    assert job.timeline.total_duration == pytest.approx(24, abs=0.1)
+
+
+def test_sync_index_job_without_creation_times(ffmpeg, tmp_path):
+    clip_dir = tmp_path / "clips"
+    clip_dir.mkdir()
+    make_clip(clip_dir / "GX010001.MP4", 2)
+    assert run_job(SyncIndexJob(clip_dir=str(clip_dir))) == {"error": "None of the clips has a creation time"}
+    assert "Set a clip folder" in run_job(SyncIndexJob(clip_dir=str(tmp_path / "missing")))["error"]
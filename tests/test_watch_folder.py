@@ -0,0 +1,93 @@
+import os
+
+import watch_folder
+from conftest import make_clip
+from watch_folder import FolderWatcher
+
+
+class RecordingScheduler:
+    """Keeps submitted jobs instead of running them, so a test decides how they end."""
+
+    class Scheduled:
+        done = True
+
+    def __init__(self):
+        self.submitted = []
+
+    def submit(self, job, name=None, **handlers):
+        self.submitted.append((job, handlers))
+        return self.Scheduled()
+
+
+def poll_until_settled(watcher):
+    # The first poll sees the clips, the second finds them unchanged
+    watcher.poll()
+    watcher.poll()
+
+
+def test_failed_concat_is_retried_once_a_clip_changes(clip_dir, tmp_path):
+    scheduler = RecordingScheduler()
+    errors = []
+    watcher = FolderWatcher(clip_dir, str(tmp_path / "concatenated.mp4"), scheduler, settle_time=0,
+                            error_handler=errors.append, message_handler=lambda message: None)
+
+    poll_until_settled(watcher)
+    assert len(scheduler.submitted) == 1
+    job, handlers = scheduler.submitted[0]
+    handlers["error_handler"]("Impossible to open the first clip")
+    assert errors == ["Impossible to open the first clip"]
+
+    # Nothing changed, so the same concat is not queued again
+    poll_until_settled(watcher)
+    assert len(scheduler.submitted) == 1
+
+    # The first clip was still being written to, once it changes and settles again the same clips are retried
+    first_clip = job.clip_paths[0]
+    stat = os.stat(first_clip)
+    os.utime(first_clip, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    poll_until_settled(watcher)
+    assert len(scheduler.submitted) == 2
+    assert scheduler.submitted[1][0].clip_paths == job.clip_paths
+
+
+def test_cancelled_concat_is_not_remembered_as_submitted(clip_dir, tmp_path):
+    scheduler = RecordingScheduler()
+    watcher = FolderWatcher(clip_dir, str(tmp_path / "concatenated.mp4"), scheduler, settle_time=0,
+                            message_handler=lambda message: None)
+
+    poll_until_settled(watcher)
+    scheduler.submitted[0][1]["error_handler"]("Cancelled")
+    assert watcher._submitted is None
+
+
+def test_concat_waits_until_the_folder_is_quiet(clip_dir, tmp_path, monkeypatch):
+    clock = [0]
+    monkeypatch.setattr(watch_folder.time, "monotonic", lambda: clock[0])
+    scheduler = RecordingScheduler()
+    watcher = FolderWatcher(clip_dir, str(tmp_path / "concatenated.mp4"), scheduler, settle_time=5,
+                            message_handler=lambda message: None)
+
+    def poll_at(seconds):
+        clock[0] = seconds
+        watcher.poll()
+        return len(scheduler.submitted)
+
+    assert poll_at(0) == 0
+    assert poll_at(6) == 1
+    job = scheduler.submitted[0][0]
+    assert len(job.clip_paths) == 2
+    # Later batches are appended to the fragmented output instead of rewriting it
+    assert job.fragmented and not job.finalize
+
+    # A card being copied keeps changing the folder, nothing is queued until it stops
+    new_clip = os.path.join(clip_dir, "GX030001.MP4")
+    make_clip(new_clip, 2)
+    assert poll_at(7) == 1
+    stat = os.stat(new_clip)
+    os.utime(new_clip, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    assert poll_at(10) == 1
+    make_clip(os.path.join(clip_dir, "GX040001.MP4"), 2)
+    assert poll_at(14) == 1
+    assert poll_at(18) == 1
+    assert poll_at(19) == 2
+    assert len(scheduler.submitted[1][0].clip_paths) == 4
@@ -0,0 +1,256 @@
+import bisect
+import calendar
+import os
+import re
+from datetime import datetime, timedelta
+
+from highlight_export import Highlight
+from job_control import IO_BOUND, JobControl
+from probe_service import get_probe_service
+from timeline import Timeline, list_clips
+from utils import format_time
+
+# Trim ranges around each scheduled event
+DEFAULT_BEFORE = 10
+DEFAULT_AFTER = 20
+TIMECODE_PATTERN = re.compile(r"^(\d{2}):(\d{2}):(\d{2})[:;.](\d{2})$")
+EVENT_PATTERN = re.compile(r"^\s*(?:(\d{4}-\d{2}-\d{2})[ T])?(\d{1,2}:\d{2}(?::\d{2}(?:\.\d+)?)?)\s*[,;\t ]?\s*(.*)$")
+
+
+def _seconds(wall_time):
+    # Wall-clock times stay naive, cameras store their local clock and DST must not shift anything
+    return calendar.timegm(wall_time.timetuple()) + wall_time.microsecond / 1_000_000
+
+
+def parse_creation_time(value):
+    """Parses an ISO 8601 creation_time tag into a naive datetime, ignoring the zone the camera claims."""
+    value = value.strip().rstrip("Z")
+    value = re.sub(r"[+-]\d{2}:?\d{2}$", "", value)
+    for pattern in ("%Y-%m-%dT%H:%M:%S.%f", "%Y-%m-%dT%H:%M:%S", "%Y-%m-%d %H:%M:%S"):
+        try:
+            return datetime.strptime(value, pattern)
+        except ValueError:
+            continue
+    raise ValueError(f"Unrecognised creation time: {value}")
+
+
+def clip_start_time(video_info):
+    """Returns when a clip started recording, from its creation_time and, when present, its start timecode."""
+    tags = video_info.get("format", {}).get("tags", {})
+    streams = video_info.get("streams", [])
+    creation_time = tags.get("creation_time")
+    timecode = tags.get("timecode")
+    for stream in streams:
+        stream_tags = stream.get("tags", {})
+        creation_time = creation_time or stream_tags.get("creation_time")
+        timecode = timecode or stream_tags.get("timecode")
+    if not creation_time:
+        return None
+
+    start = parse_creation_time(creation_time)
+    match = TIMECODE_PATTERN.match(timecode or "")
+    if match:
+        # The timecode carries the time of day with frame precision, the tag only the date reliably
+        hours, minutes, seconds, frames = (int(group) for group in match.groups())
+        rate = _frame_rate(streams)
+        start = start.replace(hour=hours % 24, minute=minutes, second=seconds,
+                              microsecond=int(frames / rate * 1_000_000) if rate else 0)
+    return start
+
+
+def _frame_rate(streams):
+    for stream in streams:
+        if stream.get("codec_type") == "video":
+            numerator, _, denominator = stream.get("r_frame_rate", "0/1").partition("/")
+            try:
+                return float(numerator) / float(denominator or 1)
+            except (ValueError, ZeroDivisionError):
+                return 0
+    return 0
+
+
+class SyncPosition:
+    def __init__(self, path, offset, position):
+        self.path = path
+        self.offset = offset  # seconds into the clip
+        self.position = position  # seconds into the concatenated timeline
+
+    def __repr__(self):
+        return f"SyncPosition({self.path!r}, {self.offset:.3f}, {self.position:.3f})"
+
+
+class SyncIndex:
+    """Sorted wall-clock spans of a clip set, for mapping real-world times onto clips and timeline positions.
+
+    clock_offset is how far the camera clock runs ahead of real time, in seconds.
+    """
+
+    def __init__(self, spans, clock_offset=0):
+        # spans is a list of (path, recording start, duration, timeline offset) tuples
+        self.spans = sorted(spans, key=lambda span: span[1])
+        self.clock_offset = clock_offset
+        self._starts = [_seconds(span[1]) for span in self.spans]
+        self._longest = max((span[2] for span in self.spans), default=0)
+
+    @classmethod
+    def from_timeline(cls, timeline, clock_offset=0):
+        paths = [path for path, _ in timeline.clips]
+        spans = []
+        for index, video_info in enumerate(get_probe_service().probe_many(paths)):
+            path, duration = timeline.clips[index]
+            start = clip_start_time(video_info) if video_info else None
+            if start is None:
+                print(f"No creation time in {path}, it is left out of time sync")
+                continue
+            spans.append((path, start, duration, timeline.clip_start(index)))
+        return cls(spans, clock_offset)
+
+    @property
+    def recording_start(self):
+        return self.spans[0][1] if self.spans else None
+
+    @property
+    def recording_end(self):
+        return max(span[1] + timedelta(seconds=span[2]) for span in self.spans) if self.spans else None
+
+    def calibrate(self, actual_time, position):
+        """Sets the clock offset from one event whose real time and timeline position are both known."""
+        for path, start, duration, timeline_offset in self.spans:
+            if timeline_offset <= position <= timeline_offset + duration:
+                camera_time = start + timedelta(seconds=position - timeline_offset)
+                self.clock_offset = (camera_time - self.resolve(actual_time, apply_offset=False)).total_seconds()
+                return self.clock_offset
+        raise ValueError(f"Position {format_time(position)} is not inside a clip with a creation time")
+
+    def resolve(self, event_time, apply_offset=True):
+        """Turns a datetime, or a time of day on the day of recording, into a camera clock datetime."""
+        if not isinstance(event_time, datetime):
+            if not self.spans:
+                raise ValueError("No clips with a creation time")
+            # A time of day belongs to whichever recording day has it inside the recording, else the first day
+            day = self.recording_start.date()
+            last_day = self.recording_end.date()
+            candidate = datetime.combine(day, event_time)
+            while day <= last_day:
+                resolved = datetime.combine(day, event_time)
+                if self.locate(resolved, apply_offset) is not None:
+                    candidate = resolved
+                    break
+                day += timedelta(days=1)
+            event_time = candidate
+        if apply_offset:
+            event_time = event_time + timedelta(seconds=self.clock_offset)
+        return event_time
+
+    def locate(self, event_time, apply_offset=True):
+        """Returns a SyncPosition for a real-world datetime, or None when no clip was recording at that time."""
+        camera_time = _seconds(event_time) + (self.clock_offset if apply_offset else 0)
+        index = bisect.bisect_right(self._starts, camera_time) - 1
+        # Spans may overlap, the latest start that still covers the time wins
+        while index >= 0 and camera_time - self._starts[index] <= self._longest:
+            path, _, duration, timeline_offset = self.spans[index]
+            offset = camera_time - self._starts[index]
+            if offset <= duration:
+                return SyncPosition(path, offset, timeline_offset + offset)
+            index -= 1
+        return None
+
+    def locate_many(self, event_times):
+        """Maps a list of datetimes or times of day in one call, with None for times nothing was recording."""
+        positions = []
+        for event_time in event_times:
+            if isinstance(event_time, datetime):
+                positions.append(self.locate(event_time))
+            else:
+                positions.append(self.locate(self.resolve(event_time), apply_offset=False))
+        return positions
+
+    def event_ranges(self, events, before=DEFAULT_BEFORE, after=DEFAULT_AFTER, total_duration=None):
+        """Returns (Highlights on the timeline, names of the events that fall outside every clip)."""
+        positions = self.locate_many([event_time for event_time, _ in events])
+        highlights = []
+        missed = []
+        for (event_time, name), position in zip(events, positions):
+            if position is None:
+                missed.append(name)
+                continue
+            start = max(position.position - before, 0)
+            end = position.position + after
+            if total_duration is not None:
+                end = min(end, total_duration)
+            highlights.append(Highlight(start, end, name))
+        return highlights, missed
+
+
+class SyncIndexJob:
+    """Reads the recording times of a clip folder, or of one file, into a SyncIndex without blocking the GUI."""
+
+    # Probing reads the headers of every clip, which is slow on a card or a network share
+    resource = IO_BOUND
+
+    def __init__(self, clip_dir=None, input_file=None, control=None):
+        self.clip_dir = clip_dir
+        self.input_file = input_file
+        self.control = control or JobControl()
+        self.timeline = None
+        self.sync_index = None
+
+    def cancel(self):
+        self.control.cancel()
+
+    def run(self, progress_handler=None, success_handler=None, error_handler=None, message_handler=None):
+        if message_handler:
+            message_handler("Reading clip recording times..")
+        try:
+            if self.clip_dir and os.path.isdir(self.clip_dir) and list_clips(self.clip_dir):
+                timeline = Timeline.from_directory(self.clip_dir)
+            elif self.input_file and os.path.isfile(self.input_file):
+                timeline = Timeline.from_files([self.input_file])
+            else:
+                raise ValueError("Set a clip folder or a concatenated file first")
+            sync_index = SyncIndex.from_timeline(timeline)
+        except (OSError, ValueError) as e:
+            if error_handler:
+                error_handler(f"Reading clip recording times failed: {e}")
+            return
+        if not sync_index.spans:
+            if error_handler:
+                error_handler("None of the clips has a creation time")
+            return
+
+        self.timeline = timeline
+        self.sync_index = sync_index
+        if success_handler:
+            success_handler()
+
+
+def parse_event_time(value):
+    """Parses "HH:MM[:SS]" into a time of day, or "YYYY-MM-DD HH:MM:SS" into a datetime."""
+    match = EVENT_PATTERN.match(value)
+    if not match:
+        raise ValueError(f"Unrecognised event time: {value}")
+    return _event_time(match.group(1), match.group(2))
+
+
+def _event_time(date, time_of_day):
+    if time_of_day.count(":") == 1:
+        time_of_day += ":00"
+    pattern = "%H:%M:%S.%f" if "." in time_of_day else "%H:%M:%S"
+    if date:
+        return datetime.strptime(f"{date} {time_of_day}", f"%Y-%m-%d {pattern}")
+    return datetime.strptime(time_of_day, pattern).time()
+
+
+def parse_schedule(text):
+    """Reads one event per line, a time followed by an optional name. Blank lines and # comments are skipped."""
+    events = []
+    for number, line in enumerate(text.splitlines(), 1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        match = EVENT_PATTERN.match(line)
+        if not match:
+            raise ValueError(f"Line {number}: unrecognised event time: {line}")
+        name = match.group(3).strip() or f"event_{len(events) + 1}"
+        events.append((_event_time(match.group(1), match.group(2)), name))
+    return events
@@ -1,13 +1,27 @@
 from datetime import datetime
 
-from PyQt5.QtWidgets import QDialog, QVBoxLayout, QHBoxLayout, QLabel, QLineEdit, QPushButton
+from PyQt5.QtCore import pyqtSignal
+from PyQt5.QtWidgets import QDialog, QVBoxLayout, QHBoxLayout, QLabel, QLineEdit, QPushButton, QPlainTextEdit, \
+    QSpinBox, QCheckBox
+
+from suggestions_dialog import RangeSuggestionsDialog
+from time_sync import DEFAULT_AFTER, DEFAULT_BEFORE, SyncIndexJob, parse_schedule
+from utils import parse_time
 
 
 class TimeUtilitiesDialog(QDialog):
-    def __init__(self, parent=None):
+    range_selected = pyqtSignal(str, str)
+
+    def __init__(self, parent=None, clip_dir=None, input_file=None, submit_job=None):
         super().__init__(parent)
         self.setWindowTitle("Time Utilities")
         self.setGeometry(100, 100, 400, 200)
+        self.clip_dir = clip_dir
+        self.input_file = input_file
+        # Runs a job on the main window's scheduler and returns its JobSignals
+        self.submit_job = submit_job
+        self.sync_index = None
+        self.timeline = None
 
         # Create widgets for time difference calculation
         self.actual_time_1_label = QLabel("Actual Time of Event 1 (HH:MM:SS):")
@@ -31,6 +45,23 @@ class TimeUtilitiesDialog(QDialog):
         self.seconds_output = QLineEdit()
         self.seconds_output.setReadOnly(True)
 
+        # Create widgets for mapping a schedule of real-world times onto the recording
+        self.schedule_label = QLabel("Event Schedule (one \"HH:MM:SS name\" per line):")
+        self.schedule_input = QPlainTextEdit()
+        self.before_label = QLabel("Seconds Before Each Event:")
+        self.before_input = QSpinBox()
+        self.before_input.setRange(0, 3600)
+        self.before_input.setValue(DEFAULT_BEFORE)
+        self.after_label = QLabel("Seconds After Each Event:")
+        self.after_input = QSpinBox()
+        self.after_input.setRange(0, 3600)
+        self.after_input.setValue(DEFAULT_AFTER)
+        self.calibrate_checkbox = QCheckBox("Correct Camera Clock with Event 1 and Recording Time 1")
+        self.find_events_button = QPushButton("Find Events in Recording")
+        self.find_events_button.clicked.connect(self.find_events)
+        self.schedule_status = QLabel()
+        self.schedule_status.setWordWrap(True)
+
         # Create layouts
         time_diff_layout = QVBoxLayout()
         time_diff_layout.addWidget(self.actual_time_1_label)
@@ -50,9 +81,21 @@ class TimeUtilitiesDialog(QDialog):
         time_to_seconds_layout.addWidget(self.seconds_output_label)
         time_to_seconds_layout.addWidget(self.seconds_output)
 
+        schedule_layout = QVBoxLayout()
+        schedule_layout.addWidget(self.schedule_label)
+        schedule_layout.addWidget(self.schedule_input)
+        schedule_layout.addWidget(self.before_label)
+        schedule_layout.addWidget(self.before_input)
+        schedule_layout.addWidget(self.after_label)
+        schedule_layout.addWidget(self.after_input)
+        schedule_layout.addWidget(self.calibrate_checkbox)
+        schedule_layout.addWidget(self.find_events_button)
+        schedule_layout.addWidget(self.schedule_status)
+
         main_layout = QHBoxLayout()
         main_layout.addLayout(time_diff_layout)
         main_layout.addLayout(time_to_seconds_layout)
+        main_layout.addLayout(schedule_layout)
 
         self.setLayout(main_layout)
 
@@ -80,6 +123,61 @@ class TimeUtilitiesDialog(QDialog):
             self.seconds_output.setText("Invalid time format")
 
 
+    def load_sync_index(self, events):
+        """Probes the clips on the scheduler, off the GUI thread, and finds the events once that is done."""
+        job = SyncIndexJob(clip_dir=self.clip_dir, input_file=self.input_file)
+        self.find_events_button.setEnabled(False)
+        self.schedule_status.setText("Reading clip recording times..")
+        signals = self.submit_job(job, "Time sync")
+
+        def sync_index_loaded(success, message):
+            self.find_events_button.setEnabled(True)
+            if not success:
+                self.schedule_status.setText(message)
+                return
+            self.timeline = job.timeline
+            self.sync_index = job.sync_index
+            self.show_events(events)
+
+        signals.finished.connect(sync_index_loaded)
+
+    def find_events(self):
+        try:
+            events = parse_schedule(self.schedule_input.toPlainText())
+        except ValueError as e:
+            self.schedule_status.setText(str(e))
+            return
+        if self.sync_index is None:
+            self.load_sync_index(events)
+        else:
+            self.show_events(events)
+
+    def show_events(self, events):
+        sync_index = self.sync_index
+        try:
+            if self.calibrate_checkbox.isChecked():
+                actual_time = datetime.strptime(self.actual_time_1_input.text(), "%H:%M:%S").time()
+                sync_index.calibrate(actual_time, parse_time(self.recording_time_1_input.text()))
+            else:
+                sync_index.clock_offset = 0
+            highlights, missed = sync_index.event_ranges(events, self.before_input.value(), self.after_input.value(),
+                                                         self.timeline.total_duration)
+        except ValueError as e:
+            self.schedule_status.setText(str(e))
+            return
+
+        status = f"Found {len(highlights)} of {len(events)} events"
+        if sync_index.clock_offset:
+            status += f", camera clock {sync_index.clock_offset:+.1f} s"
+        if missed:
+            status += f". Not recorded: {', '.join(missed)}"
+        self.schedule_status.setText(status)
+        if highlights:
+            dialog = RangeSuggestionsDialog(highlights, "Scheduled Events", self)
+            dialog.range_selected.connect(self.range_selected.emit)
+            dialog.show()
+
+
 class TimeLineEdit(QLineEdit):
     def __init__(self, parent=None):
         super().__init__(parent)
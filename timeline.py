@@ -0,0 +1,117 @@
+import bisect
+import os
+
+from probe_service import get_probe_service
+
+
+def list_clips(clip_dir):
+    clips = []
+    for file in sorted(os.listdir(clip_dir)):
+        if (file.endswith(".mp4") or file.endswith(".MP4")) and not file.startswith("."):
+            file_path = os.path.join(clip_dir, file)
+            if os.path.getsize(file_path) > 0:
+                clips.append(file_path)
+    return clips
+
+
+def escape_concat_path(path):
+    # The concat demuxer reads single-quoted strings, so embedded quotes must be closed and escaped
+    return path.replace("'", "'\\''")
+
+
+class ClipSegment:
+    def __init__(self, path, inpoint, outpoint, clip_duration):
+        self.path = path
+        self.inpoint = inpoint
+        self.outpoint = outpoint
+        self.clip_duration = clip_duration
+
+    @property
+    def duration(self):
+        return self.outpoint - self.inpoint
+
+    @property
+    def is_whole_clip(self):
+        return self.inpoint <= 0 and self.outpoint >= self.clip_duration
+
+    def __repr__(self):
+        return f"ClipSegment({self.path!r}, {self.inpoint:.3f}, {self.outpoint:.3f})"
+
+
+class Timeline:
+    """Maps positions on the virtual concatenation of a clip set onto the clips that cover them."""
+
+    def __init__(self, clips):
+        # clips is a list of (path, duration) tuples in playback order
+        self.clips = list(clips)
+        self._offsets = []
+        offset = 0
+        for _, duration in self.clips:
+            self._offsets.append(offset)
+            offset += duration
+        self.total_duration = offset
+
+    @classmethod
+    def from_directory(cls, clip_dir):
+        return cls.from_files(list_clips(clip_dir))
+
+    @classmethod
+    def from_files(cls, clip_paths):
+        durations = get_probe_service().durations(clip_paths)
+        return cls([(file_path, duration or 0) for file_path, duration in zip(clip_paths, durations)])
+
+    def clip_start(self, index):
+        return self._offsets[index]
+
+    def locate(self, position):
+        """Returns (clip index, offset within clip) for a global position in seconds."""
+        if not self.clips:
+            raise ValueError("Timeline has no clips")
+        position = min(max(position, 0), self.total_duration)
+        index = max(bisect.bisect_right(self._offsets, position) - 1, 0)
+        # Positions landing exactly on a boundary belong to the next non-empty clip
+        while index < len(self.clips) - 1 and position - self._offsets[index] >= self.clips[index][1]:
+            index += 1
+        return index, position - self._offsets[index]
+
+    def segments(self, start=0, end=None):
+        if end is None or end > self.total_duration:
+            end = self.total_duration
+        start = max(start, 0)
+        if not self.clips or end <= start:
+            return []
+
+        segments = []
+        first_index, _ = self.locate(start)
+        for index in range(first_index, len(self.clips)):
+            clip_start = self._offsets[index]
+            path, duration = self.clips[index]
+            if clip_start >= end:
+                break
+            inpoint = max(start - clip_start, 0)
+            outpoint = min(end - clip_start, duration)
+            if outpoint > inpoint:
+                segments.append(ClipSegment(path, inpoint, outpoint, duration))
+        return segments
+
+    def write_filelist(self, filelist_path, start=0, end=None):
+        """Writes a concat demuxer list covering [start, end) and returns its duration in seconds."""
+        if start <= 0 and end is None:
+            segments = [ClipSegment(path, 0, duration, duration) for path, duration in self.clips]
+        else:
+            segments = self.segments(start, end)
+        return write_segment_filelist(filelist_path, segments)
+
+
+def write_segment_filelist(filelist_path, segments):
+    # The concat demuxer resolves relative paths against the list's directory, not the working directory
+    total_duration = 0
+    with open(filelist_path, "w") as filelist:
+        for segment in segments:
+            filelist.write(f"file '{escape_concat_path(os.path.abspath(segment.path))}'\n")
+            if segment.inpoint > 0:
+                filelist.write(f"inpoint {segment.inpoint:.6f}\n")
+            if segment.outpoint < segment.clip_duration:
+                filelist.write(f"outpoint {segment.outpoint:.6f}\n")
+            total_duration += segment.duration
+    return total_duration
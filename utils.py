@@ -1,3 +1,7 @@
+import os
+import sys
+
+
 def format_eta(eta):
     if eta is None:
         return "N/A"
@@ -13,4 +17,35 @@ def format_eta(eta):
         elif minutes > 0:
             return f"{minutes}m {seconds:.1f}s"
         else:
-            return f"{seconds:.1f} seconds"
\ No newline at end of file
+            return f"{seconds:.1f} seconds"
+
+def parse_time(time_str):
+    """Converts a HH:MM:SS or MM:SS or SS format string into total seconds as float."""
+    parts = time_str.split(':')
+    if len(parts) == 3:
+        hours, minutes, seconds = map(float, parts)
+        return hours * 3600 + minutes * 60 + seconds
+    elif len(parts) == 2:
+        minutes, seconds = map(float, parts)
+        return minutes * 60 + seconds
+    else:
+        return float(parts[0])
+
+
+def format_time(seconds):
+    """Formats seconds as HH:MM:SS, the format the time fields use."""
+    seconds = max(int(seconds), 0)
+    return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
+def get_cache_dir():
+    if sys.platform.startswith('win32'):
+        base_path = os.environ.get('LOCALAPPDATA', os.path.expanduser('~'))
+    elif sys.platform.startswith('darwin'):
+        base_path = os.path.join(os.path.expanduser('~'), 'Library', 'Caches')
+    else:
+        base_path = os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache'))
+
+    cache_dir = os.path.join(base_path, 'EventVideoTool')
+    os.makedirs(cache_dir, exist_ok=True)
+    return cache_dir
@@ -0,0 +1,149 @@
+import os
+import threading
+import time
+
+from jobs import ConcatJob
+from probe_service import get_probe_service
+from timeline import list_clips
+
+DEFAULT_POLL_INTERVAL = 2
+# A clip counts as copied once its size and mtime have not changed for this long, a concat waits as long for the folder
+DEFAULT_SETTLE_TIME = 5
+
+
+class FolderWatcher:
+    """Watches a clip folder while cards are being copied into it and keeps the concatenated output up to date.
+
+    Clips are probed as soon as they finish copying, so ingest overlaps with offloading the rest of the card. A concat
+    is queued once the whole folder has been quiet for the settle time. The output is fragmented MP4 that is left
+    unfinalized, so each later batch of clips is appended to it instead of rewriting it.
+    """
+
+    def __init__(self, clip_dir, output_file, scheduler, poll_interval=DEFAULT_POLL_INTERVAL,
+                 settle_time=DEFAULT_SETTLE_TIME, scratch_dir=None, progress_handler=None, success_handler=None,
+                 error_handler=None, message_handler=None):
+        self.clip_dir = clip_dir
+        self.output_file = output_file
+        self.scratch_dir = scratch_dir
+        self.scheduler = scheduler
+        self.poll_interval = poll_interval
+        self.settle_time = settle_time
+        self._handlers = {
+            "progress_handler": progress_handler,
+            "success_handler": success_handler,
+            "error_handler": error_handler,
+            "message_handler": message_handler,
+        }
+
+        self._states = {}  # path: ((size, mtime_ns), time the state was first seen)
+        self._changed_at = None  # when a clip last appeared, changed or disappeared
+        self._settled = set()
+        self._ready = []
+        self._submitted = None  # clips of the last concat that was queued
+        self._failed_states = None  # states of the clips of the last concat that failed or was cancelled
+        self._active = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    @property
+    def ready_clips(self):
+        return list(self._ready)
+
+    def start(self):
+        if self.running:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._watch, name="folder-watcher", daemon=True)
+        self._thread.start()
+        self._notify(f"Watching {self.clip_dir} for new clips..")
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        self._thread = None
+
+    def _watch(self):
+        while not self._stop.is_set():
+            try:
+                self.poll()
+            except OSError as e:
+                print(f"Watching {self.clip_dir} failed: {e}")
+            self._stop.wait(self.poll_interval)
+
+    def poll(self):
+        """Checks the folder once, probes newly finished clips and queues a concat once the folder is quiet."""
+        now = time.monotonic()
+        newly_settled = []
+        output_path = os.path.abspath(self.output_file)
+        listed = []
+        for path in list_clips(self.clip_dir):
+            if os.path.abspath(path) == output_path:
+                continue
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue  # Moved or deleted since it was listed
+            listed.append(path)
+            state = (stat.st_size, stat.st_mtime_ns)
+
+            previous = self._states.get(path)
+            if previous is None or previous[0] != state:
+                self._states[path] = (state, now)
+                self._settled.discard(path)
+                self._changed_at = now
+                continue
+            if now - previous[1] >= self.settle_time and path not in self._settled:
+                self._settled.add(path)
+                newly_settled.append(path)
+
+        for path in set(self._states) - set(listed):
+            del self._states[path]
+            self._settled.discard(path)
+            self._changed_at = now
+
+        if newly_settled:
+            self._notify(f"{len(newly_settled)} new clips finished copying")
+            get_probe_service().probe_many(newly_settled)
+
+        # Every concat rewrites or appends to the output, so one is queued per batch of clips instead of per clip
+        quiet = self._changed_at is not None and now - self._changed_at >= self.settle_time
+        ready = listed if quiet else []
+        self._ready = ready
+
+        if not ready or ready == self._submitted:
+            return
+        if self._active is not None and not self._active.done:
+            return  # The next poll picks up whatever arrived in the meantime
+        states = [(path, self._states[path][0]) for path in ready]
+        if states == self._failed_states:
+            return  # Nothing changed since the last attempt failed, it would only fail again
+
+        self._submitted = ready
+        self._failed_states = None
+        job = ConcatJob(self.clip_dir, self.output_file, clip_paths=ready, scratch_dir=self.scratch_dir,
+                        fragmented=True, finalize=False)
+
+        def handle_error(message="Failed"):
+            self._handle_error(ready, states, message)
+
+        handlers = dict(self._handlers, error_handler=handle_error)
+        self._active = self.scheduler.submit(job, name="Watch concat", **handlers)
+
+    def _handle_error(self, clips, states, message):
+        # A clip that looked copied may still have been written to, it is tried again once it changes
+        if self._submitted is clips:
+            self._submitted = None
+            self._failed_states = states
+        if self._handlers["error_handler"]:
+            self._handlers["error_handler"](message)
+
+    def _notify(self, message):
+        if self._handlers["message_handler"]:
+            self._handlers["message_handler"](message)
+        else:
+            print(message)